@@ -0,0 +1,84 @@
+"""
+網格價位產生器的微基準測試
+
+比較原本 _grid_v2_lab_2_impl 的逐層迴圈 (math.floor/ceil + format + get_grid_quantity)
+與 trade.ladder 的向量化版本，並確認兩者價格一致。
+
+    cd mysite
+    python benchmarks/bench_ladder.py
+"""
+import math
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from trade.ladder import build_ladder  # noqa: E402
+
+BASE_PRICE = 0.38457
+STEP_RATE = 0.005
+TICK_SIZE = 0.00001
+PRICE_PRECISION = 5
+QUANTITY_PRECISION = 0
+MIN_NOTIONAL = 5.0
+BUDGET = 1000 * 0.003 * 10
+
+
+def format_decimal(value, digit):
+    return ("{:." + str(digit) + "f}").format(value)
+
+
+def legacy_quantity(price):
+    quantity_by_balance = BUDGET / price
+    quantity_by_min_notional = int(MIN_NOTIONAL / float(price)) + 1
+    return format_decimal(max(quantity_by_min_notional, quantity_by_balance), QUANTITY_PRECISION)
+
+
+def legacy_ladder(depth):
+    orders = []
+    for i in range(depth):
+        raw_price = BASE_PRICE * (1 - STEP_RATE) ** (i + 1)
+        price = math.floor(raw_price / TICK_SIZE) * TICK_SIZE
+        orders.append(('BUY', format_decimal(price, PRICE_PRECISION), legacy_quantity(price)))
+    for i in range(depth):
+        raw_price = BASE_PRICE * (1 + STEP_RATE) ** (i + 1)
+        price = math.ceil(raw_price / TICK_SIZE) * TICK_SIZE
+        orders.append(('SELL', format_decimal(price, PRICE_PRECISION), legacy_quantity(price)))
+    return orders
+
+
+def vectorized_ladder(depth):
+    return build_ladder(
+        base_price=BASE_PRICE,
+        depth=depth,
+        step_rate=STEP_RATE,
+        tick_size=TICK_SIZE,
+        price_precision=PRICE_PRECISION,
+        quantity_precision=QUANTITY_PRECISION,
+        buy_budget=BUDGET,
+        sell_budget=BUDGET,
+        min_notional=MIN_NOTIONAL
+    )
+
+
+def price_mismatches(depth):
+    """原本的 float floor/ceil 可能差一個 tick，列出與整數 tick 版本不同的價位數"""
+    legacy = [price for _, price, _ in legacy_ladder(depth)]
+    ladder = vectorized_ladder(depth)
+    vectorized = ladder.buy_prices + ladder.sell_prices
+    return sum(1 for a, b in zip(legacy, vectorized) if a != b)
+
+
+def main():
+    print(f"{'N':>5} {'legacy (µs)':>12} {'numpy (µs)':>12} {'speedup':>8} {'price diff':>10}")
+    for depth in (10, 25, 50, 100, 250, 500):
+        number = max(20, 20000 // depth)
+        legacy = min(timeit.repeat(lambda: legacy_ladder(depth), number=number, repeat=5)) / number
+        vectorized = min(timeit.repeat(lambda: vectorized_ladder(depth), number=number, repeat=5)) / number
+        print(f"{depth:>5} {legacy * 1e6:>12.1f} {vectorized * 1e6:>12.1f} {legacy / vectorized:>7.1f}x "
+              f"{price_mismatches(depth):>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+webhook 壓力測試
+
+以固定速率送出合成的 TradingView 警報，統計回應延遲分佈。
+非同步端點需在 ASGI 伺服器下執行才有意義，例如:
+
+    uvicorn mysite.asgi:application --port 8000
+    python benchmarks/webhook_load.py --url http://127.0.0.1:8000/trade/webhook/async --rate 1000 --duration 10
+
+警報使用不存在的 passphrase，派發後只會記錄「找不到策略」，不會下單。
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import aiohttp
+
+
+def build_alert(index):
+    """產生第 index 筆警報，time 欄位遞增避免被去重"""
+    return json.dumps({
+        'passphrase': 'benchmark',
+        'ticker': 'BTCUSDT',
+        'type': 'swing',
+        'entry': '50000',
+        'position_size': '0',
+        'order': 'buy',
+        'unit': '0.001',
+        'time': str(index),
+        'message': json.dumps({'type': 'long_entry', 'lev': '1', 'sl': '1', 'eq': '1'}),
+    })
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+async def send_alert(session, url, body, latencies, errors):
+    started = time.perf_counter()
+    try:
+        async with session.post(url, data=body, headers={'Content-Type': 'text/plain'}) as response:
+            await response.read()
+            if response.status != 200:
+                errors.append(response.status)
+                return
+    except aiohttp.ClientError as e:
+        errors.append(type(e).__name__)
+        return
+    latencies.append(time.perf_counter() - started)
+
+
+async def run(url, rate, duration, concurrency):
+    total = int(rate * duration)
+    interval = 1.0 / rate
+    latencies = []
+    errors = []
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        tasks = []
+        started = time.perf_counter()
+        for i in range(total):
+            # 依排程時間送出，落後時不補睡，讓實際速率反映伺服器能力
+            delay = started + i * interval - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.ensure_future(send_alert(session, url, build_alert(i), latencies, errors)))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    print(f"送出: {total}  成功: {len(latencies)}  失敗: {len(errors)}  耗時: {elapsed:.2f}s  "
+          f"實際速率: {total / elapsed:.0f}/s")
+    for pct in (50, 90, 95, 99, 99.9):
+        print(f"p{pct}: {percentile(latencies, pct) * 1000:.2f}ms")
+    if latencies:
+        print(f"max: {latencies[-1] * 1000:.2f}ms")
+    if errors:
+        print(f"錯誤樣本: {errors[:10]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='webhook 壓力測試')
+    parser.add_argument('--url', default='http://127.0.0.1:8000/trade/webhook/async')
+    parser.add_argument('--rate', type=float, default=1000, help='每秒警報數量')
+    parser.add_argument('--duration', type=float, default=10, help='持續秒數')
+    parser.add_argument('--concurrency', type=int, default=200, help='最大同時連線數')
+    args = parser.parse_args()
+    asyncio.run(run(args.url, args.rate, args.duration, args.concurrency))
+
+
+if __name__ == '__main__':
+    main()
@@ -6,7 +6,7 @@ from django.http import HttpResponse, JsonResponse
 from social_core.actions import do_auth
 from trade.utils import get_monthly_rotating_logger, get_all_future_open_order, get_strategy_by_symbol, grid_v2_lab_2, get_active_grid_v2_symbols
 from trade.utils import get_main_account_info
-from binance import Client
+from trade.exchange import get_client, rate_limit_governor, LOW
 from django.views.decorators.http import require_POST
 import os
 from trade.models import Strategy
@@ -61,7 +61,7 @@ def trading_status(request):
     try:
         main_account = get_main_account_info()
         if main_account:
-            client = Client(main_account.api_key, main_account.api_secret)
+            client = get_client(main_account.api_key, main_account.api_secret)
             
             # 獲取 grid_v2 且 ACTIVE 的策略
             v2_symbols = get_active_grid_v2_symbols()
@@ -70,8 +70,9 @@ def trading_status(request):
                 status='ACTIVE'
             )
             
-            # 獲取所有掛單
-            open_orders = get_all_future_open_order(client)
+            # 獲取所有掛單，儀表板查詢排在下單之後
+            with rate_limit_governor.priority(LOW):
+                open_orders = get_all_future_open_order(client)
             
             # 轉換 open_orders 格式為字典
             orders_dict = {}
@@ -113,7 +114,7 @@ def execute_grid_v2_view(request, symbol):
     try:
         main_account = get_main_account_info()
         if main_account:
-            client = Client(main_account.api_key, main_account.api_secret)
+            client = get_client(main_account.api_key, main_account.api_secret)
             
             # 從 strategy model 中取得對應的 strategy
             strategy = get_strategy_by_symbol(symbol)
@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/4.0/ref/settings/
 from pathlib import Path
 import os
 from dotenv import load_dotenv, find_dotenv
+from django.utils.deprecation import MiddlewareMixin
 
 load_dotenv(find_dotenv())
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -208,12 +209,9 @@ SOCIAL_AUTH_REDIRECT_IS_HTTPS = True
 SECURE_SSL_REDIRECT = False
 
 # 添加中間件來處理特定路徑的 HTTPS 重定向
-class SSLRedirectMiddleware:
-    def __init__(self, get_response):
-        self.get_response = get_response
-
-    def __call__(self, request):
+# 繼承 MiddlewareMixin 同時支援同步與非同步，ASGI 下非同步 view 不會被切到執行緒中執行
+class SSLRedirectMiddleware(MiddlewareMixin):
+    def process_request(self, request):
         if request.path.startswith('/dashboard/'):
             request.is_secure = lambda: True
-        return self.get_response(request)
 
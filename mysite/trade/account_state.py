@@ -0,0 +1,369 @@
+import logging
+import threading
+
+from .market_data import mark_price_cache
+from .metrics import metrics
+from .models import AccountBalance
+
+logger = logging.getLogger('trade')
+
+account_events_total = metrics.counter('account_events_total', '帳戶狀態事件數量', ('event',))
+account_reconcile_total = metrics.counter('account_reconcile_total', '帳戶狀態與 REST 對帳次數', ('result',))
+balance_write_behind_pending = metrics.gauge('balance_write_behind_pending', '尚未寫入資料庫的 AccountBalance 數量')
+
+
+def _derived_fields(position, mark_from_pnl=True):
+    """
+    推算起始保證金，串流事件另由數量、均價與未實現盈虧推算標記價格
+
+    Args:
+        position: 持倉 dict，就地更新
+        mark_from_pnl: 是否以 entryPrice + unRealizedProfit / positionAmt 更新 markPrice
+    """
+    amount = float(position['positionAmt'])
+    if amount and mark_from_pnl:
+        position['markPrice'] = str(float(position['entryPrice']) + float(position['unRealizedProfit']) / amount)
+    leverage = float(position.get('leverage') or 1)
+    position['initialMargin'] = str(abs(amount) * float(position['markPrice']) / leverage)
+
+
+def _repriced(position):
+    """
+    以標記價格串流重新計算持倉的標記價格、未實現盈虧與起始保證金
+
+    ACCOUNT_UPDATE 只帶有變動持倉的 up，其他持倉的值停留在最後一次事件，讀取時以最新標記價格推算。
+
+    Args:
+        position: 持倉 dict 副本，就地更新
+
+    Returns:
+        bool: 有持倉但沒有未過期的標記價格時返回 False
+    """
+    amount = float(position['positionAmt'])
+    if not amount:
+        return True
+    mark = mark_price_cache.lookup(position['symbol'])
+    if mark is None:
+        return False
+    position['markPrice'] = str(mark.mark_price)
+    position['unRealizedProfit'] = str((mark.mark_price - float(position['entryPrice'])) * amount)
+    _derived_fields(position, mark_from_pnl=False)
+    return True
+
+
+class AccountTracker:
+    """
+    單一帳戶的持倉與錢包狀態
+
+    以 REST 載入一次 (futures_position_information + futures_account)，之後套用 user data stream 的
+    ACCOUNT_UPDATE (持倉與錢包變動) 與 ACCOUNT_CONFIG_UPDATE (槓桿變動)。
+    持倉格式與 futures_position_information 相同 (另含 initialMargin)，依 symbol 為鍵，只追蹤單向持倉 (BOTH)。
+    - 依事件的撮合時間 T 忽略比目前狀態舊的更新
+    - 載入期間收到的事件暫存，快照安裝後重新套用
+    - 串流不提供強平價格，該欄位維持最近一次 REST 載入的值
+    - 讀取時以標記價格串流重新計算 markPrice / unRealizedProfit，事件只帶有變動持倉的未實現盈虧
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._positions = {}
+        self._wallets = {}
+        self._loading = 0
+        self._buffer = []
+        self._ready = False
+        self.events = 0
+        self.mismatches = 0
+
+    def _apply_position_locked(self, symbol, fields, update_time):
+        position = self._positions.get(symbol)
+        if position is None:
+            position = self._positions[symbol] = {'symbol': symbol, 'positionSide': 'BOTH', 'leverage': '1',
+                                                  'liquidationPrice': '0', 'markPrice': '0', 'updateTime': 0}
+        if int(position.get('updateTime') or 0) > update_time:
+            return
+        position.update(fields)
+        position['updateTime'] = update_time
+        _derived_fields(position)
+
+    def _apply_locked(self, msg):
+        update_time = int(msg.get('T') or msg.get('E') or 0)
+        if msg['e'] == 'ACCOUNT_UPDATE':
+            data = msg['a']
+            for wallet in data.get('B', []):
+                self._wallets[wallet['a']] = {
+                    'walletBalance': wallet['wb'],
+                    'crossWalletBalance': wallet['cw'],
+                    'updateTime': update_time,
+                }
+            for item in data.get('P', []):
+                if item.get('ps', 'BOTH') != 'BOTH':
+                    continue
+                self._apply_position_locked(item['s'], {
+                    'positionAmt': item['pa'],
+                    'entryPrice': item['ep'],
+                    'breakEvenPrice': item.get('bep', '0'),
+                    'unRealizedProfit': item['up'],
+                    'marginType': item['mt'],
+                    'isolated': item['mt'] == 'isolated',
+                    'isolatedWallet': item.get('iw', '0'),
+                }, update_time)
+        elif msg['e'] == 'ACCOUNT_CONFIG_UPDATE' and 'ac' in msg:
+            position = self._positions.get(msg['ac']['s'])
+            if position is not None:
+                position['leverage'] = str(msg['ac']['l'])
+                _derived_fields(position, mark_from_pnl=False)
+
+    def apply_event(self, msg):
+        """套用 user data stream 事件，只處理 ACCOUNT_UPDATE 與 ACCOUNT_CONFIG_UPDATE"""
+        if msg.get('e') not in ('ACCOUNT_UPDATE', 'ACCOUNT_CONFIG_UPDATE'):
+            return
+        account_events_total.inc(msg['e'])
+        with self._lock:
+            self.events += 1
+            if self._loading:
+                self._buffer.append(msg)
+            self._apply_locked(msg)
+
+    def invalidate(self):
+        """事件可能遺漏時 (例如 WebSocket 重連) 標記需要重新載入"""
+        with self._lock:
+            self._ready = False
+
+    def is_ready(self):
+        with self._lock:
+            return self._ready
+
+    def load(self, client):
+        """
+        以 REST 載入持倉與錢包
+
+        Args:
+            client: 此帳戶的 Binance client
+
+        Returns:
+            bool: 載入前的持倉數量是否與 REST 一致 (首次載入返回 True)
+        """
+        with self._lock:
+            self._loading += 1
+        try:
+            positions = client.futures_position_information()
+            account = client.futures_account()
+        except Exception:
+            with self._lock:
+                self._loading -= 1
+                if not self._loading:
+                    self._buffer = []
+            raise
+
+        with self._lock:
+            was_ready = self._ready
+            before = {symbol: float(p['positionAmt']) for symbol, p in self._positions.items()
+                      if float(p['positionAmt'])}
+            snapshot = {}
+            for position in positions:
+                if position.get('positionSide', 'BOTH') != 'BOTH':
+                    continue
+                position = dict(position)
+                position['updateTime'] = int(position.get('updateTime') or 0)
+                _derived_fields(position, mark_from_pnl=False)
+                snapshot[position['symbol']] = position
+            self._positions = snapshot
+            self._wallets = {
+                asset['asset']: {
+                    'walletBalance': asset['walletBalance'],
+                    'crossWalletBalance': asset['crossWalletBalance'],
+                    'updateTime': int(asset.get('updateTime') or 0),
+                }
+                for asset in account.get('assets', [])
+            }
+            for msg in self._buffer:
+                self._apply_locked(msg)
+            self._loading -= 1
+            if not self._loading:
+                self._buffer = []
+            self._ready = True
+            after = {symbol: float(p['positionAmt']) for symbol, p in self._positions.items()
+                     if float(p['positionAmt'])}
+            matched = not was_ready or before == after
+            if not matched:
+                self.mismatches += 1
+            return matched
+
+    def reconcile(self, client):
+        """與 REST 比對持倉數量，不一致時以 REST 快照取代並記錄"""
+        try:
+            matched = self.load(client)
+        except Exception as e:
+            account_reconcile_total.inc('error')
+            logger.error(f"帳戶 {self.name} 持倉對帳時發生錯誤: {str(e)}")
+            return False
+        account_reconcile_total.inc('match' if matched else 'mismatch')
+        if not matched:
+            logger.warning(f"帳戶 {self.name} 本地持倉與 REST 不一致，已以 REST 快照取代")
+        return matched
+
+    def get_position(self, symbol):
+        """取得單一交易對持倉副本，沒有資料返回 None"""
+        with self._lock:
+            position = self._positions.get(symbol)
+            position = dict(position) if position is not None else None
+        if position is not None:
+            _repriced(position)
+        return position
+
+    def get_positions(self, require_mark=False):
+        """
+        取得所有交易對持倉副本 (含數量為 0 者)
+
+        Args:
+            require_mark: 有持倉的交易對缺少未過期的標記價格時返回 None，由呼叫端改用 REST
+
+        Returns:
+            list[dict]: 持倉列表
+        """
+        with self._lock:
+            positions = [dict(position) for position in self._positions.values()]
+        for position in positions:
+            if not _repriced(position) and require_mark:
+                return None
+        return positions
+
+    def position_amount(self, symbol):
+        """取得持倉數量，沒有資料返回 None"""
+        with self._lock:
+            position = self._positions.get(symbol)
+            return float(position['positionAmt']) if position is not None else None
+
+    def wallet_balance(self, asset='USDT'):
+        """取得錢包餘額，沒有資料返回 None"""
+        with self._lock:
+            wallet = self._wallets.get(asset)
+            return float(wallet['walletBalance']) if wallet is not None else None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'ready': self._ready,
+                'positions': sum(1 for p in self._positions.values() if float(p['positionAmt'])),
+                'events': self.events,
+                'mismatches': self.mismatches,
+            }
+
+
+class AccountTrackerRegistry:
+    """
+    依 API key 管理各帳戶的 AccountTracker
+
+    只有訂閱 user data stream 的帳戶會註冊，其他帳戶查詢時返回 None，由呼叫端改用 REST。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._trackers = {}
+
+    def register(self, api_key, name=None):
+        """取得或建立帳戶的 tracker"""
+        with self._lock:
+            tracker = self._trackers.get(api_key)
+            if tracker is None:
+                tracker = self._trackers[api_key] = AccountTracker(name or f"{api_key[:6]}...")
+            return tracker
+
+    def get(self, api_key):
+        return self._trackers.get(api_key)
+
+    def ready_for(self, client):
+        """
+        取得 client 所屬帳戶的 tracker，尚未載入時先以 REST 載入
+
+        Returns:
+            AccountTracker: 未註冊或載入失敗返回 None
+        """
+        tracker = self._trackers.get(getattr(client, 'API_KEY', None))
+        if tracker is None:
+            return None
+        if not tracker.is_ready():
+            try:
+                tracker.load(client)
+            except Exception as e:
+                logger.error(f"載入帳戶 {tracker.name} 持倉時發生錯誤: {str(e)}")
+                return None
+        return tracker
+
+    def stats(self):
+        with self._lock:
+            return {tracker.name: tracker.stats() for tracker in self._trackers.values()}
+
+
+account_trackers = AccountTrackerRegistry()
+
+
+class BalanceWriteBehind:
+    """
+    延遲批次寫入 AccountBalance
+
+    呼叫端修改 AccountBalance 副本並以 strategy_registry.update_balance() 套用到快取 (讀取端立即看到新值)，
+    再交由此處在 delay 秒後以一次 bulk_update 寫入資料庫；同一筆在視窗內多次修改只寫入一次。
+    尚未寫入的欄位比資料庫新，registry 重新載入或收到其他 save() 時以 overlay() / pending_fields() 保留。
+    """
+
+    def __init__(self, fields, delay=2.0):
+        """
+        Args:
+            fields: bulk_update 的欄位
+            delay: 延遲寫入秒數
+        """
+        self._fields = list(fields)
+        self._delay = delay
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._timer = None
+        balance_write_behind_pending.set_function(lambda: len(self._pending))
+
+    def schedule(self, balances):
+        with self._lock:
+            for balance in balances:
+                self._pending[balance.pk] = balance
+            if self._pending and self._timer is None:
+                self._timer = threading.Timer(self._delay, self.flush)
+                self._timer.daemon = True
+                self._timer.name = "BalanceWriteBehind"
+                self._timer.start()
+
+    @property
+    def fields(self):
+        return tuple(self._fields)
+
+    def pending_fields(self, pk):
+        """此筆記錄尚未寫入的欄位，沒有待寫入時返回空 tuple"""
+        with self._lock:
+            return tuple(self._fields) if pk in self._pending else ()
+
+    def overlay(self, balance):
+        """將尚未寫入的欄位值套用到 balance"""
+        with self._lock:
+            pending = self._pending.get(balance.pk)
+            if pending is None or pending is balance:
+                return
+            for name in self._fields:
+                setattr(balance, name, getattr(pending, name))
+
+    def flush(self):
+        """立即寫入所有待寫入的 AccountBalance"""
+        with self._lock:
+            balances = list(self._pending.values())
+            self._pending = {}
+            self._timer = None
+        if not balances:
+            return
+        try:
+            AccountBalance.objects.bulk_update(balances, self._fields)
+        except Exception as e:
+            logger.error(f"寫入 AccountBalance 失敗，將於下次重試: {str(e)}")
+            self.schedule(balances)
+
+
+balance_write_behind = BalanceWriteBehind(
+    ['used_margin', 'unrealized_pnl', 'position_value', 'position_amount']
+)
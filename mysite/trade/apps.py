@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class TradeConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'trade'
+
+    def ready(self):
+        from .registry import connect_signals
+        connect_signals()
@@ -0,0 +1,73 @@
+import logging
+
+logger = logging.getLogger('trade')
+
+_ENTRY_TYPES = ('long_entry', 'short_entry')
+_EXIT_TYPES = ('long_exit', 'short_exit')
+
+
+def _coalesce_swing(indexed):
+    """
+    波段策略: 連續的進場只保留最後一筆，出場一律保留
+
+    進場會依當下持倉平掉或反轉反向倉位，後到的進場同樣會這麼做，因此連續進場中較早的可以略過；
+    出場負責平倉、將策略設為 INACTIVE 並記錄 EXIT 與盈虧，且先前是否有持倉在此無法得知，
+    所以出場以及出場前的進場都不合併。
+    """
+    collapsed = []
+    pending_entry = None
+    for index, notification in indexed:
+        message_type = notification.message_type
+        if message_type in _ENTRY_TYPES:
+            if pending_entry is not None:
+                collapsed.append((pending_entry[0], f"superseded by later {message_type}"))
+            pending_entry = (index, message_type)
+        else:
+            # 出場或其他訊號之前的進場必須照順序執行
+            pending_entry = None
+    return collapsed
+
+
+def _coalesce_grid_v2(indexed):
+    """
+    網格 v2: 每筆通知只會以 lower_bound/upper_bound 更新網格價格，只需保留最後一筆帶有上下界的通知
+
+    缺少上下界的通知在 handler 中直接返回，不能取代先前有效的通知；全部都缺少時保留最後一筆照常記錄。
+    """
+    with_bounds = [index for index, notification in indexed
+                   if notification.lower_bound is not None and notification.upper_bound is not None]
+    keep = with_bounds[-1] if with_bounds else indexed[-1][0]
+    return [(index, "superseded by later grid bounds") for index, _ in indexed if index != keep]
+
+
+_COALESCERS = {
+    'swing': _coalesce_swing,
+    'grid_v2': _coalesce_grid_v2,
+}
+
+
+def coalesce_notifications(notifications):
+    """
+    將同一策略/交易對積壓的通知合併為最少的有效動作
+
+    Args:
+        notifications: 同一分片鍵、依到達順序排列的 Notification 列表
+
+    Returns:
+        list[tuple]: 被合併略過的 [(index, reason), ...]
+    """
+    by_type = {}
+    for index, notification in enumerate(notifications):
+        by_type.setdefault(notification.strategy_type, []).append((index, notification))
+
+    collapsed = []
+    for strategy_type, indexed in by_type.items():
+        coalescer = _COALESCERS.get(strategy_type)
+        if coalescer is not None and len(indexed) > 1:
+            collapsed.extend(coalescer(indexed))
+    return collapsed
+
+
+def audit_collapsed_notification(notification, reason):
+    """記錄被合併略過的通知"""
+    logger.info(f"coalesced signal ({reason}): {notification.raw}")
@@ -0,0 +1,74 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+def notification_fingerprint(notification):
+    """
+    產生通知的穩定雜湊值
+
+    以 (passphrase, ticker, type, entry, position_size, bar time) 為鍵，
+    TradingView 重送或重複觸發的同一則警報會得到相同結果。
+    """
+    parts = (
+        notification.passphrase,
+        notification.ticker,
+        notification.message_type,
+        repr(notification.entry),
+        repr(notification.position_size),
+        notification.bar_time,
+    )
+    return hashlib.sha1('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+
+class AlertDeduplicator:
+    """
+    有容量上限的 LRU/TTL 去重快取，放在通知佇列之前
+    """
+
+    def __init__(self, max_entries=4096, ttl=120):
+        """
+        Args:
+            max_entries: 最多保留的指紋數量，超過時淘汰最舊的
+            ttl: 指紋有效秒數
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.duplicates = 0
+        self.accepted = 0
+
+    def is_duplicate(self, notification):
+        """
+        檢查並記錄通知，重複時返回 True
+
+        Args:
+            notification: Notification 實例
+
+        Returns:
+            bool: 是否為 ttl 內已收過的通知
+        """
+        key = notification_fingerprint(notification)
+        now = time.monotonic()
+        with self._lock:
+            seen_at = self._entries.get(key)
+            if seen_at is not None and now - seen_at <= self.ttl:
+                self._entries.move_to_end(key)
+                self.duplicates += 1
+                return True
+            self._entries[key] = now
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self.accepted += 1
+            return False
+
+    def stats(self):
+        with self._lock:
+            return {
+                'accepted': self.accepted,
+                'duplicates': self.duplicates,
+                'size': len(self._entries),
+            }
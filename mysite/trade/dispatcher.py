@@ -0,0 +1,266 @@
+import logging
+import threading
+import time
+import zlib
+from collections import deque
+
+logger = logging.getLogger('trade')
+
+# 通知種類
+NOTIFICATION_EXIT = 'exit'
+NOTIFICATION_ENTRY = 'entry'
+
+EXIT_TYPES = ('long_exit', 'short_exit', 'exit', 'close_all')
+ENTRY_TYPES = ('long_entry', 'short_entry', 'entry')
+
+
+def classify_notification_type(notification_type):
+    """
+    依訊息 type 判斷通知屬於出場或進場
+
+    Args:
+        notification_type: message 中的 type 欄位
+
+    Returns:
+        str: NOTIFICATION_EXIT / NOTIFICATION_ENTRY，無法分類時返回 None
+    """
+    if notification_type in EXIT_TYPES:
+        return NOTIFICATION_EXIT
+    if notification_type in ENTRY_TYPES:
+        return NOTIFICATION_ENTRY
+    return None
+
+
+class _Shard:
+    """
+    單一分片：一條工作線程，依序處理落在此分片的通知
+
+    同分片內保持入列順序，出場通知優先於進場通知。
+    設定 coalesce 時，取出一筆通知會連同同分片鍵的其他積壓通知依到達順序一併取出合併。
+    """
+
+    def __init__(self, index, handler, latency_window, on_done=None, coalesce=None, on_collapsed=None):
+        self.index = index
+        self.handler = handler
+        self.on_done = on_done
+        self.coalesce = coalesce
+        self.on_collapsed = on_collapsed
+        self._queues = {
+            NOTIFICATION_EXIT: deque(),
+            NOTIFICATION_ENTRY: deque(),
+        }
+        self._cond = threading.Condition()
+        self._latencies = deque(maxlen=latency_window)
+        self._dispatched = 0
+        self._collapsed = 0
+        self._arrivals = 0
+        self._max_latency = 0.0
+        self._busy = False
+        self._thread = None
+        self.is_running = False
+
+    def put(self, notification, kind, ticket=None, key=None):
+        with self._cond:
+            self._arrivals += 1
+            self._queues[kind].append((time.monotonic(), self._arrivals, notification, ticket, key))
+            self._cond.notify()
+
+    def _take(self):
+        """阻塞直到有通知，出場優先，返回要依序處理的通知列表"""
+        with self._cond:
+            while self.is_running:
+                for kind in (NOTIFICATION_EXIT, NOTIFICATION_ENTRY):
+                    if self._queues[kind]:
+                        self._busy = True
+                        item = self._queues[kind].popleft()
+                        if self.coalesce is None:
+                            return [item]
+                        return self._drain_key_locked(item)
+                self._cond.wait()
+        return None
+
+    def _drain_key_locked(self, first):
+        """取出與 first 同分片鍵的所有積壓通知，依到達順序排列，呼叫前須持有鎖"""
+        key = first[4]
+        batch = [first]
+        for kind in (NOTIFICATION_EXIT, NOTIFICATION_ENTRY):
+            queue = self._queues[kind]
+            if not any(item[4] == key for item in queue):
+                continue
+            remaining = deque()
+            for item in queue:
+                (batch if item[4] == key else remaining).append(item)
+            self._queues[kind] = remaining
+        batch.sort(key=lambda item: item[1])
+        return batch
+
+    def _coalesce_batch(self, batch):
+        """合併同分片鍵的積壓通知，被略過的通知記錄稽核並視為處理完成"""
+        try:
+            collapsed = dict(self.coalesce([item[2] for item in batch]))
+        except Exception as e:
+            logger.error(f"分片 {self.index} 合併通知時發生錯誤: {str(e)}")
+            return batch
+        if not collapsed:
+            return batch
+
+        kept = []
+        for index, item in enumerate(batch):
+            reason = collapsed.get(index)
+            if reason is None:
+                kept.append(item)
+                continue
+            with self._cond:
+                self._collapsed += 1
+            if self.on_collapsed is not None:
+                try:
+                    self.on_collapsed(item[2], reason)
+                except Exception as e:
+                    logger.error(f"分片 {self.index} 記錄合併通知時發生錯誤: {str(e)}")
+            self._complete(item[3])
+        return kept
+
+    def _complete(self, ticket):
+        if self.on_done is not None and ticket is not None:
+            try:
+                self.on_done(ticket)
+            except Exception as e:
+                logger.error(f"分片 {self.index} 完成回呼時發生錯誤: {str(e)}")
+
+    def _dispatch(self, item):
+        enqueued_at, _, notification, ticket, _ = item
+        latency = time.monotonic() - enqueued_at
+        with self._cond:
+            self._latencies.append(latency)
+            self._dispatched += 1
+            self._max_latency = max(self._max_latency, latency)
+        try:
+            self.handler(notification)
+        except Exception as e:
+            logger.error(f"分片 {self.index} 派發通知時發生錯誤: {str(e)}")
+            logger.error("錯誤詳情:", exc_info=True)
+        finally:
+            self._complete(ticket)
+
+    def _run(self):
+        while self.is_running:
+            batch = self._take()
+            if batch is None:
+                break
+            try:
+                if len(batch) > 1:
+                    batch = self._coalesce_batch(batch)
+                for item in batch:
+                    self._dispatch(item)
+            finally:
+                with self._cond:
+                    self._busy = False
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self.is_running = True
+        self._thread = threading.Thread(
+            target=self._run,
+            name=f"NotificationShard-{self.index}",
+            daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self.is_running = False
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            latencies = list(self._latencies)
+            return {
+                'shard': self.index,
+                'exit_depth': len(self._queues[NOTIFICATION_EXIT]),
+                'entry_depth': len(self._queues[NOTIFICATION_ENTRY]),
+                'busy': self._busy,
+                'dispatched': self._dispatched,
+                'collapsed': self._collapsed,
+                'latency_last': latencies[-1] if latencies else 0.0,
+                'latency_avg': sum(latencies) / len(latencies) if latencies else 0.0,
+                'latency_max': self._max_latency,
+            }
+
+
+class NotificationDispatcher:
+    """
+    事件驅動的通知派發器
+
+    以阻塞等待取代每 5 秒輪詢佇列，通知一進佇列即交由 handler 處理。
+    通知依策略/交易對分片，同一交易對嚴格依序執行，不同交易對並行；
+    每個分片內出場通知永遠優先於進場通知。
+    """
+
+    def __init__(self, handler, shards=4, latency_window=500, on_done=None, coalesce=None, on_collapsed=None):
+        """
+        Args:
+            handler: 處理單筆通知的函數
+            shards: 分片(工作線程)數量
+            latency_window: 每個分片延遲統計保留的樣本數
+            on_done: 通知處理完成後以 ticket 呼叫的函數 (例如日誌 ack)
+            coalesce: 合併同分片鍵積壓通知的函數，接收通知列表並返回被略過的 [(index, reason), ...]
+            on_collapsed: 通知被合併略過時以 (notification, reason) 呼叫的函數
+        """
+        if shards < 1:
+            raise ValueError("分片數量必須大於等於1")
+        self.handler = handler
+        self._shards = [_Shard(i, handler, latency_window, on_done, coalesce, on_collapsed) for i in range(shards)]
+
+    def shard_for(self, key):
+        """依分片鍵取得分片，使用 crc32 確保跨行程穩定"""
+        return self._shards[zlib.crc32(str(key).encode('utf-8')) % len(self._shards)]
+
+    def submit(self, notification, kind, key=None, ticket=None):
+        """
+        放入一筆通知
+
+        Args:
+            notification: 通知內容
+            kind: NOTIFICATION_EXIT 或 NOTIFICATION_ENTRY
+            key: 分片鍵 (策略/交易對)，None 時一律進入第一個分片
+            ticket: 處理完成後傳給 on_done 的識別值 (例如日誌序號)
+        """
+        if kind not in (NOTIFICATION_EXIT, NOTIFICATION_ENTRY):
+            raise ValueError(f"未知的通知種類: {kind}")
+        self.shard_for(key).put(notification, kind, ticket, key)
+
+    def start(self):
+        """啟動所有分片的工作線程"""
+        for shard in self._shards:
+            shard.start()
+        logger.info(f"通知派發器已啟動，分片數量: {len(self._shards)}")
+
+    def stop(self):
+        """停止所有分片的工作線程"""
+        for shard in self._shards:
+            shard.stop()
+
+    def stats(self):
+        """
+        取得佇列深度與入列到派發的延遲統計
+
+        Returns:
+            dict: {
+                'exit_depth': 出場佇列總深度,
+                'entry_depth': 進場佇列總深度,
+                'dispatched': 已派發總數量,
+                'collapsed': 被合併略過的總數量,
+                'latency_max': 各分片最大延遲(秒),
+                'shards': 各分片的積壓與延遲統計列表
+            }
+        """
+        shards = [shard.stats() for shard in self._shards]
+        return {
+            'exit_depth': sum(s['exit_depth'] for s in shards),
+            'entry_depth': sum(s['entry_depth'] for s in shards),
+            'dispatched': sum(s['dispatched'] for s in shards),
+            'collapsed': sum(s['collapsed'] for s in shards),
+            'latency_max': max(s['latency_max'] for s in shards),
+            'shards': shards,
+        }
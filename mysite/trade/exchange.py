@@ -0,0 +1,447 @@
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import unquote_plus, urlsplit
+
+from binance import Client
+from requests.adapters import HTTPAdapter
+
+from .metrics import metrics
+from .order_events import order_event_waiter
+from .tracing import tracer
+
+logger = logging.getLogger('trade')
+
+binance_requests_total = metrics.counter(
+    'binance_requests_total', 'Binance REST 呼叫次數', ('method', 'path', 'status'))
+binance_request_seconds = metrics.histogram(
+    'binance_request_seconds', 'Binance REST 往返耗時(秒)', ('path',))
+
+# 每個帳戶連線池大小，需不小於同時送出的批次數量
+CONNECTION_POOL_SIZE = 10
+
+rate_limit_wait_seconds = metrics.histogram(
+    'rate_limit_wait_seconds', '請求等待速率限制額度的時間(秒)', ('priority',),
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30))
+rate_limit_throttled_total = metrics.counter(
+    'rate_limit_throttled_total', '因速率限制而等待的請求數量', ('priority', 'reason'))
+rate_limit_bans_total = metrics.counter('rate_limit_bans_total', '收到 429/418 的次數', ('status',))
+rate_limit_weight_available = metrics.gauge('rate_limit_weight_available', '本機估計剩餘的請求權重')
+
+# 請求優先序，數字越小越優先
+HIGH = 0
+NORMAL = 1
+LOW = 2
+PRIORITY_NAMES = {HIGH: 'high', NORMAL: 'normal', LOW: 'low'}
+
+# 期貨 REST 權重，以 (method, path) 為鍵，未列出的為 1；(不帶 symbol 時的權重, 帶 symbol 時的權重)
+REQUEST_WEIGHTS = {
+    ('POST', '/fapi/v1/batchOrders'): (5, 5),
+    ('PUT', '/fapi/v1/batchOrders'): (5, 5),
+    ('GET', '/fapi/v1/openOrders'): (40, 1),
+    ('GET', '/fapi/v2/positionRisk'): (5, 5),
+    ('GET', '/fapi/v2/account'): (5, 5),
+    ('GET', '/fapi/v2/balance'): (5, 5),
+    ('GET', '/fapi/v1/userTrades'): (5, 5),
+    ('GET', '/fapi/v1/income'): (30, 30),
+    ('GET', '/fapi/v1/premiumIndex'): (10, 1),
+    ('GET', '/fapi/v1/ticker/price'): (2, 1),
+    ('GET', '/fapi/v1/allOrders'): (5, 5),
+}
+# 新增訂單的 endpoint，計入 ORDERS 限制並以最高優先序送出
+ORDER_PATHS = ('/fapi/v1/order', '/fapi/v1/batchOrders')
+# 會產生訂單事件的 endpoint (下單、改單、撤單)，送出時間記錄給 order_event_waiter
+ORDER_EVENT_PATHS = ORDER_PATHS + ('/fapi/v1/allOpenOrders',)
+
+
+def batch_orders(params):
+    """
+    取得批次下單參數中的訂單列表
+
+    futures_place_batch_order 會先將 batchOrders 的 JSON 字串 URL 編碼後放回參數，此處兩種形式都接受。
+
+    Returns:
+        list[dict]: 訂單參數列表
+    """
+    batch = params.get('batchOrders')
+    if not batch:
+        return []
+    if isinstance(batch, str):
+        return json.loads(unquote_plus(batch))
+    return list(batch)
+
+
+class RateLimitExceeded(Exception):
+    """交易所封鎖 (429/418) 剩餘時間超過可等待的上限"""
+
+
+class _Bucket:
+    """以固定速率補充的權杖桶，容量為視窗內的限制"""
+
+    __slots__ = ('capacity', 'rate', 'tokens', 'updated_at')
+
+    def __init__(self, capacity, window):
+        self.capacity = capacity
+        self.rate = capacity / window
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def sync(self, used):
+        """以交易所回報的已使用量校正，只往保守的方向調整"""
+        self.tokens = min(self.tokens, self.capacity - used)
+
+
+class RateLimitGovernor:
+    """
+    所有 Binance 期貨 REST 請求共用的速率限制器
+
+    - 請求權重 (每 IP 每分鐘) 與新增訂單數量 (每帳戶每 10 秒 / 每分鐘) 以權杖桶估算，送出前扣除預估用量
+    - 每次回應以 X-MBX-USED-WEIGHT-1M 與 X-MBX-ORDER-COUNT-10S / -1M 校正，多個 client 或行程共用額度時也不會高估
+    - 優先序：新增訂單固定為 HIGH；以 priority(LOW) 標記的流程 (儀表板、定期核對) 需保留較多額度才送出，
+      且有較高優先序的請求等待時讓路
+    - 收到 429/418 時依 Retry-After 暫停所有請求，剩餘時間超過 max_wait 時直接拋出 RateLimitExceeded
+    """
+
+    def __init__(self, weight_limit=2400, order_limit_10s=300, order_limit_1m=1200,
+                 reserves=None, max_wait=30.0):
+        """
+        Args:
+            weight_limit: 每分鐘請求權重上限
+            order_limit_10s: 每帳戶每 10 秒新增訂單上限
+            order_limit_1m: 每帳戶每分鐘新增訂單上限
+            reserves: {priority: 保留比例}，該優先序送出後權重需高於容量乘此比例
+            max_wait: 封鎖期間最長等待秒數
+        """
+        self._cond = threading.Condition()
+        self._weight = _Bucket(weight_limit, 60.0)
+        self._order_limits = (order_limit_10s, order_limit_1m)
+        self._orders = {}
+        self._reserves = reserves or {HIGH: 0.0, NORMAL: 0.1, LOW: 0.3}
+        self._max_wait = max_wait
+        self._waiting = {HIGH: 0, NORMAL: 0, LOW: 0}
+        self._blocked_until = 0.0
+        self._local = threading.local()
+        rate_limit_weight_available.set_function(self._available)
+
+    def _available(self):
+        with self._cond:
+            self._weight.refill(time.monotonic())
+            return self._weight.tokens
+
+    @contextmanager
+    def priority(self, level):
+        """在此區塊內送出的請求使用指定優先序 (新增訂單仍為 HIGH)"""
+        previous = getattr(self._local, 'priority', NORMAL)
+        self._local.priority = level
+        try:
+            yield
+        finally:
+            self._local.priority = previous
+
+    def current_priority(self):
+        return getattr(self._local, 'priority', NORMAL)
+
+    @staticmethod
+    def request_cost(method, path, params):
+        """
+        估計請求的權重與新增訂單數量
+
+        Returns:
+            tuple: (weight, orders)
+        """
+        params = params or {}
+        weights = REQUEST_WEIGHTS.get((method.upper(), path))
+        if path == '/fapi/v1/depth':
+            limit = int(params.get('limit', 500))
+            weight = 2 if limit <= 50 else 5 if limit <= 100 else 10 if limit <= 500 else 20
+        elif weights is not None:
+            weight = weights[1] if params.get('symbol') else weights[0]
+        else:
+            weight = 1
+        orders = 0
+        if method.upper() == 'POST' and path in ORDER_PATHS:
+            orders = len(batch_orders(params)) if 'batchOrders' in params else 1
+        return weight, orders
+
+    def _order_buckets(self, api_key):
+        buckets = self._orders.get(api_key)
+        if buckets is None:
+            buckets = self._orders[api_key] = (_Bucket(self._order_limits[0], 10.0),
+                                               _Bucket(self._order_limits[1], 60.0))
+        return buckets
+
+    def acquire(self, api_key, method, path, params=None):
+        """
+        送出請求前取得額度，額度不足時阻塞
+
+        Returns:
+            float: 等待秒數
+        """
+        weight, orders = self.request_cost(method, path, params)
+        priority = HIGH if orders else self.current_priority()
+        started = time.monotonic()
+        reason = None
+        with self._cond:
+            self._waiting[priority] += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._weight.refill(now)
+                    order_buckets = self._order_buckets(api_key) if orders else ()
+                    for bucket in order_buckets:
+                        bucket.refill(now)
+                    if self._blocked_until > now:
+                        remaining = self._blocked_until - now
+                        if remaining > self._max_wait:
+                            rate_limit_throttled_total.inc(PRIORITY_NAMES[priority], 'rejected')
+                            raise RateLimitExceeded(f"Binance 速率限制封鎖中，剩餘 {remaining:.0f} 秒")
+                        reason = 'banned'
+                        self._cond.wait(remaining)
+                        continue
+                    if any(self._waiting[level] for level in range(priority)):
+                        reason = reason or 'priority'
+                        self._cond.wait(0.05)
+                        continue
+                    floor = self._weight.capacity * self._reserves.get(priority, 0.0)
+                    shortfall = weight + floor - self._weight.tokens
+                    for bucket in order_buckets:
+                        shortfall = max(shortfall, (orders - bucket.tokens) * self._weight.rate / bucket.rate)
+                    if shortfall <= 0:
+                        self._weight.tokens -= weight
+                        for bucket in order_buckets:
+                            bucket.tokens -= orders
+                        break
+                    reason = reason or 'weight'
+                    self._cond.wait(min(1.0, shortfall / self._weight.rate))
+            finally:
+                self._waiting[priority] -= 1
+                self._cond.notify_all()
+        waited = time.monotonic() - started
+        rate_limit_wait_seconds.observe(waited, PRIORITY_NAMES[priority])
+        if reason is not None:
+            rate_limit_throttled_total.inc(PRIORITY_NAMES[priority], reason)
+            if waited >= 1.0:
+                logger.warning(f"{method.upper()} {path} 等待速率限制 {waited:.2f}s ({reason})")
+        return waited
+
+    def update(self, api_key, response):
+        """以回應標頭校正用量，429/418 時依 Retry-After 暫停"""
+        headers = response.headers
+        with self._cond:
+            used_weight = headers.get('X-MBX-USED-WEIGHT-1M')
+            if used_weight is not None:
+                self._weight.refill(time.monotonic())
+                self._weight.sync(int(used_weight))
+            for bucket, header in zip(self._order_buckets(api_key),
+                                      ('X-MBX-ORDER-COUNT-10S', 'X-MBX-ORDER-COUNT-1M')):
+                count = headers.get(header)
+                if count is not None:
+                    bucket.refill(time.monotonic())
+                    bucket.sync(int(count))
+            if response.status_code in (418, 429):
+                retry_after = int(headers.get('Retry-After') or 60)
+                self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+                rate_limit_bans_total.inc(str(response.status_code))
+                logger.error(f"Binance 回應 {response.status_code}，暫停所有請求 {retry_after} 秒")
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            now = time.monotonic()
+            self._weight.refill(now)
+            return {
+                'weight_available': round(self._weight.tokens, 1),
+                'weight_limit': self._weight.capacity,
+                'waiting': {PRIORITY_NAMES[level]: count for level, count in self._waiting.items()},
+                'blocked_for': round(max(0.0, self._blocked_until - now), 1),
+            }
+
+
+rate_limit_governor = RateLimitGovernor()
+
+
+class InstrumentedClient(Client):
+    """
+    記錄每次 REST 往返的 Binance Client
+
+    所有 REST 呼叫最終都經過 _request，在此以 "binance.<METHOD> <path>" 為階段名稱記錄 span，
+    並依 endpoint 累計呼叫次數與耗時。回應保存在區域變數，多線程共用同一個 client 時統計不會錯置。
+    期貨 endpoint 送出前經過 rate_limit_governor 取得額度，回應標頭回饋實際用量。
+    """
+
+    def _init_session(self):
+        session = super()._init_session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=CONNECTION_POOL_SIZE)
+        session.mount('https://', adapter)
+        return session
+
+    def _request(self, method, uri, signed, force_params=False, **kwargs):
+        path = urlsplit(uri).path
+        status = 'error'
+        started = time.monotonic()
+        try:
+            with tracer.span(f"binance.{method.upper()} {path}"):
+                governed = path.startswith('/fapi/')
+                params = kwargs.get('data')
+                if governed:
+                    with tracer.span('rate_limit.acquire'):
+                        rate_limit_governor.acquire(self.API_KEY, method, path, params)
+                event_symbols = _event_symbols(method, path, params)
+                kwargs = self._get_request_kwargs(method, signed, force_params, **kwargs)
+                sent_at = time.monotonic()
+                response = getattr(self.session, method)(uri, **kwargs)
+                self.response = response
+                status = str(response.status_code)
+                if governed:
+                    rate_limit_governor.update(self.API_KEY, response)
+                result = self._handle_response(response)
+                # 等待端以此時間之後的訂單事件確認請求已生效
+                for symbol in event_symbols:
+                    order_event_waiter.mark_request(self.API_KEY, symbol, sent_at)
+                return result
+        finally:
+            binance_requests_total.inc(method.upper(), path, status)
+            binance_request_seconds.observe(time.monotonic() - started, path)
+
+
+def _event_symbols(method, path, params):
+    """會產生訂單事件的請求所涉及的交易對"""
+    if method.upper() == 'GET' or path not in ORDER_EVENT_PATHS or not params:
+        return ()
+    if params.get('symbol'):
+        return (params['symbol'],)
+    try:
+        return {order['symbol'] for order in batch_orders(params) if order.get('symbol')}
+    except (ValueError, TypeError, KeyError):
+        return ()
+
+
+def create_client(api_key, api_secret, **kwargs):
+    """建立新的 Binance Client，一般應使用 get_client 共用連線池"""
+    return InstrumentedClient(api_key, api_secret, **kwargs)
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(api_key, api_secret):
+    """
+    取得帳戶共用的 Binance Client
+
+    每個 API key 只建立一次 (建立時會 ping 一次)，之後共用 keep-alive 連線池，
+    避免每筆訊號重新建立連線與 TLS 握手。
+    """
+    client = _clients.get(api_key)
+    if client is not None:
+        return client
+    with _clients_lock:
+        client = _clients.get(api_key)
+        if client is None:
+            client = _clients[api_key] = create_client(api_key, api_secret)
+        return client
+
+
+class OrderSubmitter:
+    """
+    並行送出互不相依的批次請求
+
+    同一帳戶的批次共用該帳戶 client 的連線池同時送出，整體耗時約為一次往返；
+    結果依輸入順序彙整後只記錄一次。
+    """
+
+    def __init__(self, max_workers=CONNECTION_POOL_SIZE):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="OrderSubmit")
+
+    def _run(self, label, function, items):
+        """
+        Returns:
+            list[tuple]: [(item, response, error), ...]，依輸入順序
+        """
+        if not items:
+            return []
+        parent_trace = tracer.current_trace_id()
+
+        def call(item):
+            # 子線程沿用呼叫端的追蹤 ID，span 歸在同一條追蹤下
+            with tracer.trace(label, trace_id=parent_trace):
+                return function(item)
+
+        started = time.monotonic()
+        outcomes = []
+        if len(items) == 1:
+            # 只有一批時直接在呼叫端線程送出，省去線程切換
+            try:
+                outcomes.append((items[0], function(items[0]), None))
+            except Exception as e:
+                outcomes.append((items[0], None, e))
+        else:
+            futures = [self._executor.submit(call, item) for item in items]
+            for item, future in zip(items, futures):
+                try:
+                    outcomes.append((item, future.result(), None))
+                except Exception as e:
+                    outcomes.append((item, None, e))
+        self._log(label, outcomes, time.monotonic() - started)
+        return outcomes
+
+    @staticmethod
+    def _log(label, outcomes, elapsed):
+        succeeded = failed = 0
+        errors = []
+        for item, response, error in outcomes:
+            if error is not None:
+                failed += len(item) if isinstance(item, list) else 1
+                errors.append(str(error))
+                continue
+            for result in response if isinstance(response, list) else [response]:
+                if isinstance(result, dict) and 'code' in result:
+                    failed += 1
+                    errors.append(f"{result.get('code')}: {result.get('msg')}")
+                else:
+                    succeeded += 1
+        message = (f"{label}: {len(outcomes)} 批次, 成功 {succeeded}, 失敗 {failed}, "
+                   f"耗時 {elapsed * 1000:.0f}ms")
+        if errors:
+            logger.warning(f"{message}, 錯誤: {errors}")
+        else:
+            logger.info(message)
+
+    def place_batches(self, client, batches):
+        """
+        並行送出多個 futures_place_batch_order (每批最多 5 筆)
+
+        Returns:
+            list[tuple]: [(batch, response, error), ...]
+        """
+        return self._run(
+            'place_batches',
+            lambda batch: client.futures_place_batch_order(batchOrders=json.dumps(batch)),
+            batches
+        )
+
+    def cancel_batches(self, client, symbol, order_id_batches):
+        """
+        並行送出多個 futures_cancel_orders (每批最多 10 筆)
+
+        Returns:
+            list[tuple]: [(order_ids, response, error), ...]
+        """
+        return self._run(
+            'cancel_batches',
+            lambda order_ids: client.futures_cancel_orders(
+                symbol=symbol,
+                orderIdList=json.dumps(order_ids, separators=(',', ':'))
+            ),
+            order_id_batches
+        )
+
+
+order_submitter = OrderSubmitter()
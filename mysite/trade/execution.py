@@ -0,0 +1,447 @@
+import logging
+import math
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from binance.exceptions import BinanceAPIException
+
+from .metrics import metrics
+from .models import Trade
+from .order_events import order_event_waiter, FINAL_STATUSES
+from .tracing import tracer
+
+logger = logging.getLogger('trade')
+
+# reduceOnly 訂單因倉位已不存在被拒絕
+REDUCE_ONLY_REJECTED = -2022
+# 交易所回應逾時，訂單是否成立未知
+EXECUTION_STATUS_UNKNOWN = -1007
+# 查詢的訂單不存在
+ORDER_DOES_NOT_EXIST = -2013
+# 子單連續失敗上限
+MAX_CHILD_ERRORS = 3
+
+execution_parents_total = metrics.counter('execution_parents_total', '母單結束數量', ('mode', 'state'))
+execution_children_total = metrics.counter('execution_children_total', '子單結果', ('result',))
+execution_active = metrics.gauge('execution_active', '執行中的母單數量')
+
+
+class ChildOrderUnknown(Exception):
+    """子單送出後無法確認交易所是否已接受"""
+
+
+class ParentOrder:
+    """
+    由排程器分批執行的母單
+
+    每張子單數量為 min(剩餘數量 / 剩餘批次, max_child_quantity)，子單之間間隔 interval 秒 (TWAP)；
+    只設定 max_child_quantity 時為冰山單，子單成交後立即送出下一張。
+    strategy_id 有值時每張成交的子單寫入一筆 Trade (同一 trade_group_id)，作為可查詢的執行進度。
+    """
+
+    PENDING = 'PENDING'
+    RUNNING = 'RUNNING'
+    DONE = 'DONE'
+    CANCELED = 'CANCELED'
+    FAILED = 'FAILED'
+
+    def __init__(self, client, symbol, side, quantity, quantity_precision, slices=1, interval=0.0,
+                 max_child_quantity=None, reduce_only=True, strategy_id=None, trade_group_id=None,
+                 trade_type='EXIT', on_done=None):
+        """
+        Args:
+            client: 下單帳戶的 Binance client
+            symbol: 交易對
+            side: 買賣方向
+            quantity: 總數量
+            quantity_precision: 數量精度
+            slices: 批次數量
+            interval: 子單間隔秒數
+            max_child_quantity: 單張子單數量上限，None 為不限制
+            reduce_only: 子單是否為 reduceOnly
+            strategy_id: 寫入 Trade 的策略，None 時不寫入
+            trade_group_id: 寫入 Trade 的交易組ID
+            trade_type: 寫入 Trade 的交易類型
+            on_done: on_done(parent)，母單結束 (完成、取消或失敗) 後在執行線程呼叫
+        """
+        self.execution_id = uuid.uuid4().hex[:12]
+        self.client = client
+        self.symbol = symbol
+        self.side = side
+        self.quantity = float(quantity)
+        self.quantity_precision = quantity_precision
+        self.slices = max(1, int(slices))
+        self.interval = interval
+        self.max_child_quantity = max_child_quantity
+        self.reduce_only = reduce_only
+        self.strategy_id = strategy_id
+        self.trade_group_id = trade_group_id
+        self.trade_type = trade_type
+        self.on_done = on_done
+        self.state = self.PENDING
+        self.executed_qty = 0.0
+        self.notional = 0.0
+        self.orders = []
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self._cancel = threading.Event()
+        self._done = threading.Event()
+
+    @property
+    def mode(self):
+        if self.interval > 0 and self.slices > 1:
+            return 'TWAP'
+        if self.max_child_quantity:
+            return 'ICEBERG'
+        return 'SINGLE'
+
+    @property
+    def key(self):
+        return self.client.API_KEY, self.symbol
+
+    @property
+    def avg_price(self):
+        return self.notional / self.executed_qty if self.executed_qty else 0.0
+
+    @property
+    def remaining(self):
+        return max(0.0, self.quantity - self.executed_qty)
+
+    def cancel(self):
+        """要求中止，已送出的子單不撤回，不再送出新的子單"""
+        self._cancel.set()
+
+    def is_canceled(self):
+        return self._cancel.is_set()
+
+    def wait(self, timeout=None):
+        """
+        等待母單結束
+
+        Returns:
+            bool: 是否在逾時前結束
+        """
+        return self._done.wait(timeout)
+
+    def is_done(self):
+        return self._done.is_set()
+
+    def summary(self):
+        """彙總成與 futures_create_order 回應相同的欄位，供既有的 Trade 記錄流程使用"""
+        last_order = self.orders[-1] if self.orders else {}
+        return {
+            'orderId': last_order.get('orderId', 0),
+            'symbol': self.symbol,
+            'side': self.side,
+            'type': 'MARKET',
+            'status': 'FILLED' if self.state == self.DONE else self.state,
+            'origQty': format(self.executed_qty, f'.{self.quantity_precision}f'),
+            'executedQty': format(self.executed_qty, f'.{self.quantity_precision}f'),
+            'price': str(self.avg_price),
+            'avgPrice': str(self.avg_price),
+        }
+
+    def stats(self):
+        return {
+            'execution_id': self.execution_id,
+            'symbol': self.symbol,
+            'side': self.side,
+            'mode': self.mode,
+            'state': self.state,
+            'quantity': self.quantity,
+            'executed_qty': round(self.executed_qty, self.quantity_precision),
+            'avg_price': self.avg_price,
+            'children': len(self.orders),
+            'strategy_id': self.strategy_id,
+            'trade_group_id': self.trade_group_id,
+            'error': self.error,
+        }
+
+
+class ExecutionScheduler:
+    """
+    在背景執行母單的排程器
+
+    不同交易對的母單在線程池中並行；同一帳戶同一交易對的母單依提交順序逐一執行，避免互相搶量。
+    子單以市價送出 (newOrderRespType=RESULT)，未立即取得最終狀態時等待 user data stream 事件。
+    每張子單使用固定的 clientOrderId ({execution_id}_{子單序號})，送出時發生逾時等傳輸錯誤，
+    先以該 ID 查詢交易所是否已接受，確認不存在後才以同一 ID 重送，避免重複成交。
+    """
+
+    def __init__(self, max_workers=4, keep_finished=100):
+        """
+        Args:
+            max_workers: 同時執行的母單數量
+            keep_finished: 保留供查詢的已結束母單數量
+        """
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="Execution")
+        self._lock = threading.Lock()
+        self._symbol_locks = {}
+        self._parents = {}
+        self._keep_finished = keep_finished
+        execution_active.set_function(lambda: len(self.active()))
+
+    def submit(self, parent):
+        """
+        提交母單，立即返回
+
+        Returns:
+            ParentOrder: 同一物件，可用於 wait() / cancel()
+        """
+        with self._lock:
+            self._parents[parent.execution_id] = parent
+            symbol_lock = self._symbol_locks.setdefault(parent.key, threading.Lock())
+        logger.info(f"母單 {parent.execution_id} 已提交: {parent.symbol} {parent.side} {parent.quantity} "
+                    f"({parent.mode}, {parent.slices} 批, 間隔 {parent.interval}s, 上限 {parent.max_child_quantity})")
+        self._executor.submit(self._run, parent, symbol_lock, tracer.current_trace_id())
+        return parent
+
+    def get(self, execution_id):
+        return self._parents.get(execution_id)
+
+    def cancel(self, execution_id):
+        """
+        中止母單
+
+        Returns:
+            bool: 母單存在且尚未結束
+        """
+        parent = self._parents.get(execution_id)
+        if parent is None or parent.is_done():
+            return False
+        parent.cancel()
+        logger.warning(f"母單 {execution_id} 已要求中止 (已成交 {parent.executed_qty}/{parent.quantity})")
+        return True
+
+    def active(self, symbol=None, api_key=None, trade_type=None):
+        """尚未結束的母單，可依交易對、帳戶與交易類型篩選"""
+        return [parent for parent in list(self._parents.values())
+                if not parent.is_done()
+                and (symbol is None or parent.symbol == symbol)
+                and (api_key is None or parent.client.API_KEY == api_key)
+                and (trade_type is None or parent.trade_type == trade_type)]
+
+    def _child_quantity(self, parent, child_index):
+        step = 10 ** -parent.quantity_precision
+        slices_left = max(1, parent.slices - child_index)
+        quantity = parent.remaining / slices_left
+        if parent.max_child_quantity:
+            quantity = min(quantity, parent.max_child_quantity)
+        quantity = math.floor(quantity / step + 1e-9) * step
+        if quantity < step:
+            # 剩餘數量不足一個精度單位時合併成一張
+            quantity = math.floor(parent.remaining / step + 1e-9) * step
+        return round(quantity, parent.quantity_precision)
+
+    @staticmethod
+    def _child_order_id(parent, child_index):
+        return f"{parent.execution_id}_{child_index}"
+
+    def _find_child(self, parent, client_order_id):
+        """
+        以 clientOrderId 查詢子單
+
+        Returns:
+            dict: 訂單，確認不存在返回 None
+
+        Raises:
+            ChildOrderUnknown: 查詢失敗，仍無法確認
+        """
+        try:
+            return parent.client.futures_get_order(symbol=parent.symbol, origClientOrderId=client_order_id)
+        except BinanceAPIException as e:
+            if e.code == ORDER_DOES_NOT_EXIST:
+                return None
+            raise ChildOrderUnknown(f"查詢子單 {client_order_id} 失敗: {e.message}") from e
+        except Exception as e:
+            raise ChildOrderUnknown(f"查詢子單 {client_order_id} 失敗: {str(e)}") from e
+
+    def _place_child(self, parent, quantity, client_order_id, unconfirmed=False):
+        """
+        送出子單並取得最終狀態
+
+        Args:
+            parent: 母單
+            quantity: 數量
+            client_order_id: 子單的 clientOrderId
+            unconfirmed: 上次以同一 ID 送出時結果未知，先查詢再決定是否送出
+
+        Raises:
+            ChildOrderUnknown: 無法確認子單是否已被接受，呼叫端應以同一 ID 再次呼叫
+        """
+        order = self._find_child(parent, client_order_id) if unconfirmed else None
+        if order is None:
+            params = {
+                'symbol': parent.symbol,
+                'side': parent.side,
+                'type': 'MARKET',
+                'quantity': format(quantity, f'.{parent.quantity_precision}f'),
+                'newClientOrderId': client_order_id,
+                'newOrderRespType': 'RESULT',
+            }
+            if parent.reduce_only:
+                params['reduceOnly'] = 'true'
+            error = None
+            try:
+                order = parent.client.futures_create_order(**params)
+            except BinanceAPIException as e:
+                if e.code != EXECUTION_STATUS_UNKNOWN:
+                    raise
+                error = e.message
+            except Exception as e:
+                # 傳輸錯誤時交易所可能已接受訂單
+                error = str(e)
+            if error is not None:
+                order = self._find_child(parent, client_order_id)
+                if order is None:
+                    raise RuntimeError(f"子單 {client_order_id} 送出失敗，交易所沒有此訂單: {error}")
+                logger.warning(f"母單 {parent.execution_id} 子單 {client_order_id} 送出時發生錯誤但已被接受: {error}")
+        if order.get('status') not in FINAL_STATUSES:
+            try:
+                event = order_event_waiter.wait_order(parent.client.API_KEY, order_id=order['orderId'], timeout=5.0)
+                if event is not None:
+                    order = dict(order, status=event['X'], executedQty=event['z'], avgPrice=event['ap'])
+                else:
+                    order = parent.client.futures_get_order(symbol=parent.symbol, orderId=order['orderId'])
+            except Exception as e:
+                # 訂單已存在，下次以同一 ID 查詢結果
+                raise ChildOrderUnknown(f"無法取得子單 {client_order_id} 的最終狀態: {str(e)}") from e
+        return order
+
+    def _record(self, parent, order):
+        if parent.strategy_id is None:
+            return
+        try:
+            Trade.objects.create(
+                strategy_id=parent.strategy_id,
+                thirdparty_id=order['orderId'],
+                symbol=parent.symbol,
+                trade_side=parent.side,
+                trade_type=parent.trade_type,
+                quantity=Decimal(order['executedQty']),
+                price=Decimal(order['avgPrice']),
+                trade_group_id=parent.trade_group_id
+            )
+        except Exception as e:
+            logger.error(f"母單 {parent.execution_id} 寫入 Trade 時發生錯誤: {str(e)}")
+
+    def _run(self, parent, symbol_lock, trace_id):
+        try:
+            with symbol_lock, tracer.trace('execution', trace_id=trace_id, symbol=parent.symbol, mode=parent.mode):
+                parent.state = ParentOrder.RUNNING
+                self._run_children(parent)
+        except Exception as e:
+            parent.error = str(e)
+            logger.error(f"母單 {parent.execution_id} 執行時發生錯誤: {str(e)}", exc_info=True)
+        finally:
+            # 無論如何都要結束母單，避免 wait() 的呼叫端永遠阻塞
+            self._finish(parent)
+
+    def _run_children(self, parent):
+        step = 10 ** -parent.quantity_precision
+        child_index = 0
+        errors = 0
+        unfilled = 0
+        # 上一張子單結果未知時，下一輪以同一 clientOrderId 先查詢
+        unconfirmed = False
+        while parent.remaining >= step and not parent.is_canceled():
+            if child_index > 0 and not unconfirmed and parent.interval > 0 and parent._cancel.wait(parent.interval):
+                break
+            quantity = self._child_quantity(parent, child_index)
+            try:
+                order = self._place_child(parent, quantity, self._child_order_id(parent, child_index), unconfirmed)
+            except ChildOrderUnknown as e:
+                unconfirmed = True
+                errors += 1
+                execution_children_total.inc('unknown')
+                logger.error(f"母單 {parent.execution_id} 子單結果未知 ({errors}/{MAX_CHILD_ERRORS}): {str(e)}")
+                if errors >= MAX_CHILD_ERRORS:
+                    parent.error = str(e)
+                    break
+                time.sleep(min(1.0 * errors, 3.0))
+                continue
+            except BinanceAPIException as e:
+                unconfirmed = False
+                if e.code == REDUCE_ONLY_REJECTED:
+                    logger.info(f"母單 {parent.execution_id} 倉位已平完，提前結束")
+                    execution_children_total.inc('position_closed')
+                    break
+                errors += 1
+                execution_children_total.inc('error')
+                logger.error(f"母單 {parent.execution_id} 子單失敗 ({errors}/{MAX_CHILD_ERRORS}): {e.message}")
+                if errors >= MAX_CHILD_ERRORS:
+                    parent.error = e.message
+                    break
+                continue
+            except Exception as e:
+                unconfirmed = False
+                errors += 1
+                execution_children_total.inc('error')
+                logger.error(f"母單 {parent.execution_id} 子單失敗 ({errors}/{MAX_CHILD_ERRORS}): {str(e)}")
+                if errors >= MAX_CHILD_ERRORS:
+                    parent.error = str(e)
+                    break
+                continue
+            errors = 0
+            unconfirmed = False
+            child_index += 1
+            executed = float(order.get('executedQty') or 0)
+            execution_children_total.inc('filled' if executed > 0 else order.get('status', 'unknown').lower())
+            if executed > 0:
+                unfilled = 0
+                parent.executed_qty += executed
+                parent.notional += executed * float(order['avgPrice'])
+                parent.orders.append(order)
+                self._record(parent, order)
+            else:
+                # 子單持續沒有成交 (例如過期) 時停止，避免 interval 為 0 時無限重送
+                unfilled += 1
+                if unfilled >= MAX_CHILD_ERRORS:
+                    parent.error = f"連續 {unfilled} 張子單沒有成交 ({order.get('status')})"
+                    break
+            logger.info(f"母單 {parent.execution_id} 子單 {child_index}: {executed} @ {order.get('avgPrice')} "
+                        f"({parent.executed_qty:.{parent.quantity_precision}f}/{parent.quantity})")
+        if unconfirmed:
+            logger.warning(f"母單 {parent.execution_id} 結束時子單 {self._child_order_id(parent, child_index)} "
+                           f"結果仍未知，成交數量可能未計入")
+
+    def _finish(self, parent):
+        parent.finished_at = time.time()
+        try:
+            step = 10 ** -parent.quantity_precision
+            if parent.error is not None:
+                parent.state = ParentOrder.FAILED
+            elif parent.is_canceled() and parent.remaining >= step:
+                parent.state = ParentOrder.CANCELED
+            else:
+                parent.state = ParentOrder.DONE
+            execution_parents_total.inc(parent.mode, parent.state)
+            logger.info(f"母單 {parent.execution_id} 結束 ({parent.state}): 成交 {parent.executed_qty} @ "
+                        f"{parent.avg_price}, 子單 {len(parent.orders)} 張, "
+                        f"耗時 {parent.finished_at - parent.created_at:.1f}s")
+        finally:
+            parent._done.set()
+            self._prune()
+            if parent.on_done is not None:
+                try:
+                    parent.on_done(parent)
+                except Exception as e:
+                    logger.error(f"母單 {parent.execution_id} on_done 發生錯誤: {str(e)}")
+
+    def _prune(self):
+        with self._lock:
+            finished = sorted((parent for parent in self._parents.values() if parent.is_done()),
+                              key=lambda parent: parent.finished_at or 0)
+            for parent in finished[:max(0, len(finished) - self._keep_finished)]:
+                del self._parents[parent.execution_id]
+
+    def stats(self):
+        parents = sorted(self._parents.values(), key=lambda parent: parent.created_at, reverse=True)
+        return [parent.stats() for parent in parents]
+
+
+execution_scheduler = ExecutionScheduler()
@@ -0,0 +1,82 @@
+import logging
+import threading
+
+from .metrics import metrics
+
+logger = logging.getLogger('trade')
+
+fills_debounced_total = metrics.counter('fills_debounced_total', '進入去抖動器的成交數量', ('symbol',))
+fill_flushes_total = metrics.counter('fill_flushes_total', '去抖動器合併後的處理次數', ('symbol',))
+fill_burst_size = metrics.histogram(
+    'fill_burst_size', '每次合併處理的成交數量', buckets=(1, 2, 3, 5, 8, 13, 21))
+
+
+class _SymbolState:
+    __slots__ = ('pending', 'timer', 'running')
+
+    def __init__(self):
+        self.pending = []
+        self.timer = None
+        self.running = False
+
+
+class FillDebouncer:
+    """
+    依交易對合併短時間內連續到達的成交
+
+    第一筆成交開始計時，window 秒內同交易對的成交累積在一起，到期後以整批呼叫一次 handler。
+    同一交易對的 handler 不會同時執行；執行期間到達的成交在結束後另開一個視窗處理，
+    因此不會在 symbol 鎖上排隊。
+    """
+
+    def __init__(self, handler, window=0.25):
+        """
+        Args:
+            handler: handler(symbol, fills)，fills 依到達順序排列
+            window: 合併視窗 (秒)
+        """
+        self._handler = handler
+        self._window = window
+        self._lock = threading.Lock()
+        self._states = {}
+
+    def submit(self, symbol, fill):
+        """加入一筆成交，必要時排程處理"""
+        fills_debounced_total.inc(symbol)
+        with self._lock:
+            state = self._states.get(symbol)
+            if state is None:
+                state = self._states[symbol] = _SymbolState()
+            state.pending.append(fill)
+            if state.timer is None and not state.running:
+                self._schedule_locked(symbol, state)
+
+    def _schedule_locked(self, symbol, state):
+        state.timer = threading.Timer(self._window, self._flush, args=(symbol,))
+        state.timer.daemon = True
+        state.timer.name = f"FillDebounce-{symbol}"
+        state.timer.start()
+
+    def _flush(self, symbol):
+        with self._lock:
+            state = self._states[symbol]
+            fills, state.pending = state.pending, []
+            state.timer = None
+            state.running = True
+        try:
+            if fills:
+                fill_flushes_total.inc(symbol)
+                fill_burst_size.observe(len(fills))
+                self._handler(symbol, fills)
+        except Exception as e:
+            logger.error(f"處理合併成交時發生錯誤 - Symbol: {symbol}, 成交數: {len(fills)}, Error: {str(e)}")
+        finally:
+            with self._lock:
+                state.running = False
+                if state.pending:
+                    self._schedule_locked(symbol, state)
+
+    def pending(self):
+        """各交易對尚未處理的成交數量"""
+        with self._lock:
+            return {symbol: len(state.pending) for symbol, state in self._states.items() if state.pending}
@@ -0,0 +1,94 @@
+import logging
+
+from .exchange import order_submitter
+from .open_orders import open_order_mirror
+
+logger = logging.getLogger('trade')
+
+# Binance 批次撤單/下單每次上限
+CANCEL_BATCH_SIZE = 10
+PLACE_BATCH_SIZE = 5
+
+
+def _is_grid_order(order):
+    return order.get('type') == 'LIMIT' and not order.get('reduceOnly')
+
+
+def diff_grid_orders(target_orders, live_orders, price_tolerance, quantity_tolerance=0.05):
+    """
+    比對目標網格與現有掛單
+
+    同方向、價格相差在 price_tolerance (相對比例) 內且數量相差在 quantity_tolerance 內的掛單視為已就位，
+    保留原掛單以維持排隊順序；其餘掛單撤銷，未被配對的目標價位新增。
+    非網格掛單 (非 LIMIT 或 reduceOnly) 一律撤銷，與原本全部撤單重掛的結果一致。
+
+    Args:
+        target_orders: 目標網格下單參數列表 (含 side/price/quantity)
+        live_orders: 現有掛單 (futures_get_open_orders 格式)
+        price_tolerance: 價格相對容差，通常為網格間距的一半
+        quantity_tolerance: 數量相對容差
+
+    Returns:
+        tuple: (kept, to_cancel, to_place)
+    """
+    unmatched = [order for order in live_orders if _is_grid_order(order)]
+    to_cancel = [order for order in live_orders if not _is_grid_order(order)]
+    kept = []
+    to_place = []
+
+    # 由最接近成交價的價位開始配對
+    for target in target_orders:
+        target_price = float(target['price'])
+        target_quantity = float(target['quantity'])
+        best = None
+        best_distance = None
+        for order in unmatched:
+            if order['side'] != target['side']:
+                continue
+            distance = abs(float(order['price']) - target_price)
+            if distance > target_price * price_tolerance:
+                continue
+            if abs(float(order['origQty']) - target_quantity) > target_quantity * quantity_tolerance:
+                continue
+            if best is None or distance < best_distance:
+                best, best_distance = order, distance
+        if best is None:
+            to_place.append(target)
+        else:
+            unmatched.remove(best)
+            kept.append(best)
+
+    to_cancel.extend(unmatched)
+    return kept, to_cancel, to_place
+
+
+def apply_grid_diff(client, symbol, to_cancel, to_place):
+    """
+    以批次撤單/批次下單套用差異，先撤單釋放保證金再下單
+
+    撤單批次之間、下單批次之間互不相依，各自經由 order_submitter 並行送出。
+
+    Returns:
+        bool: 所有請求是否皆成功送出 (個別訂單錯誤只記錄不中斷)
+    """
+    cancel_batches = [
+        [order['orderId'] for order in to_cancel[i:i + CANCEL_BATCH_SIZE]]
+        for i in range(0, len(to_cancel), CANCEL_BATCH_SIZE)
+    ]
+    outcomes = order_submitter.cancel_batches(client, symbol, cancel_batches)
+    for order_ids, response, error in outcomes:
+        if error is None:
+            open_order_mirror.record_orders(response)
+    if any(error is not None for _, _, error in outcomes):
+        logger.error(f"批次撤單失敗 - Symbol: {symbol}")
+        return False
+
+    place_batches = [to_place[i:i + PLACE_BATCH_SIZE] for i in range(0, len(to_place), PLACE_BATCH_SIZE)]
+    outcomes = order_submitter.place_batches(client, place_batches)
+    for batch, response, error in outcomes:
+        if error is None:
+            open_order_mirror.record_orders(response)
+    if any(error is not None for _, _, error in outcomes):
+        logger.error(f"批次下單失敗 - Symbol: {symbol}")
+        return False
+    return True
@@ -0,0 +1,192 @@
+import logging
+import os
+import threading
+import time
+
+from .notification import json_backend
+
+logger = logging.getLogger('trade')
+
+
+def is_stale(ts, max_age, now=None):
+    """
+    日誌記錄是否已過期，沒有時間記錄的舊格式視為過期
+
+    Args:
+        ts: 記錄寫入時間 (time.time())，可為 None
+        max_age: 有效秒數
+        now: 目前時間，None 時使用 time.time()
+
+    Returns:
+        bool: 是否應略過不派發
+    """
+    if ts is None:
+        return True
+    if now is None:
+        now = time.time()
+    return now - ts > max_age
+
+
+class WebhookJournal:
+    """
+    只追加的 webhook 日誌，讓佇列中的訊號在重啟後不會遺失
+
+    - append() 在回應 webhook 前寫入檔案(進入 OS page cache，行程崩潰也不會遺失)，
+      不等待 fsync，因此不增加請求延遲
+    - 背景線程批次 fsync，斷電最多遺失 fsync_interval 內的記錄
+    - 派發器處理完成後呼叫 ack()，未 ack 的記錄在重啟時由 recover() 重新派發(至少一次)
+    - 每筆記錄保留寫入時間 ts (壓縮後也保留)，恢復時呼叫端可依時間略過過期訊號
+    - 已 ack 的記錄累積到 compact_threshold 時壓縮檔案
+    """
+
+    def __init__(self, path, fsync_interval=0.05, compact_threshold=1000):
+        """
+        Args:
+            path: 日誌檔案路徑
+            fsync_interval: 批次 fsync 間隔(秒)
+            compact_threshold: 已 ack 記錄達此數量時壓縮
+        """
+        self.path = path
+        self.fsync_interval = fsync_interval
+        self.compact_threshold = compact_threshold
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._seq = 0
+        self._acked_since_compact = 0
+        self._dirty = False
+        self._fd = None
+        self._flush_thread = None
+        self.is_running = False
+
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def _open(self):
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def _write(self, record):
+        os.write(self._fd, (json_backend.dumps(record) + '\n').encode('utf-8'))
+        self._dirty = True
+
+    def recover(self):
+        """
+        讀取日誌並返回尚未 ack 的記錄，之後壓縮檔案並開始接受寫入
+
+        Returns:
+            list[tuple]: [(seq, kind, ts, body), ...]，依寫入順序排列；ts 為寫入時的 time.time()，
+                舊格式沒有記錄時為 None
+        """
+        started = time.monotonic()
+        pending = {}
+        max_seq = 0
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json_backend.loads(line)
+                    except ValueError:
+                        # 崩潰時寫到一半的最後一行
+                        logger.warning(f"略過損毀的日誌記錄: {line[:200]!r}")
+                        continue
+                    seq = int(record['seq'])
+                    max_seq = max(max_seq, seq)
+                    if record['op'] == 'put':
+                        pending[seq] = (record['kind'], record.get('ts'), record['body'])
+                    elif record['op'] == 'ack':
+                        pending.pop(seq, None)
+
+        with self._lock:
+            self._pending = pending
+            self._seq = max_seq
+            self._compact_locked()
+
+        logger.info(f"webhook 日誌恢復完成，待處理 {len(pending)} 筆，"
+                    f"耗時 {(time.monotonic() - started) * 1000:.1f}ms")
+        return [(seq, kind, ts, body) for seq, (kind, ts, body) in sorted(pending.items())]
+
+    def append(self, kind, body):
+        """
+        寫入一筆已接受的 webhook
+
+        Args:
+            kind: 通知種類 (exit / entry)
+            body: 通知原始字串
+
+        Returns:
+            int: 記錄序號，派發完成後用於 ack
+        """
+        with self._lock:
+            if self._fd is None:
+                self._open()
+            self._seq += 1
+            seq = self._seq
+            ts = time.time()
+            self._write({'op': 'put', 'seq': seq, 'kind': kind, 'ts': ts, 'body': body})
+            self._pending[seq] = (kind, ts, body)
+            return seq
+
+    def ack(self, seq):
+        """標記記錄已處理完成"""
+        if seq is None:
+            return
+        with self._lock:
+            if self._pending.pop(seq, None) is None:
+                return
+            self._write({'op': 'ack', 'seq': seq})
+            self._acked_since_compact += 1
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
+
+    def _compact_locked(self):
+        """只保留未 ack 的記錄重寫檔案，呼叫前須持有鎖"""
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for seq, (kind, ts, body) in sorted(self._pending.items()):
+                f.write(json_backend.dumps({'op': 'put', 'seq': seq, 'kind': kind, 'ts': ts, 'body': body}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        if self._fd is not None:
+            os.close(self._fd)
+        os.replace(tmp_path, self.path)
+        self._open()
+        self._acked_since_compact = 0
+        self._dirty = False
+
+    def _flush_loop(self):
+        while self.is_running:
+            time.sleep(self.fsync_interval)
+            try:
+                fd = None
+                with self._lock:
+                    if self._acked_since_compact >= self.compact_threshold:
+                        # 壓縮本身已 fsync
+                        self._compact_locked()
+                    elif self._dirty and self._fd is not None:
+                        fd = self._fd
+                        self._dirty = False
+                # fsync 不持有鎖，避免阻塞 append；壓縮只在本線程執行，fd 不會被關閉
+                if fd is not None:
+                    os.fsync(fd)
+            except Exception as e:
+                logger.error(f"webhook 日誌 fsync 時發生錯誤: {str(e)}")
+
+    def start(self):
+        """啟動批次 fsync 線程"""
+        if self._flush_thread and self._flush_thread.is_alive():
+            return
+        with self._lock:
+            if self._fd is None:
+                self._open()
+        self.is_running = True
+        self._flush_thread = threading.Thread(target=self._flush_loop, name="WebhookJournalFlush", daemon=True)
+        self._flush_thread.start()
+
+    def stop(self):
+        """停止線程並做最後一次 fsync"""
+        self.is_running = False
+        with self._lock:
+            if self._fd is not None:
+                os.fsync(self._fd)
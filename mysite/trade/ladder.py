@@ -0,0 +1,195 @@
+from decimal import Decimal
+
+import numpy as np
+
+GEOMETRIC = 'geometric'
+ARITHMETIC = 'arithmetic'
+
+# 浮點數換算成 tick 數時的容差，避免 123.99999999 被 floor 成 123
+_TICK_EPSILON = 1e-7
+
+
+def tick_scale(tick_size, price_precision):
+    """
+    將 tick size 表示為整數比例
+
+    Args:
+        tick_size: tick size (float 或字串)
+        price_precision: 價格小數位數
+
+    Returns:
+        tuple: (tick_units, scale)，tick_size == tick_units / 10 ** scale
+    """
+    tick = Decimal(repr(tick_size) if isinstance(tick_size, float) else str(tick_size)).normalize()
+    scale = max(int(price_precision), -tick.as_tuple().exponent, 0)
+    return int(tick.scaleb(scale)), scale
+
+
+def format_scaled(values, scale):
+    """
+    將已放大 10 ** scale 倍的非負整數陣列轉為精確的小數字串
+
+    Args:
+        values: 整數陣列
+        scale: 小數位數
+
+    Returns:
+        list[str]: 小數字串列表
+    """
+    if scale <= 0:
+        return list(map(str, values.tolist()))
+    integers, fractions = np.divmod(values, 10 ** scale)
+    template = f"{{}}.{{:0{scale}d}}".format
+    return list(map(template, integers.tolist(), fractions.tolist()))
+
+
+def _spread(ticks, direction):
+    """
+    讓相鄰價位至少相差一個 tick
+
+    間距小於 tick size 時多個價位會落在同一 tick，此時將較遠的價位往外推，
+    維持每邊 depth 個不重複的價位。
+
+    Args:
+        ticks: 由近到遠的 tick 數
+        direction: -1 為買單 (遞減)，1 為賣單 (遞增)
+
+    Returns:
+        np.ndarray: 嚴格單調的 tick 數
+    """
+    if len(ticks) < 2:
+        return ticks
+    offsets = np.arange(len(ticks), dtype=np.int64) * direction
+    accumulate = np.maximum.accumulate if direction > 0 else np.minimum.accumulate
+    return accumulate(ticks - offsets) + offsets
+
+
+def ladder_ticks(base_price, depth, step_rate, tick_size, mode=GEOMETRIC):
+    """
+    以向量運算產生買賣價位的 tick 數
+
+    買單向下取整、賣單向上取整，皆由最接近基準價的價位開始排列。
+    tick size 相對 step_rate 過大時，重複的價位會往外推開一個 tick，每邊仍為 depth 個價位。
+
+    Args:
+        base_price: 基準價格
+        depth: 每邊價位數量
+        step_rate: 價格間距比例，例如 0.005
+        tick_size: tick size
+        mode: GEOMETRIC (base * (1 ± r) ** k) 或 ARITHMETIC (base * (1 ± r * k))
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: (buy_ticks, sell_ticks)，int64
+    """
+    k = np.arange(1, depth + 1, dtype=np.float64)
+    if mode == GEOMETRIC:
+        buy_raw = base_price * (1 - step_rate) ** k
+        sell_raw = base_price * (1 + step_rate) ** k
+    elif mode == ARITHMETIC:
+        buy_raw = base_price * (1 - step_rate * k)
+        sell_raw = base_price * (1 + step_rate * k)
+    else:
+        raise ValueError(f"未知的網格模式: {mode}")
+
+    tick = float(tick_size)
+    buy_ticks = np.floor(buy_raw / tick + _TICK_EPSILON).astype(np.int64)
+    sell_ticks = np.ceil(sell_raw / tick - _TICK_EPSILON).astype(np.int64)
+    buy_ticks = _spread(buy_ticks, -1)
+    return buy_ticks[buy_ticks > 0], _spread(sell_ticks, 1)
+
+
+def grid_quantities(prices, budget, min_notional, quantity_precision):
+    """
+    以向量運算計算每個價位的下單數量
+
+    與 get_grid_quantity 相同: max(int(min_notional / price) + 1, budget / price)
+
+    Args:
+        prices: 價格陣列
+        budget: 每格投入的名目金額 (可用保證金 * 比例 * 槓桿 * 槓桿率)
+        min_notional: 最小名目價值
+        quantity_precision: 數量小數位數
+
+    Returns:
+        list[str]: 數量字串列表
+    """
+    quantities = np.maximum(np.floor(min_notional / prices) + 1, budget / prices)
+    scale = int(quantity_precision)
+    return format_scaled(np.round(quantities * 10 ** scale).astype(np.int64), scale)
+
+
+class Ladder:
+    """
+    一組網格價位與數量，價格為精確的 tick 倍數字串
+    """
+
+    __slots__ = ('buy_prices', 'sell_prices', 'buy_quantities', 'sell_quantities')
+
+    def __init__(self, buy_prices, sell_prices, buy_quantities, sell_quantities):
+        self.buy_prices = buy_prices
+        self.sell_prices = sell_prices
+        self.buy_quantities = buy_quantities
+        self.sell_quantities = sell_quantities
+
+    def orders(self, symbol, client_order_prefix):
+        """
+        轉為 futures_place_batch_order 的下單參數，買單在前、由近到遠
+        """
+        orders = []
+        for side, code, prices, quantities in (
+                ('BUY', 'B', self.buy_prices, self.buy_quantities),
+                ('SELL', 'S', self.sell_prices, self.sell_quantities)):
+            for i, (price, quantity) in enumerate(zip(prices, quantities)):
+                orders.append({
+                    'symbol': symbol,
+                    'side': side,
+                    'type': 'LIMIT',
+                    'timeInForce': 'GTC',
+                    'price': price,
+                    'quantity': quantity,
+                    'newClientOrderId': f"{client_order_prefix}_{code}{i + 1}"
+                })
+        return orders
+
+
+def build_ladder(base_price, depth, step_rate, tick_size, price_precision, quantity_precision,
+                 buy_budget, sell_budget, min_notional, mode=GEOMETRIC):
+    """
+    一次產生 depth 層買賣網格的價格與數量
+
+    Args:
+        base_price: 基準價格
+        depth: 每邊價位數量
+        step_rate: 價格間距比例
+        tick_size: tick size
+        price_precision: 價格小數位數
+        quantity_precision: 數量小數位數
+        buy_budget: 買單每格名目金額
+        sell_budget: 賣單每格名目金額
+        min_notional: 最小名目價值
+        mode: GEOMETRIC 或 ARITHMETIC
+
+    Returns:
+        Ladder: 網格價位與數量
+    """
+    buy_ticks, sell_ticks = ladder_ticks(base_price, depth, step_rate, tick_size, mode)
+    tick_units, scale = tick_scale(tick_size, price_precision)
+    tick = float(tick_size)
+    return Ladder(
+        buy_prices=format_scaled(buy_ticks * tick_units, scale),
+        sell_prices=format_scaled(sell_ticks * tick_units, scale),
+        buy_quantities=grid_quantities(buy_ticks * tick, buy_budget, min_notional, quantity_precision),
+        sell_quantities=grid_quantities(sell_ticks * tick, sell_budget, min_notional, quantity_precision),
+    )
+
+
+def linear_levels(lower_bound, upper_bound, grids, tick_size, price_precision):
+    """
+    在上下界之間 (含) 產生 grids + 1 個等距價位，四捨五入到 tick
+
+    Returns:
+        list[float]: 由低到高排序的價格點位
+    """
+    tick_units, scale = tick_scale(tick_size, price_precision)
+    ticks = np.round(np.linspace(lower_bound, upper_bound, grids + 1) / float(tick_size)).astype(np.int64)
+    return np.round(ticks * tick_units / 10 ** scale, int(price_precision)).tolist()
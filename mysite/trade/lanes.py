@@ -0,0 +1,123 @@
+import logging
+import queue
+import threading
+import time
+import zlib
+
+from .metrics import metrics
+
+logger = logging.getLogger('trade')
+
+lane_queue_depth = metrics.gauge('lane_queue_depth', '各執行道等待中的任務數量', ('executor', 'lane'))
+lane_lag_seconds = metrics.histogram('lane_lag_seconds', '任務入列到開始執行的等待時間(秒)', ('executor',))
+lane_backpressure_total = metrics.counter('lane_backpressure_total', '執行道已滿而阻塞提交端的次數', ('executor',))
+lane_rejected_total = metrics.counter('lane_rejected_total', '執行道已滿且提交端不可阻塞而拒絕的任務數量', ('executor',))
+lane_tasks_total = metrics.counter('lane_tasks_total', '執行道完成的任務數量', ('executor', 'result'))
+
+_STOP = object()
+
+
+class SymbolLaneExecutor:
+    """
+    依鍵 (交易對) 分配到固定執行道的執行器
+
+    以 crc32(key) 選擇執行道，每條執行道一條線程依入列順序執行，因此同一交易對的事件保持交易所送出的順序，
+    不同交易對在不同執行道並行。每條執行道的佇列有上限，滿時提交端阻塞等待 (背壓)，而不是無限累積；
+    不可阻塞的提交端 (例如串流事件迴圈) 以 block=False 提交，佇列已滿時直接返回 False 由呼叫端補救。
+    """
+
+    def __init__(self, name, lanes=8, max_queue=1000):
+        """
+        Args:
+            name: 執行器名稱，用於線程名稱與指標標籤
+            lanes: 執行道數量
+            max_queue: 每條執行道的佇列上限
+        """
+        self.name = name
+        self._queues = [queue.Queue(maxsize=max_queue) for _ in range(lanes)]
+        self._threads = []
+        self._inflight = 0
+        self._inflight_lock = threading.Lock()
+        self._shutdown = False
+        self.backpressure = 0
+        for index, lane in enumerate(self._queues):
+            thread = threading.Thread(target=self._run, args=(lane,), name=f"{name}-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        lane_queue_depth.set_function(
+            lambda: {(self.name, str(index)): lane.qsize() for index, lane in enumerate(self._queues)})
+
+    @property
+    def lanes(self):
+        return len(self._queues)
+
+    def lane_for(self, key):
+        """依鍵取得執行道編號，使用 crc32 確保跨行程穩定"""
+        return zlib.crc32(str(key).encode('utf-8')) % len(self._queues)
+
+    def submit(self, key, fn, *args, block=True):
+        """
+        將任務放入鍵所屬的執行道
+
+        Args:
+            key: 分配執行道的鍵
+            fn: 任務函數
+            block: 執行道已滿時是否阻塞直到有空位，False 時直接返回 False
+
+        Returns:
+            bool: 是否成功放入 (已關閉或不阻塞且已滿時返回 False)
+        """
+        if self._shutdown:
+            return False
+        lane = self._queues[self.lane_for(key)]
+        item = (time.monotonic(), fn, args)
+        try:
+            lane.put_nowait(item)
+        except queue.Full:
+            if not block:
+                lane_rejected_total.inc(self.name)
+                return False
+            lane_backpressure_total.inc(self.name)
+            self.backpressure += 1
+            # 持續滿載時每 100 次記錄一次，詳細次數見 lane_backpressure_total
+            if self.backpressure % 100 == 1:
+                logger.warning(f"{self.name} 執行道 {self.lane_for(key)} 已滿 ({lane.maxsize})，等待空位 - key: {key}")
+            lane.put(item)
+        return True
+
+    def _run(self, lane):
+        while True:
+            item = lane.get()
+            if item is _STOP:
+                return
+            enqueued_at, fn, args = item
+            lane_lag_seconds.observe(time.monotonic() - enqueued_at, self.name)
+            with self._inflight_lock:
+                self._inflight += 1
+            try:
+                fn(*args)
+                lane_tasks_total.inc(self.name, 'ok')
+            except Exception as e:
+                lane_tasks_total.inc(self.name, 'error')
+                logger.error(f"{self.name} 執行任務時發生錯誤: {str(e)}")
+            finally:
+                with self._inflight_lock:
+                    self._inflight -= 1
+
+    def shutdown(self, wait=True):
+        """停止接收新任務，已入列的任務執行完畢後結束各執行道"""
+        self._shutdown = True
+        for lane in self._queues:
+            lane.put(_STOP)
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def stats(self):
+        with self._inflight_lock:
+            inflight = self._inflight
+        return {
+            'lanes': [lane.qsize() for lane in self._queues],
+            'inflight': inflight,
+            'backpressure': self.backpressure,
+        }
@@ -0,0 +1,109 @@
+import logging
+import time
+from collections import namedtuple
+
+from .metrics import metrics
+
+logger = logging.getLogger('trade')
+
+# 不可變的最新標記價格，received_at 為本機收到時間 (time.monotonic())
+MarkPrice = namedtuple('MarkPrice', (
+    'symbol', 'mark_price', 'index_price', 'estimated_settle_price',
+    'funding_rate', 'next_funding_time', 'event_time', 'received_at'
+))
+
+mark_price_lookups_total = metrics.counter('mark_price_lookups_total', '標記價格查詢次數', ('source',))
+mark_price_stream_age_seconds = metrics.gauge('mark_price_stream_age_seconds', '距離上次收到標記價格串流的秒數')
+
+
+class MarkPriceCache:
+    """
+    全市場標記價格的最新值表
+
+    由 !markPrice@arr@1s 串流更新，每個交易對保存一個不可變的 MarkPrice。
+    寫入只替換 dict 中的參照，讀取不需加鎖；讀取端依 received_at 判斷是否過期，過期時應改用 REST。
+    """
+
+    def __init__(self, max_age=3.0):
+        """
+        Args:
+            max_age: 超過此秒數未更新視為過期
+        """
+        self.max_age = max_age
+        self._prices = {}
+        self._last_message_at = None
+        self.messages = 0
+        mark_price_stream_age_seconds.set_function(
+            lambda: time.monotonic() - self._last_message_at if self._last_message_at else -1)
+
+    def apply(self, msg):
+        """
+        串流 callback，msg 為 markPriceUpdate 列表或 combined stream 的 {'stream', 'data'}，錯誤訊息只記錄
+
+        只有實際套用到價格時才更新串流時間，避免格式不符時年齡指標看似正常而快取是空的。
+        """
+        if isinstance(msg, dict):
+            if msg.get('e') == 'error':
+                logger.warning(f"標記價格串流錯誤: {msg}")
+                return
+            msg = msg['data'] if 'data' in msg else msg
+            if isinstance(msg, dict):
+                msg = [msg]
+        received_at = time.monotonic()
+        applied = 0
+        for item in msg:
+            if item.get('e') != 'markPriceUpdate':
+                continue
+            applied += 1
+            self._prices[item['s']] = MarkPrice(
+                symbol=item['s'],
+                mark_price=float(item['p']),
+                index_price=float(item.get('i', 0)),
+                estimated_settle_price=float(item.get('P', 0)),
+                funding_rate=float(item.get('r') or 0),
+                next_funding_time=int(item.get('T', 0)),
+                event_time=int(item['E']),
+                received_at=received_at,
+            )
+        if not applied:
+            return
+        self._last_message_at = received_at
+        self.messages += 1
+
+    def get(self, symbol):
+        """取得最新值 (不論是否過期)，沒有資料返回 None"""
+        return self._prices.get(symbol)
+
+    def lookup(self, symbol, max_age=None):
+        """
+        取得未過期的最新值
+
+        Args:
+            symbol: 交易對
+            max_age: 可接受的秒數，預設使用建構時的設定
+
+        Returns:
+            MarkPrice: 沒有資料或已過期返回 None
+        """
+        price = self._prices.get(symbol)
+        if price is None:
+            return None
+        if time.monotonic() - price.received_at > (self.max_age if max_age is None else max_age):
+            return None
+        return price
+
+    def age(self):
+        """距離上次收到串流訊息的秒數，尚未收到返回 None"""
+        last = self._last_message_at
+        return time.monotonic() - last if last else None
+
+    def stats(self):
+        last = self._last_message_at
+        return {
+            'symbols': len(self._prices),
+            'messages': self.messages,
+            'age': round(time.monotonic() - last, 3) if last else None,
+        }
+
+
+mark_price_cache = MarkPriceCache()
@@ -0,0 +1,167 @@
+import bisect
+import threading
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """
+    指標基底類別
+
+    標籤值以位置參數依 labelnames 順序傳入，內部以 tuple 為鍵，熱路徑只有一次字典操作。
+    set_function() 設定後改為在輸出時才計算 (例如佇列深度)，不佔用熱路徑。
+    """
+
+    metric_type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        self._function = None
+
+    def set_function(self, function):
+        """
+        設定輸出時呼叫的函數
+
+        Args:
+            function: 無參數函數，返回數值或 {標籤值 tuple: 數值}
+        """
+        self._function = function
+
+    def _labels(self, values, extra=()):
+        pairs = list(zip(self.labelnames, values)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}'
+
+    def _snapshot(self):
+        if self._function is not None:
+            value = self._function()
+            return dict(value) if isinstance(value, dict) else {(): value}
+        with self._lock:
+            return dict(self._values)
+
+    def samples(self):
+        for labels, value in sorted(self._snapshot().items()):
+            yield self.name, self._labels(labels), value
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.metric_type}",
+        ]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{labels} {_format_value(value)}")
+        return '\n'.join(lines)
+
+
+class Counter(_Metric):
+    metric_type = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    metric_type = 'gauge'
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Metric):
+    metric_type = 'histogram'
+
+    DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                # [各區間計數..., +Inf 區間計數, 總和, 次數]
+                state = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def _snapshot(self):
+        with self._lock:
+            return {labels: list(state) for labels, state in self._values.items()}
+
+    def samples(self):
+        for labels, state in sorted(self._snapshot().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), state):
+                cumulative += count
+                yield f"{self.name}_bucket", self._labels(labels, (('le', _format_value(float(bound))),)), cumulative
+            yield f"{self.name}_sum", self._labels(labels), state[-2]
+            yield f"{self.name}_count", self._labels(labels), state[-1]
+
+
+class MetricsRegistry:
+    """
+    行程內的指標註冊表，render() 輸出 Prometheus 文字格式
+
+    同名指標重複註冊時返回既有實例，模組重新載入也不會重複。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _register(self, cls, name, documentation, labelnames=(), **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=Histogram.DEFAULT_BUCKETS):
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        blocks = []
+        for metric in metrics:
+            try:
+                blocks.append(metric.render())
+            except Exception as e:
+                blocks.append(f"# {metric.name} unavailable: {_escape(e)}")
+        return '\n'.join(blocks) + '\n'
+
+
+metrics = MetricsRegistry()
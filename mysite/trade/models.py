@@ -42,6 +42,7 @@ class Strategy(models.Model):
     hold_reduce_rate = models.DecimalField(max_digits=10, decimal_places=2)
     short_hold_rate = models.DecimalField(max_digits=10, decimal_places=2)
     short_leverage_rate = models.DecimalField(max_digits=10, decimal_places=2)
+    grid_depth = models.IntegerField(default=5)
 
     class Meta:
         db_table = 'strategies'
@@ -0,0 +1,145 @@
+import time
+
+try:
+    import ujson as json_backend
+except ImportError:  # pragma: no cover - ujson 不存在時退回標準庫
+    import json as json_backend
+
+
+class NotificationDecodeError(ValueError):
+    """通知內容無法解析或欄位格式錯誤"""
+
+
+def _to_float(value):
+    return float(value)
+
+
+def _to_int(value):
+    # TradingView 的數字可能帶小數點，例如 "5.0"
+    return int(float(value))
+
+
+def _to_str(value):
+    return str(value)
+
+
+# 欄位規格: (屬性名稱, 來源, 欄位名稱, 轉換函數, 預設值)
+# 來源: 'body' 為外層通知，'message' 為內層 message，'long'/'short' 為 strategy 參數
+_FIELD_SPECS = (
+    ('passphrase', 'body', 'passphrase', _to_str, None),
+    ('ticker', 'body', 'ticker', _to_str, None),
+    ('strategy_type', 'body', 'type', _to_str, None),
+    ('entry', 'body', 'entry', _to_float, None),
+    ('position_size', 'body', 'position_size', _to_float, None),
+    ('order', 'body', 'order', _to_str, None),
+    ('unit', 'body', 'unit', _to_float, None),
+    ('bar_time', 'body', 'time', _to_str, None),
+    ('message_type', 'message', 'type', _to_str, None),
+    ('lev', 'message', 'lev', _to_int, None),
+    ('sl', 'message', 'sl', _to_float, None),
+    ('eq', 'message', 'eq', _to_int, None),
+    ('grids', 'message', 'grids', _to_int, 0),
+    ('grid_index', 'message', 'gridIndex', _to_int, 0),
+    ('leverage', 'message', 'leverage', _to_int, 1),
+    ('weight', 'message', 'weight', _to_float, 1.0),
+    ('total_weight', 'message', 'totalWeight', _to_float, 10.0),
+    ('lower_bound', 'message', 'lower_bound', _to_float, None),
+    ('upper_bound', 'message', 'upper_bound', _to_float, None),
+    ('long_times', 'long', 'times', _to_int, None),
+    ('long_stop_loss', 'long', 'stopLoss', _to_float, None),
+    ('long_take_profit', 'long', 'takeProfit', _to_float, None),
+    ('short_times', 'short', 'times', _to_int, None),
+    ('short_stop_loss', 'short', 'stopLoss', _to_float, None),
+    ('short_take_profit', 'short', 'takeProfit', _to_float, None),
+)
+
+
+def _compile(specs):
+    """依來源分組欄位規格，解析時每個來源只需走訪一次"""
+    compiled = {}
+    for attr, source, key, convert, default in specs:
+        compiled.setdefault(source, []).append((attr, key, convert, default))
+    return tuple((source, tuple(fields)) for source, fields in compiled.items())
+
+
+_COMPILED_SPECS = _compile(_FIELD_SPECS)
+
+
+class Notification:
+    """
+    解析後的 TradingView 通知
+
+    在入口處一次解析完成，之後放入佇列並往下傳給各個 handler，
+    不再重複 json.loads。
+    """
+
+    __slots__ = ('raw', 'message', 'received_at') + tuple(spec[0] for spec in _FIELD_SPECS)
+
+    @property
+    def shard_key(self):
+        """分片鍵 (策略/交易對)"""
+        return f"{self.passphrase}:{self.ticker}"
+
+    def __repr__(self):
+        return (f"Notification(type={self.strategy_type}, message_type={self.message_type}, "
+                f"ticker={self.ticker}, entry={self.entry}, position_size={self.position_size})")
+
+
+def decode_notification(body):
+    """
+    解析通知內容
+
+    Args:
+        body: 通知原始字串
+
+    Returns:
+        Notification: 解析後的通知
+
+    Raises:
+        NotificationDecodeError: JSON 格式錯誤或數值欄位無法轉換
+    """
+    try:
+        payload = json_backend.loads(body)
+    except (ValueError, TypeError) as e:
+        raise NotificationDecodeError(f"通知不是合法的 JSON: {e}")
+    if not isinstance(payload, dict):
+        raise NotificationDecodeError("通知必須為 JSON 物件")
+
+    message = payload.get('message')
+    if isinstance(message, str):
+        if message:
+            try:
+                message = json_backend.loads(message)
+            except (ValueError, TypeError) as e:
+                raise NotificationDecodeError(f"message 不是合法的 JSON: {e}")
+        else:
+            message = None
+    if message is not None and not isinstance(message, dict):
+        raise NotificationDecodeError("message 必須為 JSON 物件")
+
+    strategy_params = payload.get('strategy')
+    if not isinstance(strategy_params, dict):
+        strategy_params = {}
+    sources = {
+        'body': payload,
+        'message': message or {},
+        'long': strategy_params.get('long') or {},
+        'short': strategy_params.get('short') or {},
+    }
+
+    notification = Notification()
+    notification.raw = body
+    notification.received_at = time.monotonic()
+    notification.message = message
+    for source, fields in _COMPILED_SPECS:
+        values = sources[source]
+        for attr, key, convert, default in fields:
+            value = values.get(key)
+            if value is None or value == '':
+                setattr(notification, attr, default)
+                continue
+            try:
+                setattr(notification, attr, convert(value))
+            except (ValueError, TypeError):
+                raise NotificationDecodeError(f"欄位 {key} 格式錯誤: {value!r}")
+    return notification
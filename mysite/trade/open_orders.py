@@ -0,0 +1,242 @@
+import logging
+import threading
+import zlib
+from collections import deque
+
+from .metrics import metrics
+
+logger = logging.getLogger('trade')
+
+# 訂單離開掛單簿的狀態
+TERMINAL_STATUSES = ('FILLED', 'CANCELED', 'EXPIRED', 'REJECTED', 'EXPIRED_IN_MATCH')
+
+# ORDER_TRADE_UPDATE 'o' 欄位對應的 REST 訂單欄位
+_WS_ORDER_FIELDS = (
+    ('s', 'symbol'),
+    ('c', 'clientOrderId'),
+    ('S', 'side'),
+    ('o', 'type'),
+    ('f', 'timeInForce'),
+    ('q', 'origQty'),
+    ('p', 'price'),
+    ('ap', 'avgPrice'),
+    ('sp', 'stopPrice'),
+    ('X', 'status'),
+    ('i', 'orderId'),
+    ('z', 'executedQty'),
+    ('R', 'reduceOnly'),
+    ('ps', 'positionSide'),
+    ('cp', 'closePosition'),
+    ('ot', 'origType'),
+    ('T', 'updateTime'),
+)
+
+open_orders_gauge = metrics.gauge('open_orders', '本地掛單簿的掛單數量', ('symbol',))
+open_order_reconcile_total = metrics.counter(
+    'open_order_reconcile_total', '掛單簿與 REST 對帳次數', ('result',))
+
+
+def order_from_ws_event(order):
+    """將 ORDER_TRADE_UPDATE 的 'o' 轉為 REST futures_get_open_orders 的欄位格式"""
+    return {rest_key: order[ws_key] for ws_key, rest_key in _WS_ORDER_FIELDS if ws_key in order}
+
+
+def orders_checksum(orders):
+    """以 (orderId, status, executedQty) 計算掛單集合的檢查碼"""
+    keys = sorted(f"{order['orderId']}:{order.get('status')}:{order.get('executedQty')}" for order in orders)
+    return zlib.crc32('|'.join(keys).encode('utf-8'))
+
+
+class OpenOrderMirror:
+    """
+    主帳戶的本地掛單簿
+
+    啟動時以 REST 載入一次，之後由 user data stream 的 ORDER_TRADE_UPDATE 與下單/撤單的 REST 回應增量更新，
+    掛單格式與 futures_get_open_orders 相同，呼叫端可直接替換。
+    - 已結束的訂單 ID 記錄在有上限的集合中，避免延遲到達的 NEW 事件讓訂單復活
+    - 依 updateTime 忽略比目前狀態舊的更新
+    - 載入期間收到的事件暫存，快照安裝後重新套用
+    - reconcile() 定期與 REST 比對檢查碼，不一致時以 REST 為準
+    只追蹤主帳戶 (user data stream 所屬帳戶)，其他帳戶的 REST 回應不應寫入。
+    """
+
+    def __init__(self, closed_guard_size=10000):
+        """
+        Args:
+            closed_guard_size: 保留的已結束訂單 ID 數量
+        """
+        self._lock = threading.Lock()
+        self._orders = {}
+        self._closed_ids = set()
+        self._closed_order = deque()
+        self._closed_guard_size = closed_guard_size
+        self._loading = 0
+        self._buffer = []
+        self._ready = False
+        self.events = 0
+        self.mismatches = 0
+        open_orders_gauge.set_function(self._count_by_symbol)
+
+    def _count_by_symbol(self):
+        with self._lock:
+            counts = {}
+            for order in self._orders.values():
+                key = (order['symbol'],)
+                counts[key] = counts.get(key, 0) + 1
+            return counts
+
+    def _mark_closed_locked(self, order_id):
+        if order_id in self._closed_ids:
+            return
+        self._closed_ids.add(order_id)
+        self._closed_order.append(order_id)
+        while len(self._closed_order) > self._closed_guard_size:
+            self._closed_ids.discard(self._closed_order.popleft())
+
+    def _apply_locked(self, order):
+        order_id = order.get('orderId')
+        if order_id is None:
+            return
+        if order_id in self._closed_ids:
+            return
+        existing = self._orders.get(order_id)
+        if existing is not None and int(existing.get('updateTime') or 0) > int(order.get('updateTime') or 0):
+            return
+        if order.get('status') in TERMINAL_STATUSES:
+            self._orders.pop(order_id, None)
+            self._mark_closed_locked(order_id)
+        elif existing is not None:
+            existing.update(order)
+        else:
+            order = dict(order)
+            order.setdefault('time', order.get('updateTime', 0))
+            self._orders[order_id] = order
+
+    def _apply(self, order):
+        with self._lock:
+            if self._loading:
+                self._buffer.append(order)
+            self._apply_locked(order)
+
+    def apply_event(self, msg):
+        """套用 user data stream 事件，只處理 ORDER_TRADE_UPDATE"""
+        if msg.get('e') != 'ORDER_TRADE_UPDATE':
+            return
+        self.events += 1
+        self._apply(order_from_ws_event(msg['o']))
+
+    def record_orders(self, orders):
+        """
+        套用下單/撤單/查單的 REST 回應
+
+        Args:
+            orders: 單筆訂單 dict 或批次下單回應列表，錯誤項目 (含 code) 會略過
+        """
+        if isinstance(orders, dict):
+            orders = [orders]
+        for order in orders or []:
+            if isinstance(order, dict) and 'orderId' in order:
+                self._apply(order)
+
+    def record_canceled(self, symbol):
+        """futures_cancel_all_open_orders 成功後移除該交易對所有掛單"""
+        with self._lock:
+            for order_id in [oid for oid, order in self._orders.items() if order['symbol'] == symbol]:
+                self._orders.pop(order_id)
+                self._mark_closed_locked(order_id)
+
+    def symbols(self):
+        """目前有掛單的交易對"""
+        with self._lock:
+            return {order['symbol'] for order in self._orders.values()}
+
+    def invalidate(self):
+        """事件可能遺漏時 (例如 WebSocket 重連) 標記需要重新載入"""
+        with self._lock:
+            self._ready = False
+
+    def is_ready(self):
+        with self._lock:
+            return self._ready
+
+    def load(self, client):
+        """
+        以 REST 載入全部掛單
+
+        Args:
+            client: 主帳戶 Binance client
+
+        Returns:
+            bool: 載入前的本地掛單簿是否與 REST 一致 (首次載入返回 True)
+        """
+        with self._lock:
+            self._loading += 1
+        try:
+            orders = client.futures_get_open_orders()
+        except Exception:
+            with self._lock:
+                self._loading -= 1
+                if not self._loading:
+                    self._buffer = []
+            raise
+
+        with self._lock:
+            was_ready = self._ready
+            before = orders_checksum(self._orders.values())
+            snapshot = {}
+            for order in orders:
+                if order['orderId'] not in self._closed_ids:
+                    snapshot[order['orderId']] = dict(order)
+            self._orders = snapshot
+            for order in self._buffer:
+                self._apply_locked(order)
+            self._loading -= 1
+            if not self._loading:
+                self._buffer = []
+            self._ready = True
+            matched = not was_ready or before == orders_checksum(self._orders.values())
+            if not matched:
+                self.mismatches += 1
+            return matched
+
+    def reconcile(self, client):
+        """與 REST 比對檢查碼，不一致時以 REST 快照取代並記錄"""
+        try:
+            matched = self.load(client)
+        except Exception as e:
+            open_order_reconcile_total.inc('error')
+            logger.error(f"掛單簿對帳時發生錯誤: {str(e)}")
+            return False
+        open_order_reconcile_total.inc('match' if matched else 'mismatch')
+        if not matched:
+            logger.warning("本地掛單簿與 REST 不一致，已以 REST 快照取代")
+        return matched
+
+    def get_open_orders(self, client, symbol=None):
+        """
+        取得掛單，尚未載入時先以 REST 載入
+
+        Args:
+            client: 主帳戶 Binance client，僅在需要載入時使用
+            symbol: 交易對，None 表示全部
+
+        Returns:
+            list[dict]: 與 futures_get_open_orders 相同格式的掛單副本
+        """
+        if not self.is_ready():
+            self.load(client)
+        with self._lock:
+            return [dict(order) for order in self._orders.values()
+                    if symbol is None or order['symbol'] == symbol]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'ready': self._ready,
+                'orders': len(self._orders),
+                'events': self.events,
+                'mismatches': self.mismatches,
+            }
+
+
+open_order_mirror = OpenOrderMirror()
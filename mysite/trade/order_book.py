@@ -0,0 +1,404 @@
+import logging
+import math
+import threading
+import time
+
+from .metrics import metrics
+from .stream_hub import stream_hub
+
+logger = logging.getLogger('trade')
+
+# REST 快照深度
+SNAPSHOT_LIMIT = 1000
+# 同步前暫存的事件上限，超過時丟棄最舊的 (快照只需要接上最新的事件)
+MAX_BUFFERED_EVENTS = 1000
+
+order_book_resyncs_total = metrics.counter('order_book_resyncs_total', '本地深度簿重新同步次數', ('symbol', 'reason'))
+order_book_age_seconds = metrics.gauge('order_book_age_seconds', '距離深度簿上次更新的秒數', ('symbol',))
+
+
+class OrderBook:
+    """
+    單一交易對的本地深度簿
+
+    依 Binance 期貨 diff depth 的同步規則維護：
+    - 快照載入前收到的事件暫存，丟棄 u < lastUpdateId 的事件，第一筆需滿足 U <= lastUpdateId <= u，
+      這一筆不檢查 pu (pu 是前一筆事件的 u，不是快照的 lastUpdateId)
+    - 快照載入時沒有可接上的暫存事件，則等待第一筆滿足上述條件的即時事件作為同步點
+    - 之後每筆事件的 pu 必須等於上一筆的 u，否則標記失效並重新取得快照
+    """
+
+    def __init__(self, symbol):
+        self.symbol = symbol
+        self._lock = threading.Lock()
+        self._bids = {}
+        self._asks = {}
+        self._buffer = []
+        self._last_update_id = None
+        self._ready = False
+        self._syncing = False
+        # 快照已載入，等待第一筆可接上的事件
+        self._awaiting_first = False
+        self.updated_at = None
+        self.resyncs = 0
+
+    def _apply_levels(self, book, levels):
+        for price, quantity in levels:
+            price = float(price)
+            quantity = float(quantity)
+            if quantity == 0:
+                book.pop(price, None)
+            else:
+                book[price] = quantity
+
+    def _apply(self, event):
+        self._apply_levels(self._bids, event['b'])
+        self._apply_levels(self._asks, event['a'])
+        self._last_update_id = event['u']
+        self.updated_at = time.monotonic()
+
+    def apply_event(self, event):
+        """
+        套用 depthUpdate 事件
+
+        Returns:
+            bool: 事件不連續或尚未同步且沒有進行中的同步時返回 False，需要重新同步
+        """
+        with self._lock:
+            if self._awaiting_first:
+                if event['u'] < self._last_update_id:
+                    return True
+                self._awaiting_first = False
+                if event['U'] > self._last_update_id:
+                    # 快照比事件舊，中間有缺口
+                    self._syncing = False
+                    self._buffer = [event]
+                    return False
+                self._apply(event)
+                self._syncing = False
+                self._ready = True
+                return True
+            if not self._ready:
+                self._buffer.append(event)
+                if len(self._buffer) > MAX_BUFFERED_EVENTS:
+                    del self._buffer[0]
+                return self._syncing
+            if event['pu'] != self._last_update_id:
+                self._ready = False
+                self._buffer = [event]
+                return False
+            self._apply(event)
+            return True
+
+    def begin_sync(self):
+        """標記開始同步，已在同步中返回 False"""
+        with self._lock:
+            if self._syncing:
+                return False
+            self._syncing = True
+            self._ready = False
+            self._awaiting_first = False
+            return True
+
+    def abort_sync(self):
+        """同步失敗，下一筆事件會再次觸發同步"""
+        with self._lock:
+            self._syncing = False
+            self._awaiting_first = False
+
+    def install_snapshot(self, snapshot):
+        """
+        安裝 REST 快照並套用暫存事件
+
+        沒有可接上的暫存事件時維持未就緒，由下一筆即時事件完成同步。
+
+        Returns:
+            bool: 暫存事件無法接上快照時返回 False，需再次取得快照
+        """
+        with self._lock:
+            last_update_id = snapshot['lastUpdateId']
+            self._bids = {}
+            self._asks = {}
+            self._apply_levels(self._bids, snapshot['bids'])
+            self._apply_levels(self._asks, snapshot['asks'])
+            self._last_update_id = last_update_id
+            buffer = [event for event in self._buffer if event['u'] >= last_update_id]
+            self._buffer = []
+            if not buffer:
+                self._awaiting_first = True
+                return True
+            if buffer[0]['U'] > last_update_id:
+                # 快照比暫存事件舊，中間有缺口
+                return False
+            for index, event in enumerate(buffer):
+                if index > 0 and event['pu'] != self._last_update_id:
+                    return False
+                self._apply(event)
+            self.updated_at = time.monotonic()
+            self._syncing = False
+            self._ready = True
+            return True
+
+    def is_ready(self):
+        return self._ready
+
+    def age(self):
+        updated_at = self.updated_at
+        return time.monotonic() - updated_at if updated_at else None
+
+    def levels(self, side, depth=None):
+        """
+        取得吃單方向的深度
+
+        Args:
+            side: 下單方向，BUY 取賣方 (由低到高)，SELL 取買方 (由高到低)
+            depth: 檔數，None 為全部
+
+        Returns:
+            list: [(price, quantity), ...]
+        """
+        with self._lock:
+            if side == 'BUY':
+                levels = sorted(self._asks.items())
+            else:
+                levels = sorted(self._bids.items(), reverse=True)
+        return levels if depth is None else levels[:depth]
+
+    def best_price(self, side):
+        """吃單方向的最優價格，沒有深度返回 None"""
+        with self._lock:
+            book = self._asks if side == 'BUY' else self._bids
+            if not book:
+                return None
+            return min(book) if side == 'BUY' else max(book)
+
+    def sweep_price(self, side, quantity, offset=0.0):
+        """
+        吃掉 offset 之後 quantity 數量所需的最差價格
+
+        Args:
+            side: 下單方向
+            quantity: 數量
+            offset: 先被其他訂單吃掉的數量
+
+        Returns:
+            float: 可見深度不足返回 None
+        """
+        needed = offset + quantity
+        cumulative = 0.0
+        for price, level_quantity in self.levels(side):
+            cumulative += level_quantity
+            if cumulative >= needed:
+                return price
+        return None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'ready': self._ready,
+                'bids': len(self._bids),
+                'asks': len(self._asks),
+                'last_update_id': self._last_update_id,
+                'resyncs': self.resyncs,
+            }
+
+
+class OrderBookCache:
+    """
+    活躍交易對的本地深度簿
+
+    track() 後由 StreamHub 的市場串流 (<symbol>@depth@100ms) 增量更新，REST 快照在背景線程取得，
+    不阻塞串流迴圈。深度簿尚未同步或已過期時 get() 返回 None，呼叫端應退回原本的下單方式。
+    sync() 定期以有效策略的交易對更新追蹤清單，其他交易對閒置 idle_after 秒後取消訂閱。
+    """
+
+    def __init__(self, hub, max_age=2.0, idle_after=300.0):
+        """
+        Args:
+            hub: StreamHub
+            max_age: 超過此秒數未更新視為過期
+            idle_after: 沒有有效策略的交易對，超過此秒數未使用即取消訂閱
+        """
+        self._hub = hub
+        self.max_age = max_age
+        self.idle_after = idle_after
+        self._books = {}
+        self._clients = {}
+        self._last_used = {}
+        self._lock = threading.Lock()
+        order_book_age_seconds.set_function(
+            lambda: {(symbol,): book.age() for symbol, book in list(self._books.items()) if book.updated_at})
+
+    def track(self, symbol, client):
+        """
+        開始維護交易對的深度簿，重複呼叫無作用
+
+        Args:
+            symbol: 交易對
+            client: 用於取得 REST 快照的 Binance client
+        """
+        with self._lock:
+            self._last_used.setdefault(symbol, time.monotonic())
+            if symbol in self._books:
+                return self._books[symbol]
+            book = self._books[symbol] = OrderBook(symbol)
+            self._clients[symbol] = client
+        self._hub.add_market_stream(f"{symbol.lower()}@depth@100ms", lambda event: self._on_event(book, event))
+        self._resync(book, 'init')
+        return book
+
+    def untrack(self, symbol):
+        with self._lock:
+            book = self._books.pop(symbol, None)
+            self._clients.pop(symbol, None)
+            self._last_used.pop(symbol, None)
+        if book is not None:
+            self._hub.remove_market_stream(f"{symbol.lower()}@depth@100ms")
+            logger.info(f"{symbol} 停止維護深度簿")
+
+    def sync(self, clients):
+        """
+        以有效策略的交易對更新追蹤清單
+
+        Args:
+            clients: {symbol: client}，需要維護深度簿的交易對與其 REST client
+
+        Returns:
+            tuple: (新增的交易對, 取消的交易對)
+        """
+        added = [symbol for symbol in clients if symbol not in self._books]
+        for symbol, client in clients.items():
+            self.track(symbol, client)
+        now = time.monotonic()
+        removed = [symbol for symbol, used_at in list(self._last_used.items())
+                   if symbol not in clients and now - used_at > self.idle_after]
+        for symbol in removed:
+            self.untrack(symbol)
+        return added, removed
+
+    def _on_event(self, book, event):
+        if event.get('e') != 'depthUpdate':
+            return
+        if not book.apply_event(event):
+            if book.updated_at is not None:
+                logger.warning(f"{book.symbol} 深度事件不連續 (pu={event['pu']})，重新取得快照")
+            self._resync(book, 'gap')
+
+    def _resync(self, book, reason):
+        if not book.begin_sync():
+            return
+        book.resyncs += 1
+        order_book_resyncs_total.inc(book.symbol, reason)
+        threading.Thread(target=self._load_snapshot, args=(book,),
+                         name=f"OrderBookSnapshot-{book.symbol}", daemon=True).start()
+
+    def _load_snapshot(self, book):
+        # 等待第一批事件進入暫存，快照才能接上
+        time.sleep(0.2)
+        client = self._clients.get(book.symbol)
+        for attempt in range(3):
+            try:
+                snapshot = client.futures_order_book(symbol=book.symbol, limit=SNAPSHOT_LIMIT)
+            except Exception as e:
+                logger.error(f"{book.symbol} 取得深度快照失敗: {str(e)}")
+                time.sleep(1 + attempt)
+                continue
+            if book.install_snapshot(snapshot):
+                logger.info(f"{book.symbol} 深度簿已載入快照 (lastUpdateId={snapshot['lastUpdateId']})")
+                return
+            time.sleep(0.5)
+        book.abort_sync()
+        logger.error(f"{book.symbol} 深度簿同步失敗，收到下一筆事件時重試")
+
+    def get(self, symbol, client=None, wait=0.0):
+        """
+        取得已同步且未過期的深度簿
+
+        Args:
+            symbol: 交易對
+            client: 尚未追蹤時用於開始追蹤
+            wait: 尚未同步時最多等待的秒數，請求路徑中應為 0 (尚未同步時退回原本的下單方式)
+
+        Returns:
+            OrderBook: 不可用時返回 None
+        """
+        book = self._books.get(symbol)
+        if book is None:
+            if client is None:
+                return None
+            book = self.track(symbol, client)
+        self._last_used[symbol] = time.monotonic()
+        deadline = time.monotonic() + wait
+        while not book.is_ready() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        if not book.is_ready():
+            return None
+        age = book.age()
+        if age is None or age > self.max_age:
+            return None
+        return book
+
+    def stats(self):
+        return {symbol: book.stats() for symbol, book in list(self._books.items())}
+
+
+def plan_depth_split(book, side, total_quantity, quantity_precision, max_parts=5, max_slippage=0.001,
+                     level_fraction=0.5):
+    """
+    依可見深度規劃 FOK 子單
+
+    子單並行送出，依序消耗同一份深度：第 n 張子單的限價為吃掉前 n-1 張與自身數量所需的最差價格。
+    每張子單不超過其價格區間內可見數量的 level_fraction，避免深度稍有變化就過期；
+    超過最優價 max_slippage 的深度不使用，剩餘數量由呼叫端以原本方式處理。
+
+    Args:
+        book: OrderBook
+        side: 下單方向
+        total_quantity: 總數量
+        quantity_precision: 數量精度
+        max_parts: 子單數量上限
+        max_slippage: 相對最優價的最大滑價比例
+        level_fraction: 子單最多使用可見深度的比例
+
+    Returns:
+        dict: {'reference_price', 'children': [{'quantity', 'price'}], 'uncovered'}，沒有深度返回 None
+    """
+    best = book.best_price(side)
+    if best is None:
+        return None
+    limit = best * (1 + max_slippage) if side == 'BUY' else best * (1 - max_slippage)
+    levels = [(price, quantity) for price, quantity in book.levels(side)
+              if (price <= limit if side == 'BUY' else price >= limit)]
+    usable = sum(quantity for _, quantity in levels) * level_fraction
+    step = 10 ** -quantity_precision
+    planned_total = min(total_quantity, usable)
+    if planned_total < step:
+        return {'reference_price': best, 'children': [], 'uncovered': total_quantity}
+
+    # 子單數量：每張不超過最優檔位可用數量，且不超過 max_parts
+    top_quantity = levels[0][1] * level_fraction
+    parts = max(1, min(max_parts, math.ceil(planned_total / max(top_quantity, step))))
+    child_quantity = math.floor(planned_total / parts / step) * step
+    if child_quantity < step:
+        parts, child_quantity = 1, math.floor(planned_total / step) * step
+
+    children = []
+    consumed = 0.0
+    for index in range(parts):
+        quantity = child_quantity if index < parts - 1 else math.floor((planned_total - consumed) / step + 1e-9) * step
+        if quantity < step:
+            break
+        # 依 level_fraction 放大後的深度計算，保留深度變化的餘裕
+        price = book.sweep_price(side, quantity / level_fraction, offset=consumed / level_fraction)
+        if price is None:
+            break
+        children.append({'quantity': round(quantity, quantity_precision), 'price': price})
+        consumed += quantity
+    return {
+        'reference_price': best,
+        'children': children,
+        'uncovered': max(0.0, total_quantity - consumed),
+    }
+
+
+order_book_cache = OrderBookCache(stream_hub)
@@ -0,0 +1,178 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from .metrics import metrics
+
+logger = logging.getLogger('trade')
+
+# 訂單不會再變化的狀態
+FINAL_STATUSES = ('FILLED', 'CANCELED', 'EXPIRED', 'REJECTED', 'EXPIRED_IN_MATCH')
+
+order_event_wait_seconds = metrics.histogram(
+    'order_event_wait_seconds', '等待訂單/持倉事件的時間(秒)', ('kind', 'result'))
+
+
+class OrderEventWaiter:
+    """
+    以 user data stream 事件取代固定延遲
+
+    依帳戶 (API key) 記錄最近的 ORDER_TRADE_UPDATE (以 clientOrderId 與 orderId 為鍵) 與各交易對最後一次
+    訂單/持倉事件時間。等待端在事件到達時立即返回，逾時則返回 None / False，呼叫端沿用原本流程。
+    REST 回應可能比串流事件晚到，因此事件保留在有上限的最近事件表中，晚註冊的等待也能立即取得。
+    下單/撤單請求送出時以 mark_request() 記錄時間，wait_settled() 等到該時間之後的事件到達才返回。
+    """
+
+    def __init__(self, capacity=2000, request_expiry=10.0):
+        """
+        Args:
+            capacity: 每個帳戶保留的最近訂單事件數量
+            request_expiry: 請求超過此秒數仍未收到事件時不再等待 (例如撤單時沒有掛單，不會有事件)
+        """
+        self._cond = threading.Condition()
+        self._capacity = capacity
+        self._request_expiry = request_expiry
+        self._orders = {}
+        self._activity = {}
+        self._positions = {}
+        self._requests = {}
+
+    def _recent(self, api_key):
+        recent = self._orders.get(api_key)
+        if recent is None:
+            recent = self._orders[api_key] = OrderedDict()
+        return recent
+
+    def mark_request(self, api_key, symbol, at=None):
+        """
+        記錄交易對的下單/撤單請求
+
+        Args:
+            api_key: 帳戶 API key
+            symbol: 交易對
+            at: 請求送出的 time.monotonic()，預設為現在
+        """
+        at = time.monotonic() if at is None else at
+        with self._cond:
+            if at > self._requests.get((api_key, symbol), 0.0):
+                self._requests[(api_key, symbol)] = at
+
+    def apply_event(self, api_key, msg):
+        """套用帳戶的 user data stream 事件"""
+        event = msg.get('e')
+        if event not in ('ORDER_TRADE_UPDATE', 'ACCOUNT_UPDATE'):
+            return
+        now = time.monotonic()
+        with self._cond:
+            if event == 'ORDER_TRADE_UPDATE':
+                order = msg['o']
+                recent = self._recent(api_key)
+                for key in (('c', order.get('c')), ('i', str(order.get('i')))):
+                    recent[key] = order
+                    recent.move_to_end(key)
+                while len(recent) > self._capacity * 2:
+                    recent.popitem(last=False)
+                self._activity[(api_key, order['s'])] = now
+            else:
+                for position in msg['a'].get('P', []):
+                    self._activity[(api_key, position['s'])] = now
+                    self._positions[(api_key, position['s'])] = (int(msg.get('T') or msg.get('E') or 0),
+                                                                 float(position['pa']))
+            self._cond.notify_all()
+
+    def wait_order(self, api_key, client_order_id=None, order_id=None, statuses=FINAL_STATUSES, timeout=5.0):
+        """
+        等待訂單進入指定狀態
+
+        Args:
+            api_key: 帳戶 API key
+            client_order_id: clientOrderId，與 order_id 擇一
+            order_id: orderId
+            statuses: 視為完成的狀態
+            timeout: 最長等待秒數
+
+        Returns:
+            dict: ORDER_TRADE_UPDATE 的 'o'，逾時返回 None
+        """
+        key = ('c', client_order_id) if client_order_id is not None else ('i', str(order_id))
+        started = time.monotonic()
+        deadline = started + timeout
+        with self._cond:
+            while True:
+                order = self._recent(api_key).get(key)
+                if order is not None and order.get('X') in statuses:
+                    order_event_wait_seconds.observe(time.monotonic() - started, 'order', 'event')
+                    return order
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    order_event_wait_seconds.observe(timeout, 'order', 'timeout')
+                    return None
+                self._cond.wait(remaining)
+
+    def wait_position(self, api_key, symbol, predicate, after=0, timeout=5.0):
+        """
+        等待持倉數量變化
+
+        Args:
+            api_key: 帳戶 API key
+            symbol: 交易對
+            predicate: predicate(position_amount) 為 True 時返回
+            after: 只採用撮合時間晚於此值 (毫秒) 的持倉事件
+            timeout: 最長等待秒數
+
+        Returns:
+            bool: 是否在逾時前等到
+        """
+        started = time.monotonic()
+        deadline = started + timeout
+        with self._cond:
+            while True:
+                position = self._positions.get((api_key, symbol))
+                if position is not None and position[0] > after and predicate(position[1]):
+                    order_event_wait_seconds.observe(time.monotonic() - started, 'position', 'event')
+                    return True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    order_event_wait_seconds.observe(timeout, 'position', 'timeout')
+                    return False
+                self._cond.wait(remaining)
+
+    def wait_settled(self, api_key, symbol, since=None, quiet=0.3, timeout=2.0):
+        """
+        等待交易對在 since 之後的請求已收到事件並平靜下來
+
+        收到 since 之後的訂單/持倉事件後，再等到連續 quiet 秒沒有新事件 (例如撤多筆掛單的後續事件)，最長 timeout 秒。
+        since 為 None 時使用最後一次 mark_request() 的時間；沒有請求紀錄或請求已超過 request_expiry 秒時立即返回。
+
+        Args:
+            api_key: 帳戶 API key
+            symbol: 交易對
+            since: 請求送出的 time.monotonic()
+            quiet: 最後一筆事件後需平靜的秒數
+            timeout: 最長等待秒數
+
+        Returns:
+            bool: 是否在逾時前收到事件並平靜
+        """
+        started = time.monotonic()
+        deadline = started + timeout
+        with self._cond:
+            if since is None:
+                since = self._requests.get((api_key, symbol))
+                if since is not None and started - since > self._request_expiry:
+                    since = None
+            while True:
+                now = time.monotonic()
+                last = self._activity.get((api_key, symbol))
+                confirmed = last is not None and since is not None and last >= since
+                if since is None or (confirmed and now - last >= quiet):
+                    order_event_wait_seconds.observe(now - started, 'settle', 'event')
+                    return True
+                if now >= deadline:
+                    order_event_wait_seconds.observe(timeout, 'settle', 'timeout')
+                    return False
+                self._cond.wait((min(deadline, last + quiet) if confirmed else deadline) - now)
+
+
+order_event_waiter = OrderEventWaiter()
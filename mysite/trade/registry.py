@@ -0,0 +1,212 @@
+import copy
+import logging
+import threading
+import time
+
+from django.db.models.signals import post_save, post_delete
+
+from .account_state import balance_write_behind
+from .models import Strategy, AccountBalance
+
+logger = logging.getLogger('trade')
+
+
+class StrategyRegistry:
+    """
+    行程內的策略索引
+
+    依 passphrase、(symbol, status)、strategy_type 建立索引，並快取各策略的 AccountBalance。
+    查詢返回快取物件的副本，呼叫端修改或 save() 不會影響其他線程讀到的值。
+    Strategy 經由 save / delete 變更時透過 signal 失效，下次查詢時整批重新載入；
+    AccountBalance 只更新變更的那一筆，寫回佇列尚未寫入的持倉欄位以佇列中的值為準。
+    其他行程或連線的寫入不會觸發 signal，超過 ttl 秒後整批重新載入。
+    注意: QuerySet.update() / bulk_update() 不會觸發 signal，需自行呼叫 invalidate() 或 refresh_balance()。
+    """
+
+    def __init__(self, ttl=30.0):
+        """
+        Args:
+            ttl: 快取有效秒數，超過後下次查詢重新載入
+        """
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._loaded_at = 0.0
+        self._ttl = ttl
+        self._generation = 0
+        self._by_passphrase = {}
+        self._by_symbol_status = {}
+        self._by_type = {}
+        self._balances = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def invalidate(self, **kwargs):
+        """使索引失效，可直接作為 signal receiver"""
+        with self._lock:
+            self._loaded = False
+            self._generation += 1
+            self.invalidations += 1
+
+    def balance_saved(self, instance, update_fields=None, **kwargs):
+        """
+        AccountBalance 儲存後更新快取中的單筆記錄，可直接作為 signal receiver
+
+        寫回佇列中尚未寫入的欄位較新，不以 instance 的值覆蓋。
+
+        Args:
+            instance: 已儲存的 AccountBalance
+            update_fields: save() 指定的欄位，None 時複製全部欄位
+        """
+        with self._lock:
+            if not self._loaded:
+                # 載入中的快照可能早於這次儲存，讓它維持未載入狀態
+                self._generation += 1
+                return
+            cached = self._balances.get(instance.strategy_id)
+            if cached is None:
+                cached = self._balances[instance.strategy_id] = copy.copy(instance)
+                balance_write_behind.overlay(cached)
+                return
+            if update_fields is None:
+                update_fields = [field.attname for field in instance._meta.concrete_fields]
+            pending = balance_write_behind.pending_fields(instance.pk)
+            for name in update_fields:
+                field = instance._meta.get_field(name)
+                if field.attname not in pending:
+                    setattr(cached, field.attname, getattr(instance, field.attname))
+
+    def balance_deleted(self, instance, **kwargs):
+        """AccountBalance 刪除後移除快取，可直接作為 signal receiver"""
+        with self._lock:
+            if not self._loaded:
+                self._generation += 1
+                return
+            cached = self._balances.get(instance.strategy_id)
+            if cached is not None and cached.pk == instance.pk:
+                del self._balances[instance.strategy_id]
+
+    def update_balance(self, balance, fields):
+        """
+        將呼叫端修改後的欄位套用到快取，用於不觸發 signal 的寫入 (例如寫回佇列)
+
+        Args:
+            balance: 修改後的 AccountBalance 副本
+            fields: 要套用的欄位
+        """
+        with self._lock:
+            cached = self._balances.get(balance.strategy_id)
+            if cached is None or cached.pk != balance.pk:
+                return
+            for name in fields:
+                setattr(cached, name, getattr(balance, name))
+
+    def refresh_balance(self, strategy_id, fields):
+        """
+        從資料庫重新讀取單筆 AccountBalance 的指定欄位，用於 QuerySet.update() 之後
+
+        Args:
+            strategy_id: 策略ID
+            fields: 要重新讀取的欄位
+        """
+        values = AccountBalance.objects.filter(strategy_id=strategy_id).values(*fields).first()
+        with self._lock:
+            cached = self._balances.get(strategy_id)
+            if cached is None or values is None:
+                return
+            for name, value in values.items():
+                setattr(cached, name, value)
+
+    def _ensure_loaded(self):
+        with self._lock:
+            if self._loaded and time.monotonic() - self._loaded_at < self._ttl:
+                self.hits += 1
+                return
+            self.misses += 1
+            generation = self._generation
+
+        strategies = list(Strategy.objects.select_related('account').all())
+        balances = {balance.strategy_id: balance for balance in AccountBalance.objects.all()}
+        for balance in balances.values():
+            # 資料庫中的持倉欄位可能比寫回佇列舊
+            balance_write_behind.overlay(balance)
+
+        by_passphrase = {}
+        by_symbol_status = {}
+        by_type = {}
+        for strategy in strategies:
+            if strategy.passphrase:
+                by_passphrase.setdefault(strategy.passphrase, strategy)
+            by_symbol_status.setdefault((strategy.symbol, strategy.status), []).append(strategy)
+            by_type.setdefault(strategy.strategy_type, []).append(strategy)
+
+        with self._lock:
+            self._by_passphrase = by_passphrase
+            self._by_symbol_status = by_symbol_status
+            self._by_type = by_type
+            self._balances = balances
+            self._loaded_at = time.monotonic()
+            # 載入期間若有失效則維持未載入狀態，下次查詢重新載入
+            self._loaded = generation == self._generation
+
+    def by_passphrase(self, passphrase):
+        """依 passphrase 取得策略，找不到返回 None"""
+        self._ensure_loaded()
+        return _copy(self._by_passphrase.get(passphrase))
+
+    def by_symbol(self, symbol, status='ACTIVE'):
+        """
+        依交易對與狀態取得策略
+
+        Raises:
+            Strategy.DoesNotExist: 找不到策略
+            Strategy.MultipleObjectsReturned: 找到多個策略
+        """
+        self._ensure_loaded()
+        strategies = self._by_symbol_status.get((symbol, status), [])
+        if not strategies:
+            raise Strategy.DoesNotExist(f"找不到 {symbol} 狀態為 {status} 的策略")
+        if len(strategies) > 1:
+            raise Strategy.MultipleObjectsReturned(f"{symbol} 狀態為 {status} 的策略不只一個")
+        return _copy(strategies[0])
+
+    def by_type(self, strategy_type, status=None):
+        """依策略類型取得策略列表，可選擇依狀態篩選"""
+        self._ensure_loaded()
+        strategies = self._by_type.get(strategy_type, [])
+        return [_copy(strategy) for strategy in strategies if status is None or strategy.status == status]
+
+    def balance_for(self, strategy_id):
+        """取得策略的 AccountBalance，找不到返回 None"""
+        self._ensure_loaded()
+        with self._lock:
+            return _copy(self._balances.get(strategy_id))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'strategies': sum(len(v) for v in self._by_type.values()),
+            }
+
+
+def _copy(instance):
+    """返回模型實例的淺複製 (Model.__getstate__ 會複製 _state)，None 原樣返回"""
+    return copy.copy(instance) if instance is not None else None
+
+
+strategy_registry = StrategyRegistry()
+
+
+def connect_signals():
+    """在 AppConfig.ready() 中連接失效 signal"""
+    post_save.connect(strategy_registry.invalidate, sender=Strategy,
+                      dispatch_uid="strategy_registry_save_Strategy")
+    post_delete.connect(strategy_registry.invalidate, sender=Strategy,
+                        dispatch_uid="strategy_registry_delete_Strategy")
+    post_save.connect(strategy_registry.balance_saved, sender=AccountBalance,
+                      dispatch_uid="strategy_registry_save_AccountBalance")
+    post_delete.connect(strategy_registry.balance_deleted, sender=AccountBalance,
+                        dispatch_uid="strategy_registry_delete_AccountBalance")
@@ -0,0 +1,366 @@
+import asyncio
+import json
+import logging
+import random
+import threading
+import time
+
+import websockets
+
+from .metrics import metrics
+
+logger = logging.getLogger('trade')
+
+FSTREAM_URL = 'wss://fstream.binance.com'
+
+stream_messages_total = metrics.counter('stream_messages_total', '串流訊息數量', ('stream',))
+stream_reconnects_total = metrics.counter('stream_reconnects_total', '串流重新連線次數', ('stream',))
+stream_connected = metrics.gauge('stream_connected', '串流是否連線中', ('stream',))
+stream_message_age_seconds = metrics.gauge('stream_message_age_seconds', '距離上次收到訊息的秒數', ('stream',))
+listen_key_keepalive_total = metrics.counter('listen_key_keepalive_total', 'listen key 延長次數', ('stream', 'result'))
+stream_stale_total = metrics.counter('stream_stale_total', '看門狗判定串流失去回應而重連的次數', ('stream', 'reason'))
+
+# Binance listen key 未延長時的有效期 (秒)
+LISTEN_KEY_VALIDITY = 60 * 60
+
+
+class _Stream:
+    """單一連線的狀態"""
+
+    __slots__ = ('name', 'connected', 'last_message_at', 'last_activity_at', 'listen_key_at', 'messages',
+                 'reconnects', 'stale')
+
+    def __init__(self, name):
+        self.name = name
+        self.connected = False
+        self.last_message_at = None
+        # 最後收到訊息或心跳 pong 的時間
+        self.last_activity_at = None
+        # listen key 取得或最後一次成功延長的時間
+        self.listen_key_at = None
+        self.messages = 0
+        self.reconnects = 0
+        self.stale = 0
+
+    def touch(self):
+        self.last_activity_at = time.monotonic()
+
+
+class StreamHub:
+    """
+    在單一 asyncio 事件迴圈上維護所有 Binance 串流
+
+    - 每個帳戶一條 user data stream 連線，listen key 由 hub 取得並定期延長，過期或斷線時換新 key 重連
+    - 所有市場資料串流合併在一條 combined stream 連線，啟動後新增的串流以 SUBSCRIBE 即時加入
+    - 收到的訊息解碼後直接在迴圈線程呼叫註冊的 handler；handler 只應更新記憶體狀態或以不阻塞的方式
+      交給執行道 (submit(..., block=False))，不可等待鎖或 I/O，否則所有帳戶與市場串流會一起停擺
+    - 每條連線有一個看門狗，每 watchdog_interval 秒檢查一次: user data stream 沒有事件時可能長時間
+      無訊息，因此每秒送出心跳 ping，訊息與 pong 皆視為活動，超過 user_stale_after 秒沒有活動即重連；
+      listen key 超過有效期仍未延長成功時也換新 key 重連。市場串流每秒都有標記價格，
+      訊息超過 market_timeout 秒未更新即重連。
+    不論帳戶與交易對數量，只使用一條線程與一個事件迴圈。
+    """
+
+    def __init__(self, url=FSTREAM_URL, keepalive_interval=30 * 60, market_timeout=3.0,
+                 ping_interval=20.0, ping_timeout=20.0, watchdog_interval=0.5, heartbeat_interval=1.0,
+                 user_stale_after=3.0, max_backoff=30.0):
+        """
+        Args:
+            url: futures 串流位址
+            keepalive_interval: listen key 延長間隔 (秒)，Binance listen key 60 分鐘失效
+            market_timeout: 市場串流多久沒有訊息視為中斷並重連 (秒)
+            ping_interval: websockets 內建 ping 間隔 (秒)
+            ping_timeout: websockets 內建 ping 等待 pong 的逾時 (秒)，逾時視為斷線
+            watchdog_interval: 看門狗檢查間隔 (秒)
+            heartbeat_interval: user data stream 心跳 ping 間隔 (秒)
+            user_stale_after: user data stream 多久沒有訊息或 pong 視為中斷並重連 (秒)
+            max_backoff: 重連等待上限 (秒)
+        """
+        self._url = url
+        self._keepalive_interval = keepalive_interval
+        self._market_timeout = market_timeout
+        self._ping_interval = ping_interval
+        self._ping_timeout = ping_timeout
+        self._watchdog_interval = watchdog_interval
+        self._heartbeat_interval = heartbeat_interval
+        self._user_stale_after = user_stale_after
+        self._max_backoff = max_backoff
+        self._loop = None
+        self._thread = None
+        self._started = threading.Event()
+        self._streams = {}
+        self._market_handlers = {}
+        self._market_ws = None
+        self._market_task = None
+        self._request_ids = 0
+        stream_message_age_seconds.set_function(self._message_ages)
+        stream_connected.set_function(
+            lambda: {(name,): 1 if stream.connected else 0 for name, stream in self._streams.items()})
+
+    def _message_ages(self):
+        now = time.monotonic()
+        return {(name,): now - stream.last_message_at
+                for name, stream in self._streams.items() if stream.last_message_at is not None}
+
+    # 生命週期
+    def start(self):
+        """啟動事件迴圈線程，重複呼叫無作用"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run_loop, name="StreamHub", daemon=True)
+        self._thread.start()
+        self._started.wait()
+
+    def _run_loop(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._started.set()
+        self._loop.run_forever()
+
+    def stop(self):
+        """取消所有連線並停止事件迴圈"""
+        if self._loop is None:
+            return
+
+        async def shutdown():
+            tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        asyncio.run_coroutine_threadsafe(shutdown(), self._loop).result(timeout=10)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=10)
+        self._loop = None
+        self._thread = None
+
+    def _call(self, function, *args):
+        self.start()
+        self._loop.call_soon_threadsafe(function, *args)
+
+    # 註冊串流
+    def add_user_stream(self, name, client, on_message, on_reconnect=None):
+        """
+        訂閱帳戶的 user data stream
+
+        Args:
+            name: 串流名稱 (指標標籤)
+            client: 此帳戶的 Binance REST client，用於取得與延長 listen key
+            on_message: on_message(msg)，msg 為解碼後的事件 dict
+            on_reconnect: 斷線重新連上後呼叫 (首次連線不呼叫)，用於補回遺漏事件
+        """
+        self._call(lambda: self._loop.create_task(self._run_user_stream(name, client, on_message, on_reconnect)))
+
+    def add_market_stream(self, stream, on_message):
+        """
+        訂閱市場資料串流 (例如 '!markPrice@arr@1s'、'btcusdt@depth@100ms')
+
+        Args:
+            stream: 串流名稱
+            on_message: on_message(data)，data 為 combined stream 中的 'data'
+        """
+        self._call(self._add_market_stream, stream, on_message)
+
+    def remove_market_stream(self, stream):
+        """取消訂閱市場資料串流"""
+        self._call(self._remove_market_stream, stream)
+
+    def _add_market_stream(self, stream, on_message):
+        existing = stream in self._market_handlers
+        self._market_handlers[stream] = on_message
+        if self._market_task is None:
+            self._market_task = self._loop.create_task(self._run_market_stream())
+        elif not existing and self._market_ws is not None:
+            self._loop.create_task(self._send_market_request('SUBSCRIBE', [stream]))
+
+    def _remove_market_stream(self, stream):
+        if self._market_handlers.pop(stream, None) is not None and self._market_ws is not None:
+            self._loop.create_task(self._send_market_request('UNSUBSCRIBE', [stream]))
+
+    async def _send_market_request(self, method, streams):
+        self._request_ids += 1
+        try:
+            await self._market_ws.send(json.dumps({'method': method, 'params': streams, 'id': self._request_ids}))
+        except Exception as e:
+            logger.warning(f"市場串流 {method} {streams} 送出失敗，將於重連時套用: {str(e)}")
+
+    # 連線
+    def _stream(self, name):
+        stream = self._streams.get(name)
+        if stream is None:
+            stream = self._streams[name] = _Stream(name)
+        return stream
+
+    def _backoff(self, attempt):
+        return min(self._max_backoff, 2 ** attempt) * (0.5 + random.random() / 2)
+
+    async def _to_thread(self, function, *args):
+        """REST 呼叫交給預設執行器，避免阻塞迴圈"""
+        return await self._loop.run_in_executor(None, function, *args)
+
+    async def _keepalive(self, name, client, listen_key):
+        while True:
+            await asyncio.sleep(self._keepalive_interval)
+            try:
+                await self._to_thread(lambda: client.futures_stream_keepalive(listenKey=listen_key))
+                self._stream(name).listen_key_at = time.monotonic()
+                listen_key_keepalive_total.inc(name, 'ok')
+            except Exception as e:
+                listen_key_keepalive_total.inc(name, 'error')
+                logger.error(f"串流 {name} 延長 listen key 失敗: {str(e)}")
+
+    def _stale_reason(self, stream, now, user):
+        """看門狗判定: 返回重連原因，正常時返回 None"""
+        if user:
+            if now - stream.last_activity_at > self._user_stale_after:
+                return 'silent'
+            if now - stream.listen_key_at > LISTEN_KEY_VALIDITY:
+                return 'listen_key'
+        elif now - stream.last_message_at > self._market_timeout:
+            return 'silent'
+        return None
+
+    async def _watchdog(self, stream, ws, user):
+        """
+        連線看門狗，判定失去回應時關閉連線，由連線迴圈重連
+
+        Args:
+            stream: _Stream
+            ws: 連線
+            user: 是否為 user data stream (以心跳 pong 補足沒有事件時的活動)
+        """
+        last_ping = 0.0
+        while True:
+            await asyncio.sleep(self._watchdog_interval)
+            now = time.monotonic()
+            if user and now - last_ping >= self._heartbeat_interval:
+                last_ping = now
+                try:
+                    pong_waiter = await asyncio.wait_for(ws.ping(), timeout=self._heartbeat_interval)
+                    pong_waiter.add_done_callback(
+                        lambda future: future.cancelled() or future.exception() is not None or stream.touch())
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    # 送不出 ping 時不更新活動時間，由下方判定
+                    pass
+            reason = self._stale_reason(stream, now, user)
+            if reason is not None:
+                stream.stale += 1
+                stream_stale_total.inc(stream.name, reason)
+                logger.warning(f"串流 {stream.name} 失去回應 ({reason})，重新連線")
+                try:
+                    await ws.close()
+                except Exception as e:
+                    logger.warning(f"串流 {stream.name} 關閉連線失敗: {str(e)}")
+                return
+
+    async def _run_user_stream(self, name, client, on_message, on_reconnect):
+        stream = self._stream(name)
+        attempt = 0
+        while True:
+            keepalive = None
+            watchdog = None
+            try:
+                listen_key = await self._to_thread(client.futures_stream_get_listen_key)
+                stream.listen_key_at = time.monotonic()
+                async with websockets.connect(f"{self._url}/ws/{listen_key}", ping_interval=self._ping_interval,
+                                              ping_timeout=self._ping_timeout, close_timeout=1) as ws:
+                    stream.connected = True
+                    stream.touch()
+                    keepalive = self._loop.create_task(self._keepalive(name, client, listen_key))
+                    watchdog = self._loop.create_task(self._watchdog(stream, ws, user=True))
+                    if stream.reconnects and on_reconnect is not None:
+                        on_reconnect()
+                    attempt = 0
+                    async for raw in ws:
+                        msg = json.loads(raw)
+                        stream.last_message_at = stream.last_activity_at = time.monotonic()
+                        stream.messages += 1
+                        stream_messages_total.inc(name)
+                        if msg.get('e') == 'listenKeyExpired':
+                            logger.warning(f"串流 {name} listen key 已過期，重新取得")
+                            break
+                        try:
+                            on_message(msg)
+                        except Exception as e:
+                            logger.error(f"串流 {name} 處理訊息時發生錯誤: {str(e)}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"串流 {name} 連線中斷: {str(e)}")
+            finally:
+                stream.connected = False
+                for task in (keepalive, watchdog):
+                    if task is not None:
+                        task.cancel()
+            stream.reconnects += 1
+            stream_reconnects_total.inc(name)
+            await asyncio.sleep(self._backoff(attempt))
+            attempt += 1
+
+    async def _run_market_stream(self):
+        stream = self._stream('market')
+        attempt = 0
+        while self._market_handlers:
+            streams = sorted(self._market_handlers)
+            watchdog = None
+            try:
+                async with websockets.connect(f"{self._url}/stream?streams={'/'.join(streams)}",
+                                              ping_interval=self._ping_interval, ping_timeout=self._ping_timeout,
+                                              close_timeout=1) as ws:
+                    self._market_ws = ws
+                    stream.connected = True
+                    stream.last_message_at = stream.last_activity_at = time.monotonic()
+                    watchdog = self._loop.create_task(self._watchdog(stream, ws, user=False))
+                    attempt = 0
+                    # 連線期間新增或移除的串流補送
+                    added = [s for s in self._market_handlers if s not in streams]
+                    if added:
+                        await self._send_market_request('SUBSCRIBE', added)
+                    async for raw in ws:
+                        msg = json.loads(raw)
+                        stream.last_message_at = stream.last_activity_at = time.monotonic()
+                        stream.messages += 1
+                        stream_messages_total.inc('market')
+                        handler = self._market_handlers.get(msg.get('stream'))
+                        if handler is None:
+                            continue
+                        try:
+                            handler(msg['data'])
+                        except Exception as e:
+                            logger.error(f"市場串流 {msg.get('stream')} 處理訊息時發生錯誤: {str(e)}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"市場串流連線中斷: {str(e)}")
+            finally:
+                self._market_ws = None
+                stream.connected = False
+                if watchdog is not None:
+                    watchdog.cancel()
+            stream.reconnects += 1
+            stream_reconnects_total.inc('market')
+            await asyncio.sleep(self._backoff(attempt))
+            attempt += 1
+        self._market_task = None
+
+    def is_connected(self, name):
+        stream = self._streams.get(name)
+        return stream is not None and stream.connected
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            name: {
+                'connected': stream.connected,
+                'messages': stream.messages,
+                'reconnects': stream.reconnects,
+                'stale': stream.stale,
+                'age': round(now - stream.last_message_at, 3) if stream.last_message_at else None,
+            }
+            for name, stream in list(self._streams.items())
+        }
+
+
+stream_hub = StreamHub()
@@ -1,3 +1,627 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+from unittest import mock
+from urllib.parse import quote_plus
 
-# Create your tests here.
+from django.test import SimpleTestCase
+
+from . import dedup, gap_recovery
+from .coalesce import coalesce_notifications
+from .dedup import AlertDeduplicator
+from .exchange import LOW, RateLimitExceeded, RateLimitGovernor
+from .execution import ExecutionScheduler, ParentOrder
+from .gap_recovery import FillGapRecovery
+from .grid_reconcile import diff_grid_orders
+from .journal import WebhookJournal, is_stale
+from .ladder import build_ladder, ladder_ticks
+from .lanes import SymbolLaneExecutor
+from .notification import NotificationDecodeError, decode_notification
+from .open_orders import OpenOrderMirror
+from .order_book import OrderBook, plan_depth_split
+
+
+def _swing(message_type):
+    return decode_notification(
+        '{"passphrase": "p", "ticker": "BTCUSDT", "type": "swing", '
+        '"message": "{\\"type\\": \\"%s\\"}"}' % message_type
+    )
+
+
+class CoalesceSwingNotificationTests(SimpleTestCase):
+
+    def collapsed_indexes(self, message_types):
+        return sorted(index for index, _ in coalesce_notifications([_swing(t) for t in message_types]))
+
+    def test_entry_then_exit_is_not_netted(self):
+        # 先前可能已有空倉: long_entry 負責平掉空倉，long_exit 負責平倉並將策略設為 INACTIVE
+        self.assertEqual(self.collapsed_indexes(['long_entry', 'long_exit']), [])
+        self.assertEqual(self.collapsed_indexes(['short_entry', 'short_exit']), [])
+
+    def test_exits_are_never_dropped(self):
+        self.assertEqual(self.collapsed_indexes(['long_exit', 'long_exit', 'short_exit']), [])
+
+    def test_consecutive_entries_keep_last(self):
+        self.assertEqual(self.collapsed_indexes(['long_entry', 'short_entry', 'long_entry']), [0, 1])
+
+    def test_entry_before_exit_is_kept_when_later_entry_follows(self):
+        # 出場之前的進場已建立要被平掉的倉位，不能被之後的進場取代
+        self.assertEqual(self.collapsed_indexes(['long_entry', 'long_exit', 'short_entry', 'short_entry']), [2])
+
+
+def _grid_v2(lower_bound=None, upper_bound=None):
+    bounds = ''
+    if lower_bound is not None:
+        bounds = ', \\"lower_bound\\": %s, \\"upper_bound\\": %s' % (lower_bound, upper_bound)
+    return decode_notification(
+        '{"passphrase": "p", "ticker": "BTCUSDT", "type": "grid_v2", '
+        '"message": "{\\"type\\": \\"entry\\"%s}"}' % bounds
+    )
+
+
+class CoalesceGridV2NotificationTests(SimpleTestCase):
+
+    def test_keeps_last_notification_with_bounds(self):
+        notifications = [_grid_v2(100, 200), _grid_v2(110, 210), _grid_v2()]
+        self.assertEqual(sorted(index for index, _ in coalesce_notifications(notifications)), [0, 2])
+
+    def test_keeps_last_when_none_have_bounds(self):
+        notifications = [_grid_v2(), _grid_v2()]
+        self.assertEqual([index for index, _ in coalesce_notifications(notifications)], [0])
+
+
+class LadderTicksTests(SimpleTestCase):
+
+    def test_coarse_tick_keeps_depth_levels(self):
+        # 0.1% 間距在 0.5 的價格上小於一個 tick (0.01)，價位需往外推開而不是合併
+        buy_ticks, sell_ticks = ladder_ticks(0.5, 5, 0.001, 0.01)
+        self.assertEqual(buy_ticks.tolist(), [49, 48, 47, 46, 45])
+        self.assertEqual(sell_ticks.tolist(), [51, 52, 53, 54, 55])
+
+    def test_fine_tick_is_unchanged(self):
+        buy_ticks, sell_ticks = ladder_ticks(100, 3, 0.005, 0.01)
+        self.assertEqual(buy_ticks.tolist(), [9950, 9900, 9850])
+        self.assertEqual(sell_ticks.tolist(), [10050, 10101, 10151])
+
+    def test_orders_match_grid_depth(self):
+        ladder = build_ladder(0.5, 5, 0.001, 0.01, 2, 0, 10, 10, 5)
+        self.assertEqual(len(ladder.orders('DOGEUSDT', 'g')), 2 * 5)
+
+
+class DecodeNotificationTests(SimpleTestCase):
+
+    def test_decodes_nested_message_and_strategy(self):
+        notification = decode_notification(
+            '{"passphrase": "p", "ticker": "BTCUSDT", "type": "swing", "entry": "101.5", "time": "t1", '
+            '"message": "{\\"type\\": \\"long_entry\\", \\"lev\\": \\"5.0\\", \\"sl\\": 99}", '
+            '"strategy": {"long": {"times": 3, "stopLoss": "0.02"}}}'
+        )
+        self.assertEqual(notification.message_type, 'long_entry')
+        self.assertEqual(notification.entry, 101.5)
+        self.assertEqual(notification.lev, 5)
+        self.assertEqual(notification.sl, 99.0)
+        self.assertEqual(notification.long_times, 3)
+        self.assertEqual(notification.long_stop_loss, 0.02)
+        self.assertIsNone(notification.short_times)
+        self.assertEqual(notification.shard_key, 'p:BTCUSDT')
+
+    def test_missing_and_empty_fields_use_defaults(self):
+        notification = decode_notification('{"ticker": "BTCUSDT", "entry": "", "message": ""}')
+        self.assertIsNone(notification.entry)
+        self.assertIsNone(notification.message)
+        self.assertEqual(notification.leverage, 1)
+        self.assertEqual(notification.total_weight, 10.0)
+
+    def test_invalid_payloads_raise(self):
+        for body in ('not json', '[1, 2]', '{"message": "{bad"}', '{"message": "[1]"}', '{"entry": "abc"}'):
+            with self.assertRaises(NotificationDecodeError, msg=body):
+                decode_notification(body)
+
+
+class WebhookJournalTests(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, 'webhook.journal')
+
+    def read_records(self):
+        with open(self.path, encoding='utf-8') as f:
+            return [json.loads(line) for line in f]
+
+    def test_recover_returns_unacked_records_with_timestamp(self):
+        journal = WebhookJournal(self.path)
+        journal.recover()
+        before = time.time()
+        first = journal.append('entry', 'a')
+        second = journal.append('exit', 'b')
+        journal.append('entry', 'c')
+        journal.ack(first)
+
+        recovered = WebhookJournal(self.path).recover()
+        self.assertEqual([(seq, kind, body) for seq, kind, _, body in recovered], [(2, 'exit', 'b'), (3, 'entry', 'c')])
+        self.assertTrue(all(ts >= before for _, _, ts, _ in recovered))
+        self.assertEqual(recovered[0][0], second)
+
+    def test_recover_compacts_and_keeps_timestamp(self):
+        journal = WebhookJournal(self.path)
+        journal.recover()
+        journal.ack(journal.append('entry', 'a'))
+        journal.append('exit', 'b')
+        ts = WebhookJournal(self.path).recover()[0][2]
+
+        # 壓縮後只剩未 ack 的記錄，寫入時間不能被改成壓縮時間
+        records = self.read_records()
+        self.assertEqual([(record['op'], record['seq'], record['ts']) for record in records], [('put', 2, ts)])
+        self.assertEqual(WebhookJournal(self.path).recover()[0][2], ts)
+
+    def test_recover_skips_torn_last_line_and_continues_sequence(self):
+        journal = WebhookJournal(self.path)
+        journal.recover()
+        journal.append('entry', 'a')
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write('{"op": "put", "seq": 2, "ki')
+
+        journal = WebhookJournal(self.path)
+        self.assertEqual([seq for seq, _, _, _ in journal.recover()], [1])
+        self.assertEqual(journal.append('entry', 'b'), 2)
+
+    def test_old_records_without_timestamp_recover_as_none(self):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write('{"op": "put", "seq": 1, "kind": "entry", "body": "a"}\n')
+        self.assertEqual(WebhookJournal(self.path).recover(), [(1, 'entry', None, 'a')])
+
+
+class JournalStaleTests(SimpleTestCase):
+
+    def test_missing_timestamp_is_stale(self):
+        self.assertTrue(is_stale(None, 300, now=1000.0))
+
+    def test_age_is_compared_with_max_age(self):
+        self.assertFalse(is_stale(800.0, 300, now=1000.0))
+        self.assertFalse(is_stale(700.0, 300, now=1000.0))
+        self.assertTrue(is_stale(699.0, 300, now=1000.0))
+
+
+def _alert(bar_time, ticker='BTCUSDT'):
+    return decode_notification(
+        '{"passphrase": "p", "ticker": "%s", "type": "swing", "time": "%s", '
+        '"message": "{\\"type\\": \\"long_entry\\"}"}' % (ticker, bar_time)
+    )
+
+
+class AlertDeduplicatorTests(SimpleTestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(dedup, 'time')
+        self.clock = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.clock.monotonic.return_value = 1000.0
+
+    def test_duplicate_within_ttl(self):
+        deduplicator = AlertDeduplicator(ttl=120)
+        self.assertFalse(deduplicator.is_duplicate(_alert('t1')))
+        self.clock.monotonic.return_value = 1120.0
+        self.assertTrue(deduplicator.is_duplicate(_alert('t1')))
+        self.assertFalse(deduplicator.is_duplicate(_alert('t2')))
+
+    def test_expired_fingerprint_is_accepted_again(self):
+        deduplicator = AlertDeduplicator(ttl=120)
+        deduplicator.is_duplicate(_alert('t1'))
+        self.clock.monotonic.return_value = 1121.0
+        self.assertFalse(deduplicator.is_duplicate(_alert('t1')))
+        # 重新接受後以新的時間計算 ttl
+        self.clock.monotonic.return_value = 1200.0
+        self.assertTrue(deduplicator.is_duplicate(_alert('t1')))
+
+    def test_evicts_least_recently_seen(self):
+        deduplicator = AlertDeduplicator(max_entries=2, ttl=120)
+        deduplicator.is_duplicate(_alert('t1'))
+        deduplicator.is_duplicate(_alert('t2'))
+        # 重複的 t1 移到最新，超過容量時淘汰 t2
+        self.assertTrue(deduplicator.is_duplicate(_alert('t1')))
+        deduplicator.is_duplicate(_alert('t3'))
+        self.assertEqual(deduplicator.stats()['size'], 2)
+        self.assertTrue(deduplicator.is_duplicate(_alert('t1')))
+        self.assertFalse(deduplicator.is_duplicate(_alert('t2')))
+
+
+def _order_event(order_id, status, update_time, executed='0'):
+    return {
+        'e': 'ORDER_TRADE_UPDATE',
+        'o': {'s': 'BTCUSDT', 'i': order_id, 'X': status, 'T': update_time, 'S': 'BUY', 'o': 'LIMIT',
+              'q': '1', 'p': '100', 'z': executed},
+    }
+
+
+class _OpenOrdersClient:
+
+    def __init__(self, orders=(), during_load=None):
+        self.orders = list(orders)
+        self.during_load = during_load
+
+    def futures_get_open_orders(self):
+        if self.during_load is not None:
+            self.during_load()
+        return [dict(order) for order in self.orders]
+
+
+class OpenOrderMirrorTests(SimpleTestCase):
+
+    def setUp(self):
+        self.mirror = OpenOrderMirror()
+        self.client = _OpenOrdersClient()
+        self.mirror.load(self.client)
+
+    def open_orders(self):
+        return {order['orderId']: order for order in self.mirror.get_open_orders(self.client)}
+
+    def test_late_new_event_does_not_revive_closed_order(self):
+        self.mirror.apply_event(_order_event(1, 'NEW', 100))
+        self.mirror.apply_event(_order_event(1, 'FILLED', 200, executed='1'))
+        self.mirror.apply_event(_order_event(1, 'NEW', 100))
+        self.assertEqual(self.open_orders(), {})
+
+    def test_canceled_symbol_is_guarded(self):
+        self.mirror.apply_event(_order_event(1, 'NEW', 100))
+        self.mirror.record_canceled('BTCUSDT')
+        self.mirror.apply_event(_order_event(1, 'PARTIALLY_FILLED', 150, executed='0.5'))
+        self.assertEqual(self.open_orders(), {})
+
+    def test_older_update_time_is_ignored(self):
+        self.mirror.apply_event(_order_event(1, 'PARTIALLY_FILLED', 200, executed='0.5'))
+        self.mirror.apply_event(_order_event(1, 'NEW', 100))
+        order = self.open_orders()[1]
+        self.assertEqual(order['status'], 'PARTIALLY_FILLED')
+        self.assertEqual(order['executedQty'], '0.5')
+
+    def test_events_during_load_are_applied_after_snapshot(self):
+        # REST 快照在事件之前取得，載入期間收到的事件不能被快照覆蓋
+        client = _OpenOrdersClient(
+            orders=[{'orderId': 2, 'symbol': 'BTCUSDT', 'status': 'NEW', 'updateTime': 100}],
+            during_load=lambda: (self.mirror.apply_event(_order_event(2, 'CANCELED', 150)),
+                                 self.mirror.apply_event(_order_event(3, 'NEW', 160))))
+        self.mirror.load(client)
+        self.assertEqual(sorted(self.open_orders()), [3])
+
+
+def _live(order_id, side, price, quantity, order_type='LIMIT', reduce_only=False):
+    return {'orderId': order_id, 'side': side, 'price': str(price), 'origQty': str(quantity),
+            'type': order_type, 'reduceOnly': reduce_only}
+
+
+def _target(side, price, quantity):
+    return {'side': side, 'price': price, 'quantity': quantity}
+
+
+class DiffGridOrdersTests(SimpleTestCase):
+
+    def test_keeps_orders_within_tolerance(self):
+        live = [_live(1, 'BUY', 99.96, 1.02), _live(2, 'SELL', 101, 1)]
+        kept, to_cancel, to_place = diff_grid_orders([_target('BUY', 100, 1), _target('SELL', 101, 1)], live, 0.001)
+        self.assertEqual([order['orderId'] for order in kept], [1, 2])
+        self.assertEqual(to_cancel, [])
+        self.assertEqual(to_place, [])
+
+    def test_replaces_orders_outside_tolerance(self):
+        live = [_live(1, 'BUY', 99.8, 1), _live(2, 'BUY', 100, 1.5), _live(3, 'SELL', 100, 1)]
+        kept, to_cancel, to_place = diff_grid_orders([_target('BUY', 100, 1)], live, 0.001)
+        self.assertEqual(kept, [])
+        self.assertEqual(sorted(order['orderId'] for order in to_cancel), [1, 2, 3])
+        self.assertEqual(to_place, [_target('BUY', 100, 1)])
+
+    def test_each_live_order_matches_once(self):
+        live = [_live(1, 'BUY', 100.02, 1), _live(2, 'BUY', 100.01, 1)]
+        targets = [_target('BUY', 100, 1), _target('BUY', 100, 1), _target('BUY', 100, 1)]
+        kept, to_cancel, to_place = diff_grid_orders(targets, live, 0.001)
+        # 先配對最接近的價位
+        self.assertEqual([order['orderId'] for order in kept], [2, 1])
+        self.assertEqual(len(to_place), 1)
+        self.assertEqual(to_cancel, [])
+
+    def test_non_grid_orders_are_canceled(self):
+        live = [_live(1, 'BUY', 100, 1, reduce_only=True), _live(2, 'BUY', 100, 1, order_type='STOP_MARKET')]
+        kept, to_cancel, to_place = diff_grid_orders([_target('BUY', 100, 1)], live, 0.001)
+        self.assertEqual(kept, [])
+        self.assertEqual([order['orderId'] for order in to_cancel], [1, 2])
+        self.assertEqual(len(to_place), 1)
+
+
+class SymbolLaneExecutorTests(SimpleTestCase):
+
+    def test_keeps_submission_order_per_key(self):
+        executor = SymbolLaneExecutor('test-order', lanes=3)
+        results = {}
+        for index in range(200):
+            key = f"SYMBOL{index % 7}"
+            executor.submit(key, results.setdefault(key, []).append, index)
+        executor.shutdown(wait=True)
+        for key, values in results.items():
+            self.assertEqual(values, sorted(values), key)
+        self.assertEqual(sum(len(values) for values in results.values()), 200)
+
+    def test_non_blocking_submit_rejects_when_lane_is_full(self):
+        executor = SymbolLaneExecutor('test-full', lanes=1, max_queue=1)
+        started = threading.Event()
+        release = threading.Event()
+        executed = []
+        self.assertTrue(executor.submit('A', lambda: (started.set(), release.wait(5))))
+        self.assertTrue(started.wait(5))
+        self.assertTrue(executor.submit('A', executed.append, 1))
+        self.assertFalse(executor.submit('A', executed.append, 2, block=False))
+        release.set()
+        executor.shutdown(wait=True)
+        self.assertEqual(executed, [1])
+
+    def test_task_error_does_not_stop_lane(self):
+        executor = SymbolLaneExecutor('test-error', lanes=1)
+        executed = []
+        executor.submit('A', lambda: 1 / 0)
+        executor.submit('A', executed.append, 1)
+        executor.shutdown(wait=True)
+        self.assertEqual(executed, [1])
+
+
+def _fill(trade_id, symbol='BTCUSDT'):
+    return {'e': 'ORDER_TRADE_UPDATE', 'E': 1000 + trade_id,
+            'o': {'s': symbol, 'x': 'TRADE', 't': trade_id, 'i': 100}}
+
+
+class _TradesClient:
+
+    def __init__(self, trade_ids):
+        self.trades = [
+            {'id': trade_id, 'orderId': 100, 'time': 1000 + trade_id, 'side': 'BUY', 'qty': '1', 'price': '10',
+             'commissionAsset': 'USDT', 'commission': '0', 'maker': False, 'realizedPnl': '0'}
+            for trade_id in trade_ids
+        ]
+        self.pages = 0
+
+    def futures_account_trades(self, symbol, limit, fromId=None, startTime=None):
+        self.pages += 1
+        trades = [trade for trade in self.trades
+                  if (fromId is None or trade['id'] >= fromId) and (startTime is None or trade['time'] >= startTime)]
+        return [dict(trade) for trade in trades[:limit]]
+
+    def futures_get_order(self, symbol, orderId):
+        return {'clientOrderId': 'c', 'type': 'LIMIT', 'origQty': str(len(self.trades)), 'price': '10',
+                'status': 'FILLED', 'executedQty': str(len(self.trades))}
+
+
+class FillGapRecoveryTests(SimpleTestCase):
+
+    def setUp(self):
+        self.replayed = []
+        self.client = _TradesClient(range(1, 8))
+        self.recovery = FillGapRecovery(self.client, self.replayed.append)
+
+    def replayed_ids(self):
+        return [event['o']['t'] for event in self.replayed]
+
+    def test_replays_fills_after_last_observed(self):
+        self.recovery.observe(_fill(5))
+        self.assertEqual(self.recovery.recover(), 2)
+        self.assertEqual(self.replayed_ids(), [6, 7])
+        # 只有訂單的最後一筆成交標記為 FILLED
+        self.assertEqual([event['o']['X'] for event in self.replayed], ['PARTIALLY_FILLED', 'FILLED'])
+        self.assertTrue(all(event['replayed'] for event in self.replayed))
+
+    def test_recovered_fills_are_not_replayed_twice(self):
+        self.recovery.observe(_fill(5))
+        self.recovery.recover()
+        self.assertEqual(self.recovery.recover(), 0)
+        self.assertEqual(self.replayed_ids(), [6, 7])
+
+    def test_dropped_fill_is_replayed(self):
+        self.recovery.observe(_fill(4))
+        self.recovery.observe(_fill(5))
+        self.assertTrue(self.recovery.mark_dropped(_fill(5)))
+        self.assertEqual(self.recovery.recover(dropped_only=True), 3)
+        self.assertEqual(self.replayed_ids(), [5, 6, 7])
+
+    def test_pages_through_trades(self):
+        self.recovery.observe(_fill(1))
+        with mock.patch.object(gap_recovery, 'TRADES_PAGE_LIMIT', 2):
+            self.assertEqual(self.recovery.recover(), 6)
+        self.assertEqual(self.replayed_ids(), [2, 3, 4, 5, 6, 7])
+        self.assertEqual(self.client.pages, 4)
+
+    def test_unobserved_symbol_uses_last_event_time(self):
+        self.recovery.observe({'e': 'ACCOUNT_UPDATE', 'E': 1006})
+        # 自最後事件時間往前 lookback (5 秒) 取回
+        self.assertEqual(self.recovery.recover(symbols=('BTCUSDT',)), 7)
+
+    def test_nothing_observed_recovers_nothing(self):
+        self.assertEqual(self.recovery.recover(symbols=('BTCUSDT',)), 0)
+        self.assertEqual(self.client.pages, 0)
+
+
+def _depth(first, last, previous, bids=(), asks=()):
+    return {'U': first, 'u': last, 'pu': previous, 'b': [list(level) for level in bids],
+            'a': [list(level) for level in asks]}
+
+
+def _snapshot(last_update_id, bids=(('99', '1'),), asks=(('101', '1'),)):
+    return {'lastUpdateId': last_update_id, 'bids': [list(level) for level in bids],
+            'asks': [list(level) for level in asks]}
+
+
+class OrderBookSyncTests(SimpleTestCase):
+
+    def setUp(self):
+        self.book = OrderBook('BTCUSDT')
+
+    def test_first_event_requests_sync(self):
+        self.assertFalse(self.book.apply_event(_depth(1, 5, 0)))
+        self.assertTrue(self.book.begin_sync())
+        self.assertFalse(self.book.begin_sync())
+        self.assertTrue(self.book.apply_event(_depth(6, 10, 5)))
+
+    def test_buffered_events_straddling_snapshot(self):
+        self.book.begin_sync()
+        self.book.apply_event(_depth(1, 5, 0, asks=[('100', '9')]))
+        self.book.apply_event(_depth(6, 10, 5, asks=[('101', '2')]))
+        self.book.apply_event(_depth(11, 12, 10, bids=[('99', '0')]))
+        self.assertTrue(self.book.install_snapshot(_snapshot(8)))
+        self.assertTrue(self.book.is_ready())
+        # u < lastUpdateId 的事件丟棄，第一筆接上的事件不檢查 pu
+        self.assertEqual(self.book.levels('BUY'), [(101.0, 2.0)])
+        self.assertIsNone(self.book.best_price('SELL'))
+        self.assertTrue(self.book.apply_event(_depth(13, 14, 12)))
+
+    def test_snapshot_older_than_buffer_fails(self):
+        self.book.begin_sync()
+        self.book.apply_event(_depth(10, 12, 9))
+        self.assertFalse(self.book.install_snapshot(_snapshot(5)))
+        self.assertFalse(self.book.is_ready())
+
+    def test_broken_pu_chain_marks_not_ready(self):
+        self.book.begin_sync()
+        self.book.apply_event(_depth(6, 10, 5))
+        self.book.install_snapshot(_snapshot(8))
+        self.assertFalse(self.book.apply_event(_depth(12, 14, 11)))
+        self.assertFalse(self.book.is_ready())
+
+    def test_empty_buffer_waits_for_straddling_event(self):
+        self.book.begin_sync()
+        self.assertTrue(self.book.install_snapshot(_snapshot(100)))
+        self.assertFalse(self.book.is_ready())
+        self.assertTrue(self.book.apply_event(_depth(80, 90, 79)))
+        self.assertFalse(self.book.is_ready())
+        # pu 是前一筆事件的 u，與快照無關
+        self.assertTrue(self.book.apply_event(_depth(95, 105, 94, asks=[('100.5', '3')])))
+        self.assertTrue(self.book.is_ready())
+        self.assertEqual(self.book.best_price('BUY'), 100.5)
+        self.assertTrue(self.book.apply_event(_depth(106, 110, 105)))
+
+    def test_empty_buffer_gap_requests_new_snapshot(self):
+        self.book.begin_sync()
+        self.book.install_snapshot(_snapshot(100))
+        self.assertFalse(self.book.apply_event(_depth(110, 120, 109)))
+        self.assertFalse(self.book.is_ready())
+        # 缺口事件留在暫存，下一次快照可以接上
+        self.assertTrue(self.book.begin_sync())
+        self.assertTrue(self.book.install_snapshot(_snapshot(115)))
+        self.assertTrue(self.book.is_ready())
+
+
+class PlanDepthSplitTests(SimpleTestCase):
+
+    def book(self, bids=(), asks=()):
+        book = OrderBook('BTCUSDT')
+        book.install_snapshot(_snapshot(1, bids=bids, asks=asks))
+        return book
+
+    def test_children_walk_the_same_depth(self):
+        book = self.book(asks=[('100', '10'), ('100.05', '10'), ('100.2', '10')])
+        plan = plan_depth_split(book, 'BUY', 6, 0)
+        self.assertEqual(plan['reference_price'], 100.0)
+        self.assertEqual(plan['children'], [{'quantity': 3, 'price': 100.0}, {'quantity': 3, 'price': 100.05}])
+        self.assertEqual(plan['uncovered'], 0.0)
+
+    def test_depth_beyond_slippage_is_uncovered(self):
+        book = self.book(bids=[('100', '10'), ('99.95', '10'), ('99', '100')])
+        plan = plan_depth_split(book, 'SELL', 30, 0)
+        self.assertEqual(plan['children'], [{'quantity': 5, 'price': 100.0}, {'quantity': 5, 'price': 99.95}])
+        self.assertEqual(plan['uncovered'], 20)
+
+    def test_child_quantities_respect_precision(self):
+        book = self.book(asks=[('100', '1')])
+        plan = plan_depth_split(book, 'BUY', 0.35, 3, max_parts=3)
+        quantities = [child['quantity'] for child in plan['children']]
+        self.assertEqual(quantities, [0.35])
+        self.assertAlmostEqual(plan['uncovered'], 0.0)
+
+    def test_empty_book_returns_none(self):
+        self.assertIsNone(plan_depth_split(self.book(), 'BUY', 1, 0))
+
+
+class ChildQuantityTests(SimpleTestCase):
+
+    def setUp(self):
+        self.scheduler = ExecutionScheduler(max_workers=1)
+        self.addCleanup(self.scheduler._executor.shutdown)
+
+    def run_children(self, parent):
+        quantities = []
+        while parent.remaining >= 10 ** -parent.quantity_precision:
+            quantity = self.scheduler._child_quantity(parent, len(quantities))
+            quantities.append(quantity)
+            parent.executed_qty += quantity
+        return quantities
+
+    def test_remainder_goes_to_last_slice(self):
+        parent = ParentOrder(None, 'BTCUSDT', 'SELL', 10, 0, slices=3, interval=1)
+        self.assertEqual(self.run_children(parent), [3, 3, 4])
+
+    def test_max_child_quantity_caps_slices(self):
+        parent = ParentOrder(None, 'BTCUSDT', 'SELL', 7, 1, max_child_quantity=2.5)
+        self.assertEqual(self.run_children(parent), [2.5, 2.5, 2.0])
+
+    def test_quantity_below_step_is_merged(self):
+        # 0.3 / 5 不足一個精度單位，合併成一張而不是送出 0
+        parent = ParentOrder(None, 'BTCUSDT', 'SELL', 0.3, 1, slices=5, interval=1)
+        self.assertEqual(self.run_children(parent), [0.3])
+
+    def test_float_remaining_does_not_leave_dust(self):
+        parent = ParentOrder(None, 'BTCUSDT', 'SELL', 0.7, 3, slices=7, interval=1)
+        quantities = self.run_children(parent)
+        self.assertEqual(len(quantities), 7)
+        self.assertAlmostEqual(sum(quantities), 0.7)
+
+
+class RateLimitGovernorTests(SimpleTestCase):
+
+    def acquire_in_thread(self, governor, level, path='/fapi/v1/time'):
+        result = {}
+
+        def run():
+            with governor.priority(level):
+                result['waited'] = governor.acquire('key', 'GET', path)
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread, result
+
+    def test_low_priority_keeps_reserve(self):
+        governor = RateLimitGovernor(weight_limit=100)
+        governor._weight.tokens = 25
+        thread, result = self.acquire_in_thread(governor, LOW)
+        thread.join(0.3)
+        # LOW 送出後需保留 30% 容量，NORMAL (10%) 與新增訂單 (HIGH) 不受影響
+        self.assertTrue(thread.is_alive())
+        self.assertLess(governor.acquire('key', 'GET', '/fapi/v1/time'), 0.1)
+        self.assertLess(governor.acquire('key', 'POST', '/fapi/v1/order', {'symbol': 'BTCUSDT'}), 0.1)
+        with governor._cond:
+            governor._weight.tokens = 100
+            governor._cond.notify_all()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertIn('waited', result)
+
+    def test_ban_longer_than_max_wait_raises(self):
+        governor = RateLimitGovernor(max_wait=30)
+        governor.update('key', SimpleNamespace(status_code=429, headers={'Retry-After': '60'}))
+        with self.assertRaises(RateLimitExceeded):
+            governor.acquire('key', 'GET', '/fapi/v1/time')
+        self.assertGreater(governor.stats()['blocked_for'], 50)
+
+    def test_short_ban_waits(self):
+        governor = RateLimitGovernor(max_wait=30)
+        governor.update('key', SimpleNamespace(status_code=418, headers={'Retry-After': '1'}))
+        self.assertGreaterEqual(governor.acquire('key', 'GET', '/fapi/v1/time'), 0.9)
+
+    def test_used_weight_header_lowers_available_weight(self):
+        governor = RateLimitGovernor(weight_limit=2400)
+        governor.update('key', SimpleNamespace(status_code=200, headers={'X-MBX-USED-WEIGHT-1M': '2000'}))
+        self.assertLessEqual(governor.stats()['weight_available'], 401)
+
+    def test_request_cost_by_method_and_path(self):
+        batch = quote_plus(json.dumps([{'symbol': 'BTCUSDT'}] * 3))
+        self.assertEqual(RateLimitGovernor.request_cost('post', '/fapi/v1/batchOrders', {'batchOrders': batch}), (5, 3))
+        self.assertEqual(RateLimitGovernor.request_cost('DELETE', '/fapi/v1/batchOrders', {'symbol': 'BTCUSDT'}), (1, 0))
+        self.assertEqual(RateLimitGovernor.request_cost('GET', '/fapi/v1/openOrders', {}), (40, 0))
+        self.assertEqual(RateLimitGovernor.request_cost('GET', '/fapi/v1/depth', {'limit': 1000}), (20, 0))
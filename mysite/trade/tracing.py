@@ -0,0 +1,185 @@
+import functools
+import itertools
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+
+_local = threading.local()
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Tracer:
+    """
+    輕量的 span 追蹤
+
+    - trace() 開始一條追蹤 (例如一筆 webhook)，span() 記錄其中一個階段，以線程區域變數串接父子關係
+    - 完成的 span 放入固定容量的環形緩衝，summary() 依階段名稱統計 p50/p95/p99
+    - configure() 後 span 另外經由 QueueListener 寫入輪替檔案，不在呼叫線程做檔案 I/O
+    """
+
+    def __init__(self, capacity=4096):
+        """
+        Args:
+            capacity: 環形緩衝保留的 span 數量
+        """
+        self._spans = deque(maxlen=capacity)
+        self._ids = itertools.count(1)
+        self._file_logger = None
+        self._listener = None
+
+    def configure(self, path, max_bytes=10 * 1024 * 1024, backup_count=5):
+        """
+        啟用檔案輸出
+
+        Args:
+            path: span 檔案路徑，每行一筆 JSON
+            max_bytes: 單檔大小上限
+            backup_count: 保留的輪替檔案數量
+        """
+        if self._listener is not None:
+            return
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count,
+                                      encoding='utf-8', delay=True)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        span_queue = queue.Queue()
+        file_logger = logging.getLogger('trade.trace')
+        file_logger.setLevel(logging.INFO)
+        file_logger.propagate = False
+        file_logger.addHandler(QueueHandler(span_queue))
+        self._listener = QueueListener(span_queue, handler)
+        self._listener.start()
+        self._file_logger = file_logger
+
+    def current_trace_id(self):
+        return getattr(_local, 'trace_id', None)
+
+    def _finish(self, trace_id, span_id, parent_id, name, started_wall, duration, attrs):
+        self._spans.append((trace_id, span_id, parent_id, name, started_wall, duration, attrs))
+        if self._file_logger is not None:
+            record = {
+                'trace': trace_id,
+                'span': span_id,
+                'parent': parent_id,
+                'name': name,
+                'ts': round(started_wall, 6),
+                'ms': round(duration * 1000, 3),
+            }
+            if attrs:
+                record.update(attrs)
+            self._file_logger.info(json.dumps(record, default=str))
+
+    @contextmanager
+    def trace(self, name, trace_id=None, **attrs):
+        """
+        開始一條新的追蹤，結束後恢復原本的追蹤
+
+        Args:
+            name: 根 span 名稱
+            trace_id: 追蹤 ID，缺省時自動產生 (例如以 req_id 帶入)
+        """
+        saved = (getattr(_local, 'trace_id', None), getattr(_local, 'stack', None))
+        _local.trace_id = trace_id or f"t{next(self._ids)}"
+        _local.stack = []
+        try:
+            with self.span(name, **attrs):
+                yield _local.trace_id
+        finally:
+            _local.trace_id, _local.stack = saved
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """
+        記錄一個階段的耗時；不在追蹤中時以此 span 為根開始一條追蹤
+
+        Args:
+            name: 階段名稱，summary() 依此分組
+        """
+        trace_id = getattr(_local, 'trace_id', None)
+        if trace_id is None:
+            with self.trace(name, **attrs):
+                yield
+            return
+        stack = _local.stack
+        span_id = next(self._ids)
+        parent_id = stack[-1] if stack else None
+        stack.append(span_id)
+        started_wall = time.time()
+        started = time.monotonic()
+        try:
+            yield
+        except Exception:
+            attrs['error'] = True
+            raise
+        finally:
+            stack.pop()
+            self._finish(trace_id, span_id, parent_id, name, started_wall, time.monotonic() - started, attrs)
+
+    def record(self, name, duration, **attrs):
+        """記錄一個已知耗時的階段 (例如佇列等待時間)"""
+        stack = getattr(_local, 'stack', None)
+        parent_id = stack[-1] if stack else None
+        trace_id = getattr(_local, 'trace_id', None) or f"t{next(self._ids)}"
+        self._finish(trace_id, next(self._ids), parent_id, name, time.time() - duration, duration, attrs)
+
+    def traced(self, name=None):
+        """以函數名稱 (或指定名稱) 記錄 span 的裝飾器"""
+        def decorator(func):
+            span_name = name or func.__name__
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(span_name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def summary(self):
+        """
+        依階段統計環形緩衝中的 span 耗時
+
+        Returns:
+            dict: {stage: {'count', 'p50', 'p95', 'p99', 'max'}}，單位毫秒
+        """
+        durations = {}
+        for _, _, _, name, _, duration, _ in list(self._spans):
+            durations.setdefault(name, []).append(duration)
+        result = {}
+        for name, values in sorted(durations.items()):
+            values.sort()
+            result[name] = {
+                'count': len(values),
+                'p50': round(_percentile(values, 50) * 1000, 3),
+                'p95': round(_percentile(values, 95) * 1000, 3),
+                'p99': round(_percentile(values, 99) * 1000, 3),
+                'max': round(values[-1] * 1000, 3),
+            }
+        return result
+
+    def spans_for(self, trace_id):
+        """取得環形緩衝中某條追蹤的所有 span，依開始時間排列"""
+        spans = [
+            {'span': span_id, 'parent': parent_id, 'name': name, 'ts': started_wall,
+             'ms': round(duration * 1000, 3), **attrs}
+            for tid, span_id, parent_id, name, started_wall, duration, attrs in list(self._spans)
+            if tid == trace_id
+        ]
+        spans.sort(key=lambda span: span['ts'])
+        return spans
+
+
+tracer = Tracer()
@@ -5,5 +5,10 @@ from . import views
 urlpatterns = [
     path('', views.index, name='index'),
     path('webhook', views.webhook, name='webhook'),
-    path('_675207c0', views.message, name='message')
+    path('webhook/async', views.webhook_async, name='webhook_async'),
+    path('_675207c0', views.message, name='message'),
+    path('queue_status', views.queue_status, name='queue_status'),
+    path('executions', views.executions, name='executions'),
+    path('trace_summary', views.trace_summary, name='trace_summary'),
+    path('metrics', views.prometheus_metrics, name='metrics')
 ]
\ No newline at end of file
@@ -4,22 +4,40 @@ import time  # 新增 time 模組
 import uuid
 from decimal import Decimal
 from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
 from django.core.exceptions import ObjectDoesNotExist, MultipleObjectsReturned
 from binance.exceptions import BinanceAPIException  # 新增 BinanceAPIException
 from .models import AccountInfo, Strategy, AccountBalance, Trade, GridPosition, OrderExecution, AccountBalanceHistory
+from .registry import strategy_registry
+from .tracing import tracer
+from .metrics import metrics
+from .open_orders import open_order_mirror, order_from_ws_event
+from .account_state import account_trackers, balance_write_behind
+from .market_data import mark_price_cache, mark_price_lookups_total
+from .lanes import SymbolLaneExecutor
+from .gap_recovery import FillGapRecovery
+from .stream_hub import stream_hub
+from .order_events import order_event_waiter, FINAL_STATUSES
+from .exchange import get_client
+from .grid_reconcile import diff_grid_orders, apply_grid_diff
+from .exchange import order_submitter
+from .ladder import build_ladder, linear_levels
+from .order_book import plan_depth_split
+from .execution import ParentOrder, execution_scheduler
 import logging
 from logging.handlers import TimedRotatingFileHandler
 from datetime import datetime
 import concurrent.futures
 from concurrent.futures import ThreadPoolExecutor
 import threading
-from binance import ThreadedWebsocketManager
 from django.db.utils import DatabaseError
 from collections import defaultdict
 import math
 import queue
 from logging.handlers import QueueHandler, QueueListener
 import re
+from contextlib import contextmanager
 
 
 def get_monthly_rotating_logger(logger_name, log_dir='logs'):
@@ -128,11 +146,7 @@ def strategy_list(status: str = None) -> list:
 
 
 def find_strategy_by_passphrase(passphrase):
-    try:
-        strategy = Strategy.objects.get(passphrase=passphrase)
-        return strategy
-    except Strategy.DoesNotExist:
-        return None
+    return strategy_registry.by_passphrase(passphrase)
 
 
 def find_balance_by_strategy_id(strategy_id):
@@ -476,6 +490,43 @@ def create_new_grid_position(
     )
     return new_position
 
+fok_resolutions_total = metrics.counter('fok_resolutions_total', 'FOK 訂單結果的取得來源', ('source', 'status'))
+fok_child_orders_total = metrics.counter('fok_child_orders_total', 'FOK 子單執行結果', ('source', 'result'))
+fok_slippage_bps = metrics.histogram('fok_slippage_bps', 'FOK 子單成交均價相對規劃參考價的滑價(bps)', ('source',),
+                                     buckets=(-5, 0, 1, 2, 5, 10, 20, 50, 100))
+
+
+def resolve_fok_order(client, symbol, order, timeout):
+    """
+    取得 FOK 訂單的最終結果
+
+    FOK 在撮合時立即成交或過期，下單時使用 newOrderRespType=RESULT，回應通常已是最終狀態；
+    否則以 user data stream 依 orderId 等待最終事件，串流未連線或逾時才查詢一次 REST。
+
+    Args:
+        client: Binance client
+        symbol: 交易對
+        order: 下單回應
+        timeout: 等待串流事件的最長秒數
+
+    Returns:
+        dict: 含 status / executedQty / avgPrice 的訂單
+    """
+    if order.get('status') in FINAL_STATUSES:
+        fok_resolutions_total.inc('response', order['status'])
+        return order
+    if is_account_streaming(client.API_KEY):
+        event = order_event_waiter.wait_order(client.API_KEY, order_id=order['orderId'], timeout=timeout)
+        if event is not None:
+            fok_resolutions_total.inc('stream', event['X'])
+            return order_from_ws_event(event)
+        logger.warning(f"FOK訂單 {order['orderId']} {timeout} 秒內未收到串流事件，改查詢 REST")
+    order_status = client.futures_get_order(symbol=symbol, orderId=order['orderId'])
+    fok_resolutions_total.inc('rest', order_status['status'])
+    return order_status
+
+
+@tracer.traced()
 def execute_single_fok_order(
     client,
     symbol,
@@ -486,7 +537,8 @@ def execute_single_fok_order(
     price_precision,
     max_retries=3,
     execution_timeout=20,
-    base_price_adjustment=0.00005  # 基礎調整0.005%
+    base_price_adjustment=0.00005,  # 基礎調整0.005%
+    reprice=None
 ):
     """
     執行單個FOK訂單
@@ -498,13 +550,19 @@ def execute_single_fok_order(
     - 初始調整：0.005%
     - 最大調整：0.015%（第三次重試）
     確保始終優於市價單手續費
+
+    訂單結果由下單回應或 user data stream 取得 (見 resolve_fok_order)，過期後立即以新價格重試。
+    提供 reprice 時 (依深度規劃的子單)，price 已是吃掉可見深度所需的價格，第一次不加調整，
+    重試時以 reprice() 取得最新深度的價格再逐次調整。
     """
     formatted_quantity = format_decimal(quantity, quantity_precision)
     current_price = price
     
     for attempt in range(max_retries):
+        if attempt > 0 and reprice is not None:
+            current_price = reprice() or current_price
         # 每次重試增加0.005%
-        price_adjustment = base_price_adjustment * (attempt + 1)  # 0.005%, 0.01%, 0.015%
+        price_adjustment = base_price_adjustment * (attempt + (0 if reprice is not None else 1))  # 0.005%, 0.01%, 0.015%
         adjusted_price = current_price * (1 + price_adjustment) if side == 'BUY' else current_price * (1 - price_adjustment)
         formatted_price = format_decimal(adjusted_price, price_precision)
         
@@ -521,33 +579,26 @@ def execute_single_fok_order(
                 timeInForce='FOK',
                 quantity=formatted_quantity,
                 price=formatted_price,
-                priceProtect='TRUE'
+                priceProtect='TRUE',
+                newOrderRespType='RESULT'
             )
             
             # 檢查訂單狀態
-            start_time = time.time()
-            while time.time() - start_time < execution_timeout:
-                order_status = client.futures_get_order(
-                    symbol=symbol,
-                    orderId=order['orderId']
-                )
-                
-                if order_status['status'] == 'FILLED':
-                    executed_qty = float(order_status['executedQty'])
-                    avg_price = float(order_status['avgPrice'])
-                    logger.info(f"FOK訂單成功: {executed_qty} @ {avg_price}")
-                    return {
-                        'success': True,
-                        'order': order_status,
-                        'executed_qty': executed_qty,
-                        'price_adjustment': price_adjustment
-                    }
-                    
-                elif order_status['status'] in ['EXPIRED', 'CANCELED']:
-                    logger.warning(f"訂單未成交，調整價格重試")
-                    break
-                    
-                time.sleep(0.5)
+            order_status = resolve_fok_order(client, symbol, order, execution_timeout)
+
+            if order_status['status'] == 'FILLED':
+                executed_qty = float(order_status['executedQty'])
+                avg_price = float(order_status['avgPrice'])
+                logger.info(f"FOK訂單成功: {executed_qty} @ {avg_price}")
+                return {
+                    'success': True,
+                    'order': order_status,
+                    'executed_qty': executed_qty,
+                    'price_adjustment': price_adjustment,
+                    'attempts': attempt + 1
+                }
+
+            logger.warning(f"訂單未成交 ({order_status['status']})，調整價格重試")
                 
         except BinanceAPIException as e:
             logger.error(f"FOK訂單失敗 (嘗試 {attempt + 1}/{max_retries}): {e.message}")
@@ -558,9 +609,11 @@ def execute_single_fok_order(
     return {
         'success': False,
         'executed_qty': 0,
-        'price_adjustment': price_adjustment if 'price_adjustment' in locals() else 0
+        'price_adjustment': price_adjustment if 'price_adjustment' in locals() else 0,
+        'attempts': attempt + 1
     }
 
+@tracer.traced()
 def execute_split_fok_orders(
     client, 
     symbol, 
@@ -573,7 +626,9 @@ def execute_split_fok_orders(
     max_workers=3,
     max_retries=3,
     execution_timeout=20,
-    base_price_adjustment=0.00005  # 基礎調整0.005%
+    base_price_adjustment=0.00005,  # 基礎調整0.005%
+    order_book=None,
+    max_slippage=0.001
 ):
     """
     並行執行多個FOK訂單
@@ -586,11 +641,17 @@ def execute_split_fok_orders(
         price: 價格
         quantity_precision: 數量精度
         price_precision: 價格精度
-        split_parts: 分割次數
+        split_parts: 分割次數 (依深度規劃時為子單數量上限)
         max_workers: 最大並行數
         max_retries: 每個訂單最大重試次數
-        execution_timeout: 訂單超時時間
+        execution_timeout: 等待訂單串流事件的最長秒數
         base_price_adjustment: 基礎價格調整幅度
+        order_book: 已同步的 OrderBook，提供時依可見深度決定子單數量與價格 (見 plan_depth_split)，
+            深度不足的剩餘數量以 price 下單；None 時平均分割
+        max_slippage: 依深度規劃時相對最優價的最大滑價比例
+
+    Returns:
+        dict: 彙總結果，executions 為每張子單的規劃與成交 (數量、價格、嘗試次數、滑價 bps)
     """
     single_quantity = total_quantity / split_parts
     executed_orders = []
@@ -598,49 +659,96 @@ def execute_split_fok_orders(
     
     # 準備所有批次的參數
     batch_params = []
-    for i in range(split_parts):
-        remaining = total_quantity - total_executed
-        if remaining <= 0:
-            break
-            
-        current_quantity = remaining if i == split_parts - 1 else single_quantity
-        batch_params.append({
-            'client': client,
-            'symbol': symbol,
-            'side': side,
-            'quantity': current_quantity,
-            'price': price,
-            'quantity_precision': quantity_precision,
-            'price_precision': price_precision,
-            'max_retries': max_retries,
-            'execution_timeout': execution_timeout,
-            'base_price_adjustment': base_price_adjustment
-        })
+    base_params = {
+        'client': client,
+        'symbol': symbol,
+        'side': side,
+        'quantity_precision': quantity_precision,
+        'price_precision': price_precision,
+        'max_retries': max_retries,
+        'execution_timeout': execution_timeout,
+        'base_price_adjustment': base_price_adjustment
+    }
+    plan = None
+    if order_book is not None:
+        plan = plan_depth_split(order_book, side, total_quantity, quantity_precision,
+                                max_parts=split_parts, max_slippage=max_slippage)
+    if plan and plan['children']:
+        reference_price = plan['reference_price']
+        for child in plan['children']:
+            batch_params.append(('depth', dict(
+                base_params,
+                quantity=child['quantity'],
+                price=child['price'],
+                reprice=lambda quantity=child['quantity']: order_book.sweep_price(side, quantity)
+            )))
+        if plan['uncovered'] >= 10 ** -quantity_precision:
+            batch_params.append(('fallback', dict(base_params, quantity=plan['uncovered'], price=price)))
+    else:
+        reference_price = price
+        for i in range(split_parts):
+            remaining = total_quantity - total_executed
+            if remaining <= 0:
+                break
+
+            current_quantity = remaining if i == split_parts - 1 else single_quantity
+            batch_params.append(('equal', dict(base_params, quantity=current_quantity, price=price)))
     
     # 使用線程池並行執行
+    executions = []
     with ThreadPoolExecutor(max_workers=max_workers) as executor:
         future_to_batch = {
             executor.submit(
                 execute_single_fok_order,
                 **params
-            ): i for i, params in enumerate(batch_params)
+            ): i for i, (_, params) in enumerate(batch_params)
         }
         
         # 收集結果
         max_adjustment = 0
         for future in concurrent.futures.as_completed(future_to_batch):
             batch_index = future_to_batch[future]
+            source, params = batch_params[batch_index]
+            execution = {
+                'part': batch_index + 1,
+                'source': source,
+                'quantity': params['quantity'],
+                'planned_price': params['price'],
+                'executed_qty': 0,
+                'avg_price': 0,
+                'attempts': 0,
+                'price_adjustment': 0,
+                'slippage_bps': None
+            }
             try:
                 result = future.result()
+                execution['attempts'] = result['attempts']
+                execution['price_adjustment'] = result['price_adjustment']
                 if result['success']:
                     executed_orders.append(result['order'])
                     total_executed += result['executed_qty']
                     max_adjustment = max(max_adjustment, result['price_adjustment'])
+                    avg_price = float(result['order']['avgPrice'])
+                    slippage = (avg_price - reference_price) if side == 'BUY' else (reference_price - avg_price)
+                    execution['executed_qty'] = result['executed_qty']
+                    execution['avg_price'] = avg_price
+                    execution['slippage_bps'] = round(slippage / reference_price * 10000, 2)
+                    fok_slippage_bps.observe(execution['slippage_bps'], source)
+                    fok_child_orders_total.inc(source, 'filled')
                     logger.info(f"批次 {batch_index + 1} 執行成功")
                 else:
+                    fok_child_orders_total.inc(source, 'expired')
                     logger.warning(f"批次 {batch_index + 1} 執行失敗")
             except Exception as e:
+                fok_child_orders_total.inc(source, 'error')
                 logger.error(f"批次 {batch_index + 1} 執行出錯: {str(e)}")
+            executions.append(execution)
+    executions.sort(key=lambda execution: execution['part'])
+    for execution in executions:
+        logger.info(f"{symbol} FOK子單 {execution['part']}/{len(executions)} ({execution['source']}): "
+                    f"規劃 {execution['quantity']} @ {execution['planned_price']}, "
+                    f"成交 {execution['executed_qty']} @ {execution['avg_price']}, "
+                    f"嘗試 {execution['attempts']} 次, 滑價 {execution['slippage_bps']} bps")
     
     # 返回執行結果
     return {
@@ -649,8 +757,11 @@ def execute_split_fok_orders(
         'total_executed': total_executed,
         'remaining_qty': total_quantity - total_executed,
         'execution_count': len(executed_orders),
-        'attempted_parts': split_parts,
+        'attempted_parts': len(batch_params),
         'max_price_adjustment': max_adjustment,
+        'plan_source': 'depth' if plan and plan['children'] else 'equal',
+        'reference_price': reference_price,
+        'executions': executions,
         'avg_price': sum(float(o['avgPrice']) * float(o['executedQty']) 
                         for o in executed_orders) / total_executed if total_executed > 0 else 0
     }
@@ -683,31 +794,103 @@ class PositionSide:
     LONG = 'LONG'                  # 只做多
     SHORT = 'SHORT'                # 只做空
 
+ws_messages_total = metrics.counter('ws_messages_total', 'User data stream 訊息數量', ('event',))
+ws_callback_inflight = metrics.gauge('ws_callback_inflight', 'WebSocket 回調執行中的任務數量')
+ws_callback_queue_depth = metrics.gauge('ws_callback_queue_depth', 'WebSocket 回調等待中的任務數量')
+ws_callback_pool_size = metrics.gauge('ws_callback_pool_size', 'WebSocket 回調執行道數量')
+symbol_lock_wait_seconds = metrics.histogram(
+    'symbol_lock_wait_seconds', '等待交易對鎖的時間(秒)', ('symbol',))
+
+
 class BinanceWebsocketClient:
-    def __init__(self, api_key, api_secret, callback=None, custom_logger=None):
+    """
+    主帳戶 user data stream 的消費端
+
+    連線由共用的 StreamHub 維護；此處更新掛單簿、持倉狀態與成交補回記錄，
+    並將訂單事件依交易對交給執行道執行回調。
+    """
+
+    def __init__(self, api_key, api_secret, callback=None, custom_logger=None, hub=None):
         self.api_key = api_key
         self.api_secret = api_secret
-        self.twm = None
+        self.hub = hub if hub else stream_hub
         self.is_running = False
-        self.reconnect_count = 0
-        self.max_reconnects = 10
-        self.reconnect_delay = 5
-        self.last_receive_time = time.time()
         self._lock = threading.Lock()
-        self.heartbeat_thread = None
         self.callback = callback if callback else lambda x: None
         self.logger = custom_logger if custom_logger else logger
-        # 創建線程池
-        self.thread_pool = ThreadPoolExecutor(
-            max_workers=10,
-            thread_name_prefix="WebsocketCallback"
-        )
+        # 此帳戶的持倉與錢包狀態，由 ACCOUNT_UPDATE / ACCOUNT_CONFIG_UPDATE 更新
+        self.account_tracker = account_trackers.register(api_key, 'main')
+        # 記錄最後成交 ID，中斷恢復後補回遺漏的成交並走一般回調流程
+        self.gap_recovery = FillGapRecovery(get_client(api_key, api_secret), replay=self._replay_fill)
+        self._drop_lock = threading.Lock()
+        self._drop_recovery_pending = False
+        self.drop_recovery_delay = 1.0
+        # 依交易對分配執行道，同交易對依序處理、不同交易對並行；佇列滿時不阻塞串流，成交事件改由補回流程重送
+        self.executor = SymbolLaneExecutor("WebsocketCallback", lanes=10, max_queue=1000)
+        ws_callback_pool_size.set(self.executor.lanes)
+        ws_callback_queue_depth.set_function(
+            lambda: sum(self.executor.stats()['lanes']) if self.executor else 0)
+
+    def _run_callback(self, msg):
+        ws_callback_inflight.inc()
+        try:
+            self.callback(msg)
+        finally:
+            ws_callback_inflight.dec()
+
+    def _replay_fill(self, msg):
+        """將補回的成交放入與即時事件相同的執行道"""
+        if self.is_running and self.executor:
+            self.executor.submit(msg['o']['s'], self._run_callback, msg)
+
+    def _recover_gap(self):
+        """在背景補回中斷期間的成交，檢查曾成交及目前有掛單的交易對"""
+        threading.Thread(
+            target=self.gap_recovery.recover,
+            args=(open_order_mirror.symbols(),),
+            name="FillGapRecovery",
+            daemon=True
+        ).start()
+
+    def _on_lane_full(self, msg):
+        """
+        執行道已滿時丟棄事件: 成交事件標記給補回流程，稍後以 REST 重送，避免阻塞所有串流
+        """
+        if not self.gap_recovery.mark_dropped(msg):
+            self.logger.warning(f"{msg['o']['s']} 執行道已滿，略過訂單事件 {msg['o']['c']} ({msg['o']['X']})")
+            return
+        self.logger.warning(f"{msg['o']['s']} 執行道已滿，成交 {msg['o']['t']} 稍後補回")
+        with self._drop_lock:
+            if self._drop_recovery_pending:
+                return
+            self._drop_recovery_pending = True
+
+        def recover():
+            # 等執行道消化積壓後再補回，補回的事件以阻塞方式放入執行道
+            time.sleep(self.drop_recovery_delay)
+            with self._drop_lock:
+                self._drop_recovery_pending = False
+            self.gap_recovery.recover(dropped_only=True)
+
+        threading.Thread(target=recover, name="DroppedFillRecovery", daemon=True).start()
+
+    def _on_reconnect(self):
+        """串流重新連上: 斷線期間的事件可能遺漏，重新載入掛單簿與持倉並補回成交"""
+        self.logger.warning("User data stream 已重新連線，補回中斷期間的成交")
+        open_order_mirror.invalidate()
+        self.account_tracker.invalidate()
+        self._recover_gap()
 
     def handle_socket_message(self, msg):
         """處理websocket訊息的回調函數"""
         try:
-            self.last_receive_time = time.time()
+            ws_messages_total.inc(msg.get('e', 'unknown'))
+            self.gap_recovery.observe(msg)
+            self.account_tracker.apply_event(msg)
+            order_event_waiter.apply_event(self.api_key, msg)
             if msg['e'] == 'ORDER_TRADE_UPDATE':
+                # 先更新本地掛單簿，回調中的網格邏輯讀到的是最新狀態
+                open_order_mirror.apply_event(msg)
                 order = msg['o']
                 # 使用 OrderStatus 類來檢查訂單狀態
                 if order['X'] not in [OrderStatus.CANCELED, OrderStatus.NEW]:
@@ -732,103 +915,86 @@ class BinanceWebsocketClient:
 訂單時間: {order['T']}
 成交時間: {order['t']}
 """)
-                # 檢查是否還在運行中
-                if self.is_running and self.thread_pool:
-                    self.thread_pool.submit(self.callback, msg)
+                # 檢查是否還在運行中；此處在串流事件迴圈上執行，不可阻塞
+                if self.is_running and self.executor:
+                    if not self.executor.submit(order['s'], self._run_callback, msg, block=False):
+                        self._on_lane_full(msg)
                 
         except Exception as e:
             self.logger.error(f"處理訊息時發生錯誤: {str(e)}")
 
     def start_websocket(self):
-        """啟動websocket連接"""
-        with self._lock:  # 使用線程鎖
+        """向 StreamHub 訂閱主帳戶 user data stream 與全市場標記價格"""
+        with self._lock:
+            if self.is_running:
+                return True
             try:
-                if self.twm and self.twm.is_alive():
-                    self.stop_websocket()
-                    time.sleep(1)  # 等待舊連接完全關閉
-
-                self.twm = ThreadedWebsocketManager(
-                    api_key=self.api_key,
-                    api_secret=self.api_secret
-                )
-                self.twm.start()
                 self.is_running = True
-                
-                # 訂閱用戶數據流
-                self.twm.start_futures_socket(
-                    callback=self.handle_socket_message
+                _account_streams[self.api_key] = 'main'
+                self.hub.add_user_stream(
+                    'main',
+                    get_client(self.api_key, self.api_secret),
+                    self.handle_socket_message,
+                    on_reconnect=self._on_reconnect
                 )
-                
+                # 全市場標記價格 (每秒)，get_current_price 優先讀取此快取
+                self.hub.add_market_stream('!markPrice@arr@1s', mark_price_cache.apply)
                 self.logger.info("Websocket連接已啟動")
                 return True
-                
             except Exception as e:
+                self.is_running = False
                 self.logger.error(f"啟動Websocket時發生錯誤: {str(e)}")
                 return False
 
     def stop_websocket(self):
-        """停止websocket連接"""
-        with self._lock:  # 使用線程鎖
+        """停止處理事件並等待執行道中的任務完成"""
+        with self._lock:
             try:
                 self.is_running = False
-                
-                # 先關閉 WebSocket 連接
-                if self.twm:
-                    self.twm.stop()
-                    self.twm = None
-                
-                # 關閉線程池前等待所有任務完成
-                if hasattr(self, 'thread_pool') and self.thread_pool:
-                    self.thread_pool.shutdown(wait=True)
-                    self.thread_pool = None
-                    
+                if hasattr(self, 'executor') and self.executor:
+                    self.executor.shutdown(wait=True)
+                    self.executor = None
                 self.logger.info("Websocket連接已停止")
             except Exception as e:
                 self.logger.error(f"停止Websocket時發生錯誤: {str(e)}")
 
-    def __del__(self):
-        """析構函數，確保資源被釋放"""
-        try:
-            self.stop_websocket()
-        except Exception as e:
-            if self.logger:  # 確保 logger 還存在
-                self.logger.error(f"清理 WebSocket 客戶端時發生錯誤: {str(e)}")
 
-    def _check_connection(self):
-        """檢查連接狀態"""
-        while self.is_running:
-            try:
-                time.sleep(30)  # 每30秒檢查一次
-                if not self.twm or not self.twm.is_alive():
-                    self.logger.warning("檢測到連接已斷開，嘗試重新連接...")
-                    if self.start_websocket():
-                        self.reconnect_count = 0
-                    else:
-                        self.reconnect_count += 1
-                        if self.reconnect_count >= self.max_reconnects:
-                            self.logger.error("達到最大重連次數，停止服務")
-                            self.stop_websocket()
-                            break
-            except Exception as e:
-                self.logger.error(f"連接檢查時發生錯誤: {str(e)}")
+# API key 對應的串流名稱
+_account_streams = {}
 
-    def run(self):
-        """運行主循環"""
-        try:
-            if self.start_websocket():
-                # 啟動心跳檢查線程
-                self.heartbeat_thread = threading.Thread(target=self._check_connection)
-                self.heartbeat_thread.daemon = True
-                self.heartbeat_thread.start()
-
-                while self.is_running:
-                    time.sleep(1)
-                    # print("running")
-                    
-        except KeyboardInterrupt:
-            self.logger.info("收到終止信號")
-        finally:
-            self.stop_websocket()
+
+def is_account_streaming(api_key):
+    """帳戶的 user data stream 是否連線中，未連線時等待事件的流程應退回固定延遲"""
+    name = _account_streams.get(api_key)
+    return name is not None and stream_hub.is_connected(name)
+
+
+def subscribe_account_streams(accounts, hub=None):
+    """
+    訂閱其他帳戶的 user data stream，只更新各帳戶的 AccountTracker
+
+    Args:
+        accounts: AccountInfo 列表，沒有 API key 的帳戶略過
+        hub: StreamHub，預設使用共用實例
+    """
+    hub = hub if hub else stream_hub
+    for account in accounts:
+        if not account.api_key or not account.api_secret:
+            continue
+        tracker = account_trackers.register(account.api_key, account.account_name)
+
+        def on_message(msg, api_key=account.api_key, tracker=tracker):
+            tracker.apply_event(msg)
+            order_event_waiter.apply_event(api_key, msg)
+
+        _account_streams[account.api_key] = account.account_name
+        hub.add_user_stream(
+            account.account_name,
+            get_client(account.api_key, account.api_secret),
+            on_message,
+            on_reconnect=tracker.invalidate
+        )
+        logger.info(f"已訂閱帳戶 {account.account_name} 的 user data stream")
 
 def get_grid_positions_by_strategy(strategy, ascending=True):
     """
@@ -903,26 +1069,16 @@ def generate_grid_levels(lower_bound: float, upper_bound: float, grids: int, sym
     Returns:
         list[float]: 由低到高排序的價格點位陣列
     """
-    # 包含上下界
-    _grids = grids + 1
-    tick_size = float(exchange_info_map[symbol]["tickSize"])
+    tick_size = exchange_info_map[symbol]["tickSize"]
     price_precision = int(exchange_info_map[symbol]['pricePrecision'])
 
     if lower_bound >= upper_bound:
         raise ValueError("下界必須小於上界")
     if grids < 2:
         raise ValueError("網格數量必須大於等於2")
-        
-    grid_size = (upper_bound - lower_bound) / (_grids - 1)
-    
-    grid_levels = []
-    for i in range(_grids):
-        price = lower_bound + (grid_size * i)
-        # 先根據 tick size 調整價格，再根據 price precision 進行四捨五入
-        adjusted_price = round(round(price / tick_size) * tick_size, price_precision)
-        grid_levels.append(adjusted_price)
-    
-    return grid_levels
+
+    # 包含上下界，以整數 tick 計算後再依 price precision 輸出
+    return linear_levels(lower_bound, upper_bound, grids, tick_size, price_precision)
 
 def generate_trade_group_id():
     """
@@ -1050,7 +1206,12 @@ def get_position_info(client, symbol=None):
         如果未指定 symbol: 返回所有持倉資訊的 list
     """
     try:
-        positions = client.futures_position_information()
+        # 訂閱 user data stream 的帳戶由記憶體讀取，其他帳戶查詢 REST
+        # 未實現盈虧與標記價格會寫入 AccountBalance，標記價格串流過期時也改用 REST
+        tracker = account_trackers.ready_for(client)
+        positions = tracker.get_positions(require_mark=True) if tracker else None
+        if positions is None:
+            positions = client.futures_position_information()
         
         # 過濾出有持倉量的倉位（positionAmt 不為 0）
         active_positions = [
@@ -1112,8 +1273,8 @@ def update_all_future_positions(client):
         total_pnl += pos['unrealized_pnl']
         total_margin += pos['margin']
         symbol = pos['symbol']
-        strategy = Strategy.objects.get(symbol=symbol, status='ACTIVE')
-        balance = AccountBalance.objects.get(strategy=strategy)
+        strategy = strategy_registry.by_symbol(symbol)
+        balance = strategy_registry.balance_for(strategy.strategy_id)
         
         if balance:
             margin = pos['margin']
@@ -1168,15 +1329,12 @@ def update_all_future_positions(client):
             balance.unrealized_pnl = float(pos['unrealized_pnl'])
             balance.position_value = float(pos['position_value'])
             balance.position_amount = float(pos['position_amount'])
+            # balance 是 strategy_registry 返回的副本，套用到快取後讀取端立即看到新值
+            strategy_registry.update_balance(balance, balance_write_behind.fields)
             balances_to_update.append(balance)
     
-    # 使用 bulk_update 一次性更新所有 balance
-    if balances_to_update:
-        AccountBalance.objects.bulk_update(
-            balances_to_update, 
-            ['used_margin', 'unrealized_pnl', 'position_value', 
-             'position_amount']
-        )
+    # 資料庫延遲批次寫入，bulk_update 不觸發 signal 也不需失效
+    balance_write_behind.schedule(balances_to_update)
         
     logger.info(f"""
 === 總計 ===
@@ -1188,7 +1346,7 @@ def update_all_future_positions(client):
     return close_orders_map
 
 def get_strategy_by_symbol(symbol):
-    return Strategy.objects.get(symbol=symbol, status='ACTIVE')
+    return strategy_registry.by_symbol(symbol)
 
 def get_balance_by_symbol(symbol):
     """
@@ -1201,16 +1359,19 @@ def get_balance_by_symbol(symbol):
         Decimal: 帳戶餘額，如果找不到則返回 None
     """
     try:
-        strategy = Strategy.objects.get(symbol=symbol, status='ACTIVE')
-        account_balance = AccountBalance.objects.get(strategy=strategy)
-        return account_balance
-    except (Strategy.DoesNotExist, AccountBalance.DoesNotExist):
+        strategy = strategy_registry.by_symbol(symbol)
+    except Strategy.DoesNotExist:
+        strategy = None
+    account_balance = strategy_registry.balance_for(strategy.strategy_id) if strategy else None
+    if account_balance is None:
         logger.warning(f"找不到 {symbol} 對應的活躍策略帳戶餘額")
-        return None
+    return account_balance
 
 def get_current_price(client, symbol):
     """
     獲取指定合約的當前價格
+
+    優先讀取標記價格串流的快取，串流過期或尚未收到該交易對時才查詢 REST。
     
     Args:
         client: Binance client
@@ -1224,11 +1385,27 @@ def get_current_price(client, symbol):
             'estimated_settle_price': 預估結算價格,
             'last_funding_rate': 最後一次資金費率,
             'next_funding_time': 下次資金費率時間,
-            'timestamp': 時間戳
+            'timestamp': 時間戳,
+            'source': 'stream' 或 'rest'
         }
         發生錯誤時返回 None
     """
+    cached = mark_price_cache.lookup(symbol)
+    if cached is not None:
+        mark_price_lookups_total.inc('stream')
+        return {
+            'symbol': cached.symbol,
+            'mark_price': cached.mark_price,
+            'index_price': cached.index_price,
+            'estimated_settle_price': cached.estimated_settle_price,
+            'last_funding_rate': cached.funding_rate,
+            'next_funding_time': cached.next_funding_time,
+            'timestamp': cached.event_time,
+            'source': 'stream'
+        }
+
     try:
+        mark_price_lookups_total.inc('rest')
         price_info = client.futures_mark_price(symbol=symbol)
         
         # 轉換數據類型並整理返回格式
@@ -1239,7 +1416,8 @@ def get_current_price(client, symbol):
             'estimated_settle_price': float(price_info['estimatedSettlePrice']),
             'last_funding_rate': float(price_info['lastFundingRate']),
             'next_funding_time': int(price_info['nextFundingTime']),
-            'timestamp': int(price_info['time'])
+            'timestamp': int(price_info['time']),
+            'source': 'rest'
         }
         
     except BinanceAPIException as e:
@@ -1252,6 +1430,16 @@ def get_current_price(client, symbol):
 # 使用字典存儲每個 symbol 的鎖
 _symbol_locks = defaultdict(threading.Lock)
 
+
+@contextmanager
+def _symbol_lock(symbol):
+    """取得交易對鎖並記錄等待時間"""
+    lock = _symbol_locks[symbol]
+    started = time.monotonic()
+    with lock:
+        symbol_lock_wait_seconds.observe(time.monotonic() - started, symbol)
+        yield
+
 def grid_v2_lab(client, passphrase, symbol):
     """
     網格交易實驗方法，使用基於 symbol 的同步鎖
@@ -1262,7 +1450,7 @@ def grid_v2_lab(client, passphrase, symbol):
         symbol: 交易對符號
     """
     # 獲取該 symbol 的專屬鎖
-    with _symbol_locks[symbol]:
+    with _symbol_lock(symbol):
         try:
             logger.info(f"開始執行網格交易實驗 - Symbol: {symbol}")
             
@@ -1273,6 +1461,7 @@ def grid_v2_lab(client, passphrase, symbol):
             for attempt in range(max_retries):
                 try:
                     client.futures_cancel_all_open_orders(symbol=symbol)
+                    open_order_mirror.record_canceled(symbol)
                     logger.info(f"成功取消 {symbol} 所有掛單")
                     break
                     
@@ -1298,11 +1487,11 @@ def grid_v2_lab(client, passphrase, symbol):
             update_grid_positions_price(strategy, levels)
             batch_payloads = grid_v2_create_batch_payload(strategy=strategy, current_grid_index=5, mark_price=mark_price)
             # print(f'batch_payloads {batch_payloads}')
-            # 分批發送訂單
-            for batch in batch_payloads:
-                logger.info(f"Sending batch order: {json.dumps(batch)}")
-                response = client.futures_place_batch_order(batchOrders=json.dumps(batch))
-                print(response)
+            # 各批次互不相依，並行送出
+            logger.info(f"Sending batch orders: {json.dumps(batch_payloads)}")
+            for batch, response, error in order_submitter.place_batches(client, batch_payloads):
+                if error is None:
+                    open_order_mirror.record_orders(response)
 
         except Exception as e:
             logger.error(f"網格交易實驗執行失敗 - Symbol: {symbol}, Error: {str(e)}")
@@ -1398,6 +1587,11 @@ def update_balance_and_pnl_by_custom_order_id(
         logger.error(f"更新餘額和盈虧時發生錯誤: {str(e)}")
         logger.error("錯誤詳情:", exc_info=True)
 
+def is_execution_recorded(execution_id) -> bool:
+    """成交是否已記錄 (binance_execution_id 唯一)，用於重送或補回的成交"""
+    return OrderExecution.objects.filter(binance_execution_id=str(execution_id)).exists()
+
+
 def create_order_execution(
     strategy: 'Strategy',
     order: dict,
@@ -1515,9 +1709,101 @@ def recover_leverage(strategy: 'Strategy') -> None:
         logger.error("錯誤詳情:", exc_info=True)
 
 
+# 單張市價平倉單的名目價值上限 (USDT)，超過時以 TWAP 分批送出；0 為不分批
+EXECUTION_MAX_CHILD_NOTIONAL = float(os.environ.get('EXECUTION_MAX_CHILD_NOTIONAL', '5000'))
+# TWAP 子單間隔秒數
+EXECUTION_CHILD_INTERVAL = float(os.environ.get('EXECUTION_CHILD_INTERVAL', '2'))
+# 同步等待分批平倉的上限秒數，子單間隔會壓縮到此時間內；逾時後母單在背景繼續執行
+EXECUTION_MAX_WAIT = float(os.environ.get('EXECUTION_MAX_WAIT', '10'))
+# 等待上限之外預留給子單往返的秒數
+EXECUTION_WAIT_GRACE = 10.0
+
+
+def plan_execution_slices(symbol, quantity):
+    """
+    依標記價格計算的名目價值決定分批數量
+
+    Returns:
+        int: 批次數量，不需分批或沒有即時標記價格時返回 1
+    """
+    if EXECUTION_MAX_CHILD_NOTIONAL <= 0:
+        return 1
+    mark = mark_price_cache.lookup(symbol)
+    if mark is None:
+        return 1
+    notional = abs(float(quantity)) * mark.mark_price
+    return max(1, math.ceil(notional / EXECUTION_MAX_CHILD_NOTIONAL))
+
+
+def submit_reduce_execution(client, symbol, side, quantity, strategy_id=None, trade_group_id=None,
+                            trade_type='EXIT', force=False, max_duration=None):
+    """
+    將大額 reduceOnly 市價單交給 ExecutionScheduler 分批執行
+
+    Args:
+        client: Binance client
+        symbol: 交易對
+        side: 買賣方向
+        quantity: 總數量
+        strategy_id: 子單成交寫入 Trade 的策略，None 時不寫入
+        trade_group_id: 交易組ID
+        trade_type: 交易類型
+        force: 不需分批時仍交給排程器 (背景執行)
+        max_duration: 子單間隔總和的上限秒數，None 為不限制
+
+    Returns:
+        ParentOrder: 不需分批且未指定 force 時返回 None，呼叫端沿用單張市價單
+    """
+    slices = plan_execution_slices(symbol, quantity)
+    if slices <= 1 and not force:
+        return None
+    interval = EXECUTION_CHILD_INTERVAL if slices > 1 else 0.0
+    if max_duration is not None and slices > 1:
+        interval = min(interval, max_duration / (slices - 1))
+    parent = ParentOrder(
+        client=client,
+        symbol=symbol,
+        side=side,
+        quantity=abs(float(quantity)),
+        quantity_precision=int(exchange_info_map[symbol]['quantityPrecision']),
+        slices=slices,
+        interval=interval,
+        reduce_only=True,
+        strategy_id=strategy_id,
+        trade_group_id=trade_group_id,
+        trade_type=trade_type
+    )
+    return execution_scheduler.submit(parent)
+
+
+def run_reduce_execution(client, symbol, side, quantity, **kwargs):
+    """
+    分批執行 reduceOnly 市價單並等待完成
+
+    子單間隔壓縮到 EXECUTION_MAX_WAIT 內，最多等待 EXECUTION_MAX_WAIT + EXECUTION_WAIT_GRACE 秒，
+    避免呼叫端 (通知分片、WebSocket 執行道) 長時間阻塞；逾時後母單在背景繼續執行，返回目前進度。
+
+    Args:
+        其餘參數同 submit_reduce_execution
+
+    Returns:
+        ParentOrder: 不需分批且未指定 force 時返回 None
+    """
+    parent = submit_reduce_execution(client, symbol, side, quantity, max_duration=EXECUTION_MAX_WAIT, **kwargs)
+    if parent is None:
+        return None
+    if not parent.wait(EXECUTION_MAX_WAIT + EXECUTION_WAIT_GRACE):
+        logger.error(f"母單 {parent.execution_id} {EXECUTION_MAX_WAIT + EXECUTION_WAIT_GRACE:.0f} 秒內未完成，"
+                     f"背景繼續執行 (已成交 {parent.executed_qty}/{parent.quantity})")
+    return parent
+
+
 def risk_control(client, symbol: str, close_order: dict) -> bool:
     """
     執行風險控制平倉操作
+
+    平倉單交給 ExecutionScheduler 分批執行並等待完成 (見 run_reduce_execution)，子單成交逐筆寫入 Trade，
+    呼叫端之後重置網格時倉位已經縮減；同一交易對已有執行中的風控平倉時不重複送出。
     
     Args:
         client: Binance client
@@ -1525,12 +1811,14 @@ def risk_control(client, symbol: str, close_order: dict) -> bool:
         close_order: 平倉訂單資訊
         
     Returns:
-        bool: 平倉是否成功
+        bool: 平倉是否完成
     """
     try:
-        # 優先使用傳入的 newClientOrderId，若沒有則生成新的
+        if execution_scheduler.active(symbol=symbol, api_key=client.API_KEY, trade_type="RISK_CONTROL"):
+            logger.info(f"{symbol} 風險控制平倉執行中，略過本次")
+            return False
+
         trade_group_id = generate_trade_group_id()
-        close_order['newClientOrderId'] = trade_group_id
         
         # 執行平倉訂單
         logger.warning(f"""
@@ -1542,44 +1830,33 @@ def risk_control(client, symbol: str, close_order: dict) -> bool:
 交易組ID: {trade_group_id}
 ------------------------""")
         
-        # 將訂單包裝成批次訂單格式
-        batch_payload = [close_order]
-        
-        # 執行批次訂單
-        response = client.futures_place_batch_order(
-            batchOrders=json.dumps(batch_payload)
+        strategy = get_strategy_by_symbol(symbol)
+        parent = run_reduce_execution(
+            client=client,
+            symbol=symbol,
+            side=close_order['side'],
+            quantity=close_order['quantity'],
+            strategy_id=strategy.strategy_id,
+            trade_group_id=trade_group_id+"_r",
+            trade_type="RISK_CONTROL",  # 標記為風險控制交易
+            force=True
         )
-        
-        # 如果訂單成功執行，創建交易記錄
-        if response:
-            strategy = get_strategy_by_symbol(symbol)
-            
-            # 創建交易記錄
-            Trade.objects.create(
-                strategy_id=strategy.strategy_id,
-                trade_group_id=trade_group_id+"_r",
-                thirdparty_id=response[0]['orderId'],
-                symbol=symbol,
-                trade_side=close_order['side'],
-                quantity=close_order['quantity'],
-                trade_type="RISK_CONTROL"  # 標記為風險控制交易
-            )
-            
-            logger.info(f"風險控制平倉訂單執行成功: {response}")
-            
-            # 根據平倉方向決定要調整的槓桿率
-            # 當平倉方向為 SELL 時表示平掉多倉，所以要調整多倉槓桿率
-            # 當平倉方向為 BUY 時表示平掉空倉，所以要調整空倉槓桿率
-            leverage_side = 'LONG' if close_order['side'] == 'SELL' else 'SHORT'
-            reduce_leverage(strategy, leverage_side)
-            return True
+        logger.info(f"風險控制平倉 母單 {parent.execution_id} ({parent.mode}, {parent.slices} 批): {parent.state}, "
+                    f"成交 {parent.executed_qty}/{parent.quantity}")
+        if parent.executed_qty <= 0:
+            return False
+
+        # 根據平倉方向決定要調整的槓桿率
+        # 當平倉方向為 SELL 時表示平掉多倉，所以要調整多倉槓桿率
+        # 當平倉方向為 BUY 時表示平掉空倉，所以要調整空倉槓桿率
+        leverage_side = 'LONG' if close_order['side'] == 'SELL' else 'SHORT'
+        reduce_leverage(strategy, leverage_side)
+        return parent.state == ParentOrder.DONE
             
     except Exception as e:
         logger.error(f"執行風險控制平倉時發生錯誤: {str(e)}")
         logger.error("錯誤詳情:", exc_info=True)
         return False
-        
-    return False
 
 
 def recover_all_active_strategy_leverage():
@@ -1610,15 +1887,15 @@ def update_balance_from_execution(strategy_id: int, realized_pnl: float, commiss
     """
     根據成交記錄更新策略餘額
     
+    以 F() 在資料庫內累加，多個線程或行程同時成交時不會互相覆蓋；
+    只寫入成交影響的欄位，寫回佇列負責的持倉欄位不受影響。
+    
     Args:
         strategy_id: 策略ID
         realized_pnl: 已實現盈虧
         commission: 手續費
     """
     try:
-        # 查找對應的帳戶餘額記錄
-        account_balance = AccountBalance.objects.get(strategy_id=strategy_id)
-        
         # 轉換為 Decimal 並保持原始精度
         realized_pnl_decimal = Decimal(str(realized_pnl))
         commission_decimal = Decimal(str(commission))
@@ -1627,14 +1904,19 @@ def update_balance_from_execution(strategy_id: int, realized_pnl: float, commiss
         net_profit = realized_pnl_decimal - commission_decimal
         
         # 更新餘額時也保持原始精度
-        account_balance.balance += net_profit
-        account_balance.profit_loss = net_profit
-        account_balance.save()
+        updated = AccountBalance.objects.filter(strategy_id=strategy_id).update(
+            balance=F('balance') + net_profit,
+            profit_loss=net_profit,
+            updated_at=timezone.now()
+        )
+        if not updated:
+            logger.error(f"找不到策略 {strategy_id} 的帳戶餘額記錄")
+            return
+        # update() 不觸發 signal，重新讀取累加後的餘額
+        strategy_registry.refresh_balance(strategy_id, ('balance', 'profit_loss', 'updated_at'))
         
         logger.info(f"已更新策略 {strategy_id} 的餘額，淨收益: {net_profit}")
         
-    except AccountBalance.DoesNotExist:
-        logger.error(f"找不到策略 {strategy_id} 的帳戶餘額記錄")
     except Exception as e:
         logger.error(f"更新餘額時發生錯誤: {str(e)}")
 
@@ -1782,8 +2064,8 @@ def get_all_future_open_order(client):
             ]
     """
     try:
-        # 獲取所有未完成的掛單
-        all_open_orders = client.futures_get_open_orders()
+        # 從本地掛單簿獲取所有未完成的掛單
+        all_open_orders = open_order_mirror.get_open_orders(client)
         summary_list = []
         
         if not all_open_orders:
@@ -1896,6 +2178,7 @@ def calculate_order_quantity(client, symbol, strategy):
         logger.error(f"計算訂單數量時發生錯誤: {str(e)}")
         raise
 
+@tracer.traced()
 def grid_v2_lab_2(client, passphrase, symbol, price_step_rate=0.005, is_callback=False, executed_side=None, executed_price=None, is_reset=False, use_lock=True):
     """
     網格交易 2.0
@@ -1913,7 +2196,7 @@ def grid_v2_lab_2(client, passphrase, symbol, price_step_rate=0.005, is_callback
     """
     # 如果使用鎖，則用 with 語句
     if use_lock:
-        with _symbol_locks[symbol]:
+        with _symbol_lock(symbol):
             return _grid_v2_lab_2_impl(
                 client, passphrase, symbol, price_step_rate,
                 is_callback, executed_side, executed_price, is_reset
@@ -1931,8 +2214,11 @@ def _grid_v2_lab_2_impl(client, passphrase, symbol, price_step_rate, is_callback
         strategy = find_strategy_by_passphrase(passphrase)
         balance = get_balance_by_symbol(symbol)
         
-        # 根據目前持倉方向決定槓桿率
-        position_amount = float(balance.position_amount)
+        # 根據目前持倉方向決定槓桿率，持倉優先讀取串流維護的帳戶狀態
+        tracker = account_trackers.ready_for(client)
+        position_amount = tracker.position_amount(symbol) if tracker else None
+        if position_amount is None:
+            position_amount = float(balance.position_amount)
         
         # 使用 exchange_info_map 獲取交易對資訊
         symbol_info = exchange_info_map.get(symbol)
@@ -1955,18 +2241,8 @@ Leverage: {strategy.leverage}
 Position Amount: {position_amount}
 ------------------------""")
                 
-        # 如果是重置模式，先取消所有掛單
-        if is_reset:
-            try:
-                logger.info(f"重置模式：開始取消所有掛單 - Symbol: {symbol}")
-                client.futures_cancel_all_open_orders(symbol=symbol)
-                logger.info("已取消所有掛單")
-                current_orders = []
-            except Exception as e:
-                logger.error(f"取消掛單時發生錯誤: {str(e)}")
-                raise
-        else:
-            current_orders = client.futures_get_open_orders(symbol=symbol)
+        # 重置模式不再全部撤單，之後與目標網格比對只調整有差異的價位
+        current_orders = open_order_mirror.get_open_orders(client, symbol)
         
         # 如果沒有提供成交價格，則獲取當前市價
         if executed_price is None:
@@ -1977,13 +2253,17 @@ Position Amount: {position_amount}
             
         trade_group_id = generate_trade_group_id()
 
+        grid_depth = strategy.grid_depth
+
         # 在計算數量時根據持倉方向和交易方向決定槓桿率
-        def get_order_quantity(side, price):
+        def get_leverage_rate(side):
             if position_amount < 0:  # 目前持空單
-                leverage_rate = float(strategy.short_leverage_rate if side == 'SELL' else 1.0)
-            else:  # 目前持多單或無倉位
-                leverage_rate = float(strategy.leverage_rate if side == 'BUY' else 1.0)
-            
+                return float(strategy.short_leverage_rate if side == 'SELL' else 1.0)
+            # 目前持多單或無倉位
+            return float(strategy.leverage_rate if side == 'BUY' else 1.0)
+
+        def get_order_quantity(side, price):
+            leverage_rate = get_leverage_rate(side)
             return get_grid_quantity(
                 symbol=symbol,
                 balance=balance,
@@ -2000,57 +2280,38 @@ Position Amount: {position_amount}
 基準價格: {base_price}
 價格間隔: {price_step_rate*100}%
 Tick Size: {tick_size}
+網格深度: {grid_depth}
 重置模式: {'是' if is_reset else '否'}
 ------------------------""")
-            new_orders = []
-            
-            # 生成5個買單
-            for i in range(5):
-                raw_price = base_price * (1 - price_step_rate) ** (i + 1)
-                price = math.floor(raw_price / tick_size) * tick_size
-                quantity = get_order_quantity('BUY', price)
-                new_orders.append({
-                    'symbol': symbol,
-                    'side': 'BUY',
-                    'type': 'LIMIT',
-                    'timeInForce': 'GTC',
-                    'price': format_decimal_symbol_price(symbol, price),
-                    'quantity': quantity,
-                    'newClientOrderId': f"{trade_group_id}_B{i+1}"
-                })
-            
-            # 生成5個賣單
-            for i in range(5):
-                raw_price = base_price * (1 + price_step_rate) ** (i + 1)
-                price = math.ceil(raw_price / tick_size) * tick_size
-                quantity = get_order_quantity('SELL', price)
-                new_orders.append({
-                    'symbol': symbol,
-                    'side': 'SELL',
-                    'type': 'LIMIT',
-                    'timeInForce': 'GTC',
-                    'price': format_decimal_symbol_price(symbol, price),
-                    'quantity': quantity,
-                    'newClientOrderId': f"{trade_group_id}_S{i+1}"
-                })
+            # 一次產生每邊 grid_depth 個價位與數量，價格為整數 tick 的精確字串
+            grid_budget = float(balance.available_margin) * 0.003 * strategy.leverage
+            ladder = build_ladder(
+                base_price=base_price,
+                depth=grid_depth,
+                step_rate=price_step_rate,
+                tick_size=symbol_info['tickSize'],
+                price_precision=price_precision,
+                quantity_precision=quantity_precision,
+                buy_budget=grid_budget * get_leverage_rate('BUY'),
+                sell_budget=grid_budget * get_leverage_rate('SELL'),
+                min_notional=min_notional
+            )
+            new_orders = ladder.orders(symbol, trade_group_id)
             
-            # 批次發送訂單（每次最多5個）
-            for i in range(0, len(new_orders), 5):
-                batch = new_orders[i:i+5]
-                try:
-                    response = client.futures_place_batch_order(
-                        batchOrders=json.dumps(batch)
-                    )
-                    logger.info(f"""
-批次下單結果 ({i//5 + 1}/2):
-訂單數量: {len(batch)}
+            # 價格在半個網格間距內且數量相近的掛單保留，其餘批次撤單/下單
+            kept, to_cancel, to_place = diff_grid_orders(
+                new_orders, current_orders, price_tolerance=price_step_rate / 2
+            )
+            logger.info(f"""
+網格比對結果:
+交易對: {symbol}
 交易組ID: {trade_group_id}
-響應內容: {json.dumps(response, indent=2)}
-symbol: {batch[0]['symbol']}
+保留: {len(kept)}
+撤單: {len(to_cancel)}
+下單: {len(to_place)}
 ------------------------""")
-                except Exception as e:
-                    logger.error(f"批次下單失敗: {str(e)}")
-                    return
+            if not apply_grid_diff(client, symbol, to_cancel, to_place):
+                return
 
         elif is_callback and executed_side:
             # 處理訂單成交後的邏輯
@@ -2065,10 +2326,10 @@ symbol: {batch[0]['symbol']}
                 if sell_orders:
                     furthest_sell = max(sell_orders, key=lambda x: float(x['price']))
                     try:
-                        client.futures_cancel_order(
+                        open_order_mirror.record_orders(client.futures_cancel_order(
                             symbol=symbol,
                             orderId=furthest_sell['orderId']
-                        )
+                        ))
                         logger.info(f"已取消最遠賣單，價格: {furthest_sell['price']}")
                     except Exception as e:
                         logger.error(f"取消賣單失敗: {str(e)}")
@@ -2093,7 +2354,7 @@ symbol: {batch[0]['symbol']}
                     lowest_buy = min(buy_orders, key=lambda x: float(x['price']))
                     raw_price = float(lowest_buy['price']) * (1 - price_step_rate)
                 else:
-                    raw_price = base_price * (1 - price_step_rate * 5)
+                    raw_price = base_price * (1 - price_step_rate * grid_depth)
                     
                 new_far_buy_price = math.floor(raw_price / tick_size) * tick_size
                 quantity = get_order_quantity('BUY', new_far_buy_price)
@@ -2104,7 +2365,7 @@ symbol: {batch[0]['symbol']}
                     'timeInForce': 'GTC',
                     'price': format_decimal_symbol_price(symbol, new_far_buy_price),
                     'quantity': quantity,
-                    'newClientOrderId': f"{trade_group_id}_B5"
+                    'newClientOrderId': f"{trade_group_id}_B{grid_depth}"
                 })
                 
             elif executed_side == 'SELL':
@@ -2114,10 +2375,10 @@ symbol: {batch[0]['symbol']}
                 if buy_orders:
                     furthest_buy = min(buy_orders, key=lambda x: float(x['price']))
                     try:
-                        client.futures_cancel_order(
+                        open_order_mirror.record_orders(client.futures_cancel_order(
                             symbol=symbol,
                             orderId=furthest_buy['orderId']
-                        )
+                        ))
                         logger.info(f"已取消最遠買單，價格: {furthest_buy['price']}")
                     except Exception as e:
                         logger.error(f"取消買單失敗: {str(e)}")
@@ -2142,7 +2403,7 @@ symbol: {batch[0]['symbol']}
                     highest_sell = max(sell_orders, key=lambda x: float(x['price']))
                     raw_price = float(highest_sell['price']) * (1 + price_step_rate)
                 else:
-                    raw_price = base_price * (1 + price_step_rate * 5)
+                    raw_price = base_price * (1 + price_step_rate * grid_depth)
                     
                 new_far_sell_price = math.ceil(raw_price / tick_size) * tick_size
                 quantity = get_order_quantity('SELL', new_far_sell_price)
@@ -2153,7 +2414,7 @@ symbol: {batch[0]['symbol']}
                     'timeInForce': 'GTC',
                     'price': format_decimal_symbol_price(symbol, new_far_sell_price),
                     'quantity': quantity,
-                    'newClientOrderId': f"{trade_group_id}_S5"
+                    'newClientOrderId': f"{trade_group_id}_S{grid_depth}"
                 })
             
             # 批次下新單
@@ -2162,6 +2423,7 @@ symbol: {batch[0]['symbol']}
                     response = client.futures_place_batch_order(
                         batchOrders=json.dumps(new_orders)
                     )
+                    open_order_mirror.record_orders(response)
                     logger.info(f"""
 批次下單結果:
 訂單數量: {len(new_orders)}
@@ -2195,13 +2457,13 @@ def check_and_reset_grid_orders(client, symbol):
             return False
             
         try:
-            current_orders = client.futures_get_open_orders(symbol=symbol)
+            current_orders = open_order_mirror.get_open_orders(client, symbol)
+            # 查找對應的策略
+            strategy = get_strategy_by_symbol(symbol)
+            expected_orders = 2 * strategy.grid_depth
             
-            if len(current_orders) != 10:
-                logger.info(f"檢測到 {symbol} 掛單數量錯誤 ({len(current_orders)}/10)，執行重置")
-                
-                # 查找對應的策略
-                strategy = get_strategy_by_symbol(symbol)
+            if len(current_orders) != expected_orders:
+                logger.info(f"檢測到 {symbol} 掛單數量錯誤 ({len(current_orders)}/{expected_orders})，執行重置")
                 logger.info(strategy)
                 if strategy:
                     grid_v2_lab_2(
@@ -2233,12 +2495,7 @@ def get_active_grid_v2_symbols() -> list:
         list: 符合條件的交易對符號列表，例如 ['BTCUSDT', 'ETHUSDT']
     """
     try:
-        symbols = Strategy.objects.filter(
-            strategy_type='grid_v2',
-            status='ACTIVE'
-        ).values_list('symbol', flat=True)
-        
-        return list(symbols)
+        return [strategy.symbol for strategy in strategy_registry.by_type('grid_v2', status='ACTIVE')]
         
     except Exception as e:
         logger.error(f"獲取ACTIVE grid_v2 交易對時發生錯誤: {str(e)}")
@@ -8,8 +8,9 @@ from decimal import Decimal
 import requests
 import inspect
 import time
-from binance import Client, ThreadedWebsocketManager, ThreadedDepthCacheManager
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse
+from django.db import connection
+from django.conf import settings
 from rest_framework.decorators import api_view
 from datetime import datetime
 import schedule
@@ -40,6 +41,9 @@ from .utils import (
     OrderSide,
     PositionSide,
     BinanceWebsocketClient,
+    subscribe_account_streams,
+    run_reduce_execution,
+    is_account_streaming,
     generate_grid_levels,
     update_grid_positions_price,
     generate_trade_group_id,
@@ -49,6 +53,7 @@ from .utils import (
     create_trade,
     get_strategy_by_symbol,
     create_order_execution,
+    is_execution_recorded,
     risk_control,
     recover_leverage,
     recover_all_active_strategy_leverage,
@@ -59,9 +64,29 @@ from .utils import (
     check_and_reset_grid_orders,
     get_active_grid_v2_symbols
 )
+from .dispatcher import (
+    NotificationDispatcher,
+    classify_notification_type,
+    NOTIFICATION_ENTRY
+)
+from .notification import decode_notification, NotificationDecodeError
+from .journal import WebhookJournal, is_stale
+from .dedup import AlertDeduplicator
+from .coalesce import coalesce_notifications, audit_collapsed_notification
+from .tracing import tracer
+from .metrics import metrics
+from .open_orders import open_order_mirror
+from .account_state import account_trackers
+from .market_data import mark_price_cache
+from .exchange import get_client, rate_limit_governor, LOW
+from .fill_debounce import FillDebouncer
+from .stream_hub import stream_hub
+from .order_events import order_event_waiter
+from .order_book import order_book_cache
+from .registry import strategy_registry
+from .execution import execution_scheduler
+from .models import AccountInfo
 
-notification_queue_entry = queue.Queue()
-notification_queue_exit = queue.Queue()
 balance_update_queue = queue.Queue()
 
 main_account = get_main_account_info()
@@ -69,7 +94,7 @@ main_account = get_main_account_info()
 api_key = main_account.api_key
 api_secret = main_account.api_secret
 
-client = Client(api_key, api_secret)
+client = get_client(api_key, api_secret)
 tradingview_passphase = os.environ['TRADINGVIEW_PASSPHASE']
 
 # 在檔案頂部定義 logger
@@ -91,12 +116,66 @@ def initialize_websocket():
             callback=ws_callback,
             custom_logger=logger  # 使用 views 中定義的 logger
         )
-        # 在新線程中啟動 websocket
-        websocket_thread = threading.Thread(target=ws_client.run)
-        websocket_thread.daemon = True
-        websocket_thread.start()
+        # 所有串流共用 StreamHub 的事件迴圈線程
+        ws_client.start_websocket()
+        # 其他帳戶的 user data stream 只維護持倉狀態，get_position 由記憶體讀取
+        try:
+            subscribe_account_streams(AccountInfo.objects.exclude(api_key=api_key))
+        except Exception as e:
+            logger.error(f"訂閱其他帳戶串流時發生錯誤: {str(e)}")
         logger.info("WebSocket 客戶端已初始化")
 
+@tracer.traced('grid_v2_fills')
+def handle_grid_v2_fills(symbol, fills):
+    """
+    處理合併後的 grid_v2 成交
+
+    單筆成交沿用成交後調整兩端掛單的邏輯；
+    多筆成交代表價格已穿越多個價位，直接以最後成交價為基準重置網格 (只調整有差異的價位)。
+    每批成交只執行一次持倉更新與風控。
+    """
+    last_fill = fills[-1]
+    if len(fills) == 1:
+        grid_v2_lab_2(
+            client=client,
+            passphrase=last_fill['passphrase'],
+            symbol=symbol,
+            is_callback=True,
+            executed_side=last_fill['side'],
+            executed_price=last_fill['price']
+        )
+    else:
+        logger.info(f"{symbol} 合併 {len(fills)} 筆成交，以最後成交價 {last_fill['price']} 重置網格")
+        grid_v2_lab_2(
+            client=client,
+            passphrase=last_fill['passphrase'],
+            symbol=symbol,
+            executed_price=last_fill['price'],
+            is_reset=True
+        )
+
+    v2 = get_active_grid_v2_symbols()
+    close_orders = update_all_future_positions(client)
+    for close_symbol, close_order in close_orders.items():
+        if close_symbol in v2:
+            # risk_control 等待縮減完成 (有上限) 後才返回，重置時使用縮減後的倉位
+            risk_control(client=client, symbol=close_symbol, close_order=close_order)
+            grid_v2_lab_2(
+                client=client,
+                passphrase=get_strategy_by_symbol(close_symbol).passphrase,
+                symbol=close_symbol,
+                is_reset=True
+            )
+
+
+# 同一交易對在視窗內的連續成交合併成一次網格調整
+grid_fill_debouncer = FillDebouncer(
+    handle_grid_v2_fills,
+    window=float(os.environ.get('FILL_DEBOUNCE_SECONDS', '0.25'))
+)
+
+
+@tracer.traced('ws_callback')
 def ws_callback(msg):
     """WebSocket 回調函數"""
     if msg['e'] == 'ORDER_TRADE_UPDATE':
@@ -119,62 +198,64 @@ def ws_callback(msg):
             
             # 當訂單部分成交或完全成交時記錄執行情況
             if order['X'] in [OrderStatus.PARTIALLY_FILLED, OrderStatus.FILLED]:
+                query_count = [0]
+
+                def count_query(execute, sql, params, many, context):
+                    query_count[0] += 1
+                    return execute(sql, params, many, context)
+
                 try:
                     symbol = order['s']
-                    strategy = get_strategy_by_symbol(symbol)
-                    execution_type = 'FULL' if order['X'] == OrderStatus.FILLED else 'PARTIAL'
-                    create_order_execution(strategy, order, execution_type)
-                    # 根據訂單類型決定交易類型 - 移到外面確保一定會被定義
-                    trade_type = "GRID_V2_MARKET" if order['o'] == "MARKET" else "GRID_V2_LIMIT"
-                    
-                    # 創建交易記錄
-                    create_trade_from_ws_order(order, strategy, trade_type)
-
-                    # 更新餘額（已實現盈虧減去手續費）
-                    realized_pnl = float(order.get('rp', 0))  # 已實現盈虧
-                    commission = float(order.get('n', 0))     # 手續費
-                    
-                    # 更新餘額
-                    update_balance_from_execution(
-                        strategy_id=strategy.strategy_id,
-                        realized_pnl=realized_pnl,
-                        commission=commission
-                    )
-
-                    v2 = get_active_grid_v2_symbols()
-
-                    # V2，執行額外操作
-                    if symbol in v2 and order.get('o') == 'LIMIT':
-                        # 使用原始掛單價格作為基準價格
-                        order_price = float(order.get('p', 0))  # 'p' 是原始掛單價格
-                        order_side = order.get('S', '')  # 'S' 是訂單方向
-                        
-                        grid_v2_lab_2(
-                            client=client, 
-                            passphrase=strategy.passphrase, 
-                            symbol=symbol,
-                            is_callback=True,
-                            executed_side=order_side,
-                            executed_price=order_price
+                    with tracer.span('db.record_fill'), connection.execute_wrapper(count_query):
+                        # 斷線補回與即時事件可能重疊，同一成交只處理一次
+                        if is_execution_recorded(order['t']):
+                            logger.info(f"成交 {order['t']} 已記錄，略過{'補回' if msg.get('replayed') else '重複'}事件")
+                            return
+                        strategy = get_strategy_by_symbol(symbol)
+                        execution_type = 'FULL' if order['X'] == OrderStatus.FILLED else 'PARTIAL'
+                        create_order_execution(strategy, order, execution_type)
+                        # 根據訂單類型決定交易類型 - 移到外面確保一定會被定義
+                        trade_type = "GRID_V2_MARKET" if order['o'] == "MARKET" else "GRID_V2_LIMIT"
+
+                        # 創建交易記錄
+                        create_trade_from_ws_order(order, strategy, trade_type)
+
+                        # 更新餘額（已實現盈虧減去手續費）
+                        realized_pnl = float(order.get('rp', 0))  # 已實現盈虧
+                        commission = float(order.get('n', 0))     # 手續費
+
+                        # 更新餘額
+                        update_balance_from_execution(
+                            strategy_id=strategy.strategy_id,
+                            realized_pnl=realized_pnl,
+                            commission=commission
                         )
-                        
-                        close_orders = update_all_future_positions(client)
-                        for symbol, close_order in close_orders.items():
-                            if symbol in v2:
-                                risk_control(client=client, symbol=symbol, close_order=close_order)
-                                grid_v2_lab_2(
-                                    client=client,
-                                    passphrase=strategy.passphrase,
-                                    symbol=symbol,
-                                    is_reset=True
-                                )
+
+                    # V2，網格調整交由去抖動器合併同一波成交後執行
+                    if order.get('o') == 'LIMIT' and symbol in get_active_grid_v2_symbols():
+                        grid_fill_debouncer.submit(symbol, {
+                            'passphrase': strategy.passphrase,
+                            'side': order.get('S', ''),  # 'S' 是訂單方向
+                            'price': float(order.get('p', 0)),  # 'p' 是原始掛單價格
+                        })
                 except Exception as e:
                     logger.error(f"記錄交易時發生錯誤: {str(e)}")
                 except Exception as e:
                     logger.error(f"記錄訂單執行時發生錯誤: {str(e)}")
+                finally:
+                    db_queries_per_fill.observe(query_count[0])
 
 # 在應用啟動時初始化 WebSocket
 initialize_websocket()
+# WebSocket 啟動後載入掛單簿，載入期間的訂單事件會在快照後重新套用
+try:
+    open_order_mirror.load(client)
+except Exception as e:
+    logger.error(f"載入掛單簿時發生錯誤，將於首次讀取時重試: {str(e)}")
+try:
+    account_trackers.register(api_key, 'main').load(client)
+except Exception as e:
+    logger.error(f"載入帳戶持倉時發生錯誤，將於對帳時重試: {str(e)}")
 ####################################
 
 
@@ -205,20 +286,39 @@ get_account_trade_delay = 2
 percentage = 0.95
 # preserve prev position exists less than
 preserve_prev_position_second = 20
+# 通知派發分片數量 (同一策略/交易對落在同一分片)
+notification_shards = 4
+# webhook 日誌路徑，未處理完成的訊號在重啟後重新派發
+webhook_journal_path = os.environ.get(
+    'WEBHOOK_JOURNAL_PATH', os.path.join(settings.BASE_DIR.parent, 'journal', 'webhook.journal'))
+# 重啟後只重新派發此秒數內收到的訊號，更舊的訊號以當下價格執行已無意義
+webhook_journal_max_age = float(os.environ.get('WEBHOOK_JOURNAL_MAX_AGE', '300'))
+# 重複警報判定的有效秒數
+alert_dedup_ttl = 120
+# span 追蹤檔案路徑
+trace_log_path = os.environ.get('TRACE_LOG_PATH', '../logs/trace.log')
 ####################################
 
-def parse_type(notification):
+tracer.configure(trace_log_path)
+
+webhook_journal = WebhookJournal(webhook_journal_path)
+alert_deduplicator = AlertDeduplicator(ttl=alert_dedup_ttl)
+
+webhook_alerts_total = metrics.counter('webhook_alerts_total', 'webhook 警報數量', ('result',))
+db_queries_per_fill = metrics.histogram(
+    'db_queries_per_fill', '每筆成交回報執行的 SQL 數量', buckets=(1, 2, 5, 10, 20, 50, 100))
+
+def decode_request_notification(plain):
     """
-    解析通知訊息中的類型
+    解析請求中的通知，格式錯誤時記錄並返回 None
     """
     try:
-        notification_json = json.loads(notification)
-        notification_type = json.loads(notification_json['message'])
-        return notification_type['type']
-    except Exception as e:
-        logger.error(f"解析type時發生錯誤: {str(e)}")
-        logger.error(f"通知內容: {notification}")
-        raise  # 重新拋出異常，維持原本的中斷行為
+        return decode_notification(plain)
+    except NotificationDecodeError as e:
+        webhook_alerts_total.inc('invalid')
+        logger.error(f"解析通知時發生錯誤: {str(e)}")
+        logger.error(f"通知內容: {plain}")
+        return None
 
 
 @api_view(['GET', 'POST'])
@@ -226,8 +326,15 @@ def message(request):
     req_id = wrap_str(str(uuid.uuid1()).split("-")[0])
     print(req_id + "message")
     plain = request.body.decode('utf-8')
-    print("type: " + parse_type(plain))
-    notification_queue_entry.put(plain)
+    notification = decode_request_notification(plain)
+    if notification is None:
+        return HttpResponse('invalid notification', status=400)
+    print("type: " + str(notification.message_type))
+    if alert_deduplicator.is_duplicate(notification):
+        webhook_alerts_total.inc('duplicate')
+        logger.info(f"{req_id} - duplicate alert ignored")
+        return HttpResponse('received')
+    accept_notification(notification, NOTIFICATION_ENTRY)
     return HttpResponse('received')
 
 
@@ -281,47 +388,144 @@ strategy_list()
 def webhook(request):
     logger.info("receive notification")
     plain = request.body.decode('utf-8')
-    notification_type = parse_type(plain)
-    if notification_type == 'long_exit' or \
-            notification_type == 'short_exit' or \
-            notification_type == 'exit' or \
-            notification_type == 'close_all':
-        notification_queue_exit.put(plain)
-    if notification_type == 'long_entry' or \
-            notification_type == 'short_entry' or \
-            notification_type == 'entry':
-        notification_queue_entry.put(plain)
+    notification = decode_request_notification(plain)
+    if notification is None:
+        return HttpResponse('invalid notification', status=400)
+    kind = classify_notification_type(notification.message_type)
+    if kind is None:
+        webhook_alerts_total.inc('ignored')
+    elif alert_deduplicator.is_duplicate(notification):
+        webhook_alerts_total.inc('duplicate')
+        logger.info(f"duplicate alert ignored: {notification.raw}")
+    else:
+        accept_notification(notification, kind)
+    return HttpResponse('received')
+
+
+async def webhook_async(request):
+    """
+    非同步 webhook 入口 (ASGI)
+
+    只做解析、去重、寫入日誌與放入派發器，不存取 ORM，
+    不為每筆警報佔用一個 Django 工作線程。
+    """
+    notification = decode_request_notification(request.body.decode('utf-8'))
+    if notification is None:
+        return HttpResponse('invalid notification', status=400)
+    kind = classify_notification_type(notification.message_type)
+    if kind is None:
+        webhook_alerts_total.inc('ignored')
+    elif alert_deduplicator.is_duplicate(notification):
+        webhook_alerts_total.inc('duplicate')
+    else:
+        accept_notification(notification, kind)
     return HttpResponse('received')
 
 
-def handle_webhook_entry_schedule():
-    # print("handle_webhook_entry_schedule")
-    if notification_queue_exit.empty() and not notification_queue_entry.empty():
-        notification = notification_queue_entry.get()
-        handle_webhook(notification)
-        notification_queue_entry.task_done()
+# Django 4.0 的 csrf_exempt 會把 async view 包成同步函數，直接設定屬性
+webhook_async.csrf_exempt = True
+
 
+def accept_notification(notification, kind):
+    """
+    先寫入日誌再放入派發器，確保回應 webhook 前訊號已落地
+    """
+    webhook_alerts_total.inc('accepted')
+    seq = webhook_journal.append(kind, notification.raw)
+    notification_dispatcher.submit(notification, kind, key=notification.shard_key, ticket=seq)
 
-def handle_webhook_exit_schedule():
-    # print("handle_webhook_exit_schedule")
-    if not notification_queue_exit.empty():
-        notification = notification_queue_exit.get()
-        handle_webhook(notification)
-        notification_queue_exit.task_done()
 
+def recover_journal_notifications():
+    """
+    重新派發上次停止時尚未處理完成的訊號
+
+    超過 webhook_journal_max_age 的訊號 (或沒有時間記錄的舊格式記錄) 不派發，記錄後直接 ack。
+    """
+    now = time.time()
+    for seq, kind, ts, body in webhook_journal.recover():
+        notification = decode_request_notification(body)
+        if notification is None:
+            webhook_journal.ack(seq)
+            continue
+        if is_stale(ts, webhook_journal_max_age, now):
+            age = 'unknown' if ts is None else f"{now - ts:.0f}s"
+            logger.warning(f"略過過期的日誌訊號 seq={seq} (age {age}): {body}")
+            webhook_alerts_total.inc('stale')
+            webhook_journal.ack(seq)
+            continue
+        logger.info(f"重新派發日誌中的訊號 seq={seq}")
+        notification_dispatcher.submit(notification, kind, key=notification.shard_key, ticket=seq)
+
+
+def prometheus_metrics(request):
+    """Prometheus 文字格式的執行期指標"""
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def trace_summary(request):
+    """各階段耗時 p50/p95/p99，帶 trace 參數時返回該追蹤的所有 span"""
+    trace_id = request.GET.get('trace')
+    if trace_id:
+        return JsonResponse({'trace': trace_id, 'spans': tracer.spans_for(trace_id)})
+    return JsonResponse(tracer.summary())
+
+
+def queue_status(request):
+    """通知佇列深度與派發延遲"""
+    status = notification_dispatcher.stats()
+    status['journal_pending'] = webhook_journal.pending_count()
+    status['dedup'] = alert_deduplicator.stats()
+    status['open_orders'] = open_order_mirror.stats()
+    status['accounts'] = account_trackers.stats()
+    status['mark_prices'] = mark_price_cache.stats()
+    status['streams'] = stream_hub.stats()
+    status['order_books'] = order_book_cache.stats()
+    status['executions'] = execution_scheduler.stats()
+    status['rate_limit'] = rate_limit_governor.stats()
+    status['pending_fills'] = grid_fill_debouncer.pending()
+    return JsonResponse(status)
 
-def handle_webhook(body_unicode):
+
+@api_view(['GET', 'POST'])
+def executions(request):
+    """
+    分批執行中的母單
+
+    GET 列出母單與進度；POST {"passphrase": ..., "execution_id": ...} 中止該策略的母單
+    """
+    if request.method == 'GET':
+        return JsonResponse({'executions': execution_scheduler.stats()})
+    try:
+        body = json.loads(request.body.decode('utf-8'))
+    except ValueError:
+        return HttpResponse('invalid request', status=400)
+    strategy = find_strategy_by_passphrase(body.get('passphrase'))
+    parent = execution_scheduler.get(body.get('execution_id'))
+    if strategy is None or parent is None or parent.strategy_id != strategy.strategy_id:
+        return HttpResponse('execution not found', status=404)
+    canceled = execution_scheduler.cancel(parent.execution_id)
+    return JsonResponse({'canceled': canceled, 'execution': parent.stats()})
+
+
+def handle_webhook(notification):
     req_id = wrap_str(str(uuid.uuid1()).split("-")[0])
-    logger.info(f"{req_id} - received signal: {body_unicode}")
-    if body_unicode:
+    with tracer.trace('webhook', trace_id=req_id, ticker=notification.ticker,
+                      type=notification.strategy_type, message_type=notification.message_type):
+        tracer.record('queue_wait', time.monotonic() - notification.received_at)
+        return _handle_webhook(req_id, notification)
+
+
+def _handle_webhook(req_id, notification):
+    logger.info(f"{req_id} - received signal: {notification.raw}")
+    if notification.raw:
         try:
-            notification = json.loads(body_unicode)
-            strategy = find_strategy_by_passphrase(notification['passphrase'])
+            with tracer.span('db.find_strategy'):
+                strategy = find_strategy_by_passphrase(notification.passphrase)
             if strategy is not None:
                 logger.info(f"{req_id} - passphrase correct")
                 # 檢查notification中是否存在'type'字段，並判斷其值
-                if 'type' in notification:
-                    notification_type = notification['type']
+                if notification.strategy_type is not None:
+                    notification_type = notification.strategy_type
                     if notification_type == 'grid':
                         # 如果type為'grid'，則處理網格交易通知
                         handle_grid_notification(req_id, strategy, notification)
@@ -347,19 +551,19 @@ def handle_webhook(body_unicode):
     return HttpResponse('received')
 
 
+@tracer.traced()
 def handle_grid_notification(req_id, strategy, notification):
-    notification_message = json.loads(notification.get("message", {}))
-    grids = int(notification_message.get("grids", 0))
-    grid_index = int(notification_message.get("gridIndex", 0))  # 从通知中获取格子索引，缺省值为0
-    leverage = int(notification_message.get("leverage", 1))  # 从通知中获取杠杆数，缺省值为1
-    weight = float(notification_message.get("weight", 1))
-    total_weight = float(notification_message.get("totalWeight", 10))
-    notification_type = notification_message.get("type", "entry")  # 从通知中获取类型，缺省值为"entry"
-    notification_symbol = notification.get("ticker")
-    notification_entry = notification.get("entry")
+    grids = notification.grids
+    grid_index = notification.grid_index  # 从通知中获取格子索引，缺省值为0
+    leverage = notification.leverage  # 从通知中获取杠杆数，缺省值为1
+    weight = notification.weight
+    total_weight = notification.total_weight
+    notification_type = notification.message_type or "entry"  # 从通知中获取类型，缺省值为"entry"
+    notification_symbol = notification.ticker
+    notification_entry = notification.entry
 
     if not notification_symbol or not notification_entry:
-        logger.info(f"{req_id} - Field not found in notification. {notification}")
+        logger.info(f"{req_id} - Field not found in notification. {notification.raw}")
         return
     if notification_type == "entry":
         # 处理开仓逻辑
@@ -397,24 +601,27 @@ def handle_grid_notification(req_id, strategy, notification):
         # 未知的通知类型
         logger.error(f"{req_id} - Unknown notification type {notification_type} for strategy {strategy.strategy_id}")
 
+@tracer.traced()
 def handle_grid_notification_v2(req_id, strategy, notification):
-    notification_message = json.loads(notification.get("message", {}))
-    logger.info(f"{req_id} - notification_message {notification_message}")
-    grids = int(notification_message.get("grids", 0))
-    grid_index = int(notification_message.get("gridIndex", 0))  # 从通知中获取格子索引，缺省值为0
-    leverage = int(notification_message.get("leverage", 1))  # 从通知中获取杠杆数，缺省值为1
-    weight = int(notification_message.get("weight", 1))
-    total_weight = int(notification_message.get("totalWeight", 10))
-    notification_type = notification_message.get("type", "entry")  # 从通知中获取类型，缺省值为"entry"
-    notification_symbol = notification.get("ticker")
-    notification_entry = notification.get("entry")
-
-    levels = generate_grid_levels(float(notification_message.get("lower_bound")), float(notification_message.get("upper_bound")), grids)
+    logger.info(f"{req_id} - notification_message {notification.message}")
+    grids = notification.grids
+    grid_index = notification.grid_index  # 从通知中获取格子索引，缺省值为0
+    leverage = notification.leverage  # 从通知中获取杠杆数，缺省值为1
+    weight = int(notification.weight)
+    total_weight = int(notification.total_weight)
+    notification_type = notification.message_type or "entry"  # 从通知中获取类型，缺省值为"entry"
+    notification_symbol = notification.ticker
+    notification_entry = notification.entry
+
+    if notification.lower_bound is None or notification.upper_bound is None:
+        logger.info(f"{req_id} - Grid bounds not found in notification. {notification.raw}")
+        return
+    levels = generate_grid_levels(notification.lower_bound, notification.upper_bound, grids, notification_symbol)
     logger.info(f"{req_id} - levels {levels}")
     update_grid_positions_price(strategy, levels)
 
     if not notification_symbol or not notification_entry:
-        logger.info(f"{req_id} - Field not found in notification. {notification}")
+        logger.info(f"{req_id} - Field not found in notification. {notification.raw}")
         return
     if notification_type == "entry":
         # 处理开仓逻辑
@@ -472,7 +679,7 @@ def open_grid_position(
     - leverage: 杠杆
     """
     try:
-        strategy_client = Client(strategy.account.api_key, strategy.account.api_secret)
+        strategy_client = get_client(strategy.account.api_key, strategy.account.api_secret)
         logger.info(f"{req_id} - strategy client {strategy_client}")
         symbol_exchange_info = exchange_info_map[notification_symbol]
         _price_precision = int(symbol_exchange_info['pricePrecision'])
@@ -558,7 +765,7 @@ def open_grid_position_v2(
     """
     try:
         # 直接使用strategy的api資訊
-        strategy_client = Client(strategy.account.api_key, strategy.account.api_secret)
+        strategy_client = get_client(strategy.account.api_key, strategy.account.api_secret)
         if not strategy_client:
             logger.error(f"{req_id} - Failed to get strategy client")
             return False
@@ -595,7 +802,9 @@ def open_grid_position_v2(
             price_precision=price_precision,
             split_parts=3,
             max_workers=3,
-            base_price_adjustment=0.00005
+            base_price_adjustment=0.00005,
+            # 不在請求路徑等待同步，深度簿尚未就緒時退回平均分割
+            order_book=order_book_cache.get(notification_symbol, client=strategy_client)
         )
 
         if entry_result['success']:
@@ -633,7 +842,9 @@ def open_grid_position_v2(
             logger.info(f"{req_id} - Grid entry V2完成: "
                         f"總成交量={entry_result['total_executed']}, "
                         f"平均價格={entry_result['avg_price']}, "
-                        f"最大價格調整={entry_result['max_price_adjustment'] * 100:.4f}%")
+                        f"最大價格調整={entry_result['max_price_adjustment'] * 100:.4f}%, "
+                        f"分割方式={entry_result['plan_source']}, "
+                        f"子單={entry_result['execution_count']}/{entry_result['attempted_parts']}")
 
             # 發送Telegram通知
             post_data = {
@@ -671,7 +882,7 @@ def close_grid_position(
     - notification_symbol: 通知裡的幣種
     """
     try:
-        strategy_client = Client(strategy.account.api_key, strategy.account.api_secret)
+        strategy_client = get_client(strategy.account.api_key, strategy.account.api_secret)
         # 查找所有对应的且当前为开仓状态的GridPosition记录
         grid_position_to_close = get_grid_position(
             strategy=strategy,
@@ -689,7 +900,7 @@ def close_grid_position(
             return
 
         position = get_position(req_id=req_id, strategy_client=strategy_client, symbol=notification_symbol)
-        close_grid_order(
+        close_response = close_grid_order(
             req_id=req_id,
             strategy_client=strategy_client,
             strategy=strategy,
@@ -702,7 +913,9 @@ def close_grid_position(
         grid_exit_trade = query_trade(trade_group_id=grid_position_to_close.trade_group_id, trade_type="GRID_EXIT")
         if grid_exit_trade is not None:
             start_time = str((grid_exit_trade.created_at_timestamp - 3600) * 1000)
-            time.sleep(get_account_trade_delay)
+            exit_order = close_response[0] if close_response else {}
+            wait_for_order(req_id, strategy_client.API_KEY, 'get_account_trade_delay', get_account_trade_delay,
+                           order_id=exit_order.get('orderId'))
             # 改由WS更新
             # update_balance_and_pnl(
             #     req_id=req_id,
@@ -747,7 +960,7 @@ def close_all_position(
     - notification_symbol: 通知裡的幣種
     """
     try:
-        strategy_client = Client(strategy.account.api_key, strategy.account.api_secret)
+        strategy_client = get_client(strategy.account.api_key, strategy.account.api_secret)
         # 查找所有对应的且当前为开仓状态的GridPosition记录
         grid_quantity_to_close = get_total_quantity_for_strategy(
             strategy=strategy
@@ -769,18 +982,34 @@ def close_all_position(
         logger.info(order_payload)
         logger.info(f"{req_id} - Closing order: {json.dumps(order_payload)}")
         if check_api_enable(enable_create_order):
-            exit_response = strategy_client.futures_place_batch_order(batchOrders=json.dumps(order_payload))
             # 生成trade_group_id
             trade_group_id = uuid.uuid4()
-            # 創建Trade實例
-            create_trades_from_binance(
-                binance_trades=exit_response,
+            # 大額平倉分批執行，子單成交由排程器寫入Trade
+            parent = run_reduce_execution(
+                client=strategy_client,
+                symbol=notification_symbol,
+                side="SELL",
+                quantity=order_payload[0]['quantity'],
                 strategy_id=strategy.strategy_id,
-                trade_group_id=trade_group_id,
-                trade_type_override="GRID_EXIT"
+                trade_group_id=str(trade_group_id),
+                trade_type="GRID_EXIT"
             )
+            if parent is not None:
+                exit_response = [parent.summary()]
+            else:
+                exit_response = strategy_client.futures_place_batch_order(batchOrders=json.dumps(order_payload))
+                # 創建Trade實例
+                create_trades_from_binance(
+                    binance_trades=exit_response,
+                    strategy_id=strategy.strategy_id,
+                    trade_group_id=trade_group_id,
+                    trade_type_override="GRID_EXIT"
+                )
 
-            time.sleep(close_all_position_delay)
+                # 平倉成交後再查詢成交紀錄計算盈虧
+                exit_order = exit_response[0] if exit_response else {}
+                wait_for_order(req_id, strategy_client.API_KEY, 'close_all_position_delay', close_all_position_delay,
+                               order_id=exit_order.get('orderId'))
 
             start_time = str(int(datetime.timestamp(datetime.now()) - 3600) * 1000)
 
@@ -803,9 +1032,48 @@ def close_all_position(
 ###
 
 
+def wait_for_symbol_settled(api_key, symbol, name, timeout):
+    """
+    等待帳戶該交易對最後一次下單/撤單請求的事件到達並平靜下來，最長 timeout 秒
+
+    取代原本的固定延遲：請求送出時間由 InstrumentedClient 記錄，需收到該時間之後的
+    ORDER_TRADE_UPDATE / ACCOUNT_UPDATE 才返回；逾時 (例如撤單時沒有掛單) 即等同原本的固定延遲。
+    帳戶串流未連線時退回固定延遲。
+    """
+    with tracer.span(f'wait.{name}'):
+        if is_account_streaming(api_key):
+            if not order_event_waiter.wait_settled(api_key, symbol, timeout=timeout):
+                logger.info(f"{symbol} {timeout} 秒內未收到請求後的訂單事件，已等待完整延遲 ({name})")
+        else:
+            time.sleep(timeout)
+
+
+def wait_for_order(req_id, api_key, name, timeout, client_order_id=None, order_id=None):
+    """
+    等待訂單進入最終狀態 (成交、取消、過期或拒絕)，最長 timeout 秒
+
+    取代原本的固定延遲；帳戶串流未連線時退回固定延遲。
+
+    Returns:
+        dict: 訂單事件，逾時或串流未連線返回 None
+    """
+    with tracer.span(f'wait.{name}'):
+        if not is_account_streaming(api_key):
+            time.sleep(timeout)
+            return None
+        order = order_event_waiter.wait_order(
+            api_key, client_order_id=client_order_id, order_id=order_id, timeout=timeout)
+        if order is None:
+            logger.warning(f"{req_id} - {timeout} 秒內未收到訂單 {client_order_id or order_id} 的最終狀態")
+        else:
+            logger.info(f"{req_id} - 訂單 {client_order_id or order_id} 狀態 {order['X']}")
+        return order
+
+
 def handle_notification_common(req_id, strategy, notification, position):
     logger.info(f"{req_id} - check current position")
-    time.sleep(close_position_delay)
+    wait_for_symbol_settled(strategy.account.api_key, notification.ticker, 'close_position_delay',
+                            close_position_delay)
     if position is not None:
         return handle_existing_position(req_id, strategy, notification, position)
     else:
@@ -826,7 +1094,7 @@ def handle_existing_position(
     prev_quantity = position['positionAmt']
     _price_precision = int(symbol_exchange_info['pricePrecision'])
     _quantity_precision = int(symbol_exchange_info['quantityPrecision'])
-    signal_position_size = round(float(notification['position_size']), _quantity_precision)
+    signal_position_size = round(notification.position_size or 0.0, _quantity_precision)
     prev_opposite_side = 'SELL' if float(prev_quantity) > 0 else (
         '' if float(prev_quantity) == 0.0 else 'BUY')
     prev_update_time = int(position['updateTime'])
@@ -893,15 +1161,15 @@ def handle_existing_position(
 
 # TODO refactor
 def handle_swing_notification2(req_id, strategy, notification):
-    strategy_client = Client(strategy.account.api_key, strategy.account.api_secret)
+    strategy_client = get_client(strategy.account.api_key, strategy.account.api_secret)
     logger.info(f"{req_id} - strategy client {strategy_client}")
-    signal_symbol = notification['ticker']
+    signal_symbol = notification.ticker
     symbol_exchange_info = exchange_info_map[signal_symbol]
     _price_precision = int(symbol_exchange_info['pricePrecision'])
     _quantity_precision = int(symbol_exchange_info['quantityPrecision'])
 
     logger.info(f"{req_id} - check current position")
-    time.sleep(close_position_delay)
+    wait_for_symbol_settled(strategy_client.API_KEY, signal_symbol, 'close_position_delay', close_position_delay)
     position = get_position(
         req_id=req_id,
         strategy_client=strategy_client,
@@ -910,18 +1178,16 @@ def handle_swing_notification2(req_id, strategy, notification):
     prev_quantity = position['positionAmt']
     prev_opposite_side = 'SELL' if float(prev_quantity) > 0 else (
         '' if float(prev_quantity) == 0.0 else 'BUY')
-    signal_symbol = notification['ticker']
-    signal_message_json = json.loads(notification['message']) if notification.get('message') else None
+    signal_message_json = notification.message
     logger.info(f"{req_id} - signal message {signal_message_json}") if signal_message_json else None
 
-    signal_message_type = signal_message_json['type'] if signal_message_json and 'type' in signal_message_json else None
-    signal_message_lev = signal_message_json['lev'] if signal_message_json and 'lev' in signal_message_json else None
+    signal_message_type = notification.message_type
+    signal_message_lev = notification.lev
 
-    signal_message_eq = int(
-        float(signal_message_json['eq'])) if signal_message_json and 'eq' in signal_message_json else 0
+    signal_message_eq = notification.eq if notification.eq is not None else 0
     signal_message_eq = 95 if signal_message_eq > 95 else signal_message_eq
     equity_percentage = signal_message_eq / 100
-    signal_position_size = round(float(notification['position_size']), _quantity_precision)
+    signal_position_size = round(notification.position_size or 0.0, _quantity_precision)
     is_close_notification = handle_notification_common(
         req_id=req_id,
         strategy=strategy,
@@ -937,7 +1203,6 @@ def handle_swing_notification2(req_id, strategy, notification):
         return
 
     # 根据信号类型处理订单创建和关闭
-    signal_message_type = signal_message_json.get('type') if signal_message_json else None
     if signal_message_type in ['long_entry', 'short_entry']:
         create_order_based_on_notification(
             req_id=req_id,
@@ -984,7 +1249,8 @@ def create_order_based_on_notification(
     cancel_all_open_order(symbol=signal_symbol, strategy_client=strategy_client)
     _price_precision = int(symbol_exchange_info['pricePrecision'])
     _quantity_precision = int(symbol_exchange_info['quantityPrecision'])
-    time.sleep(create_order_delay)
+    # 等待撤單事件到齊後再讀取可用餘額
+    wait_for_symbol_settled(strategy_client.API_KEY, signal_symbol, 'create_order_delay', create_order_delay)
     # prepare param
     all_usdt = Decimal(get_usdt(req_id=req_id, strategy_client=strategy_client))
     balance = find_balance_by_strategy_id(strategy.strategy_id)
@@ -1006,21 +1272,15 @@ def create_order_based_on_notification(
     logger.info(f"{req_id} - used usdt {usdt}")
 
     logger.info(f"{req_id} - parse entry")
-    signal_entry = round(float(notification['entry']), _price_precision)
+    signal_entry = round(notification.entry, _price_precision)
     logger.info(f"{req_id} - parse side")
-    signal_side = 'SELL' if notification['order'] == 'sell' else 'BUY'
-    logger.info(f"{req_id} - parse long times")
-    signal_long_times = int(notification['strategy']['long']['times'])
-    logger.info(f"{req_id} - parse long stop loss")
-    signal_long_stop_loss = notification['strategy']['long']['stopLoss']
-    logger.info(f"{req_id} - parse long take profit")
-    signal_long_take_profit = notification['strategy']['long']['takeProfit']
-    logger.info(f"{req_id} - parse short times")
-    signal_short_times = int(notification['strategy']['short']['times'])
-    logger.info(f"{req_id} - parse short stop loss")
-    signal_short_stop_loss = notification['strategy']['short']['stopLoss']
-    logger.info(f"{req_id} - parse long take profit")
-    signal_short_take_profit = notification['strategy']['short']['takeProfit']
+    signal_side = 'SELL' if notification.order == 'sell' else 'BUY'
+    signal_long_times = notification.long_times
+    signal_long_stop_loss = notification.long_stop_loss
+    signal_long_take_profit = notification.long_take_profit
+    signal_short_times = notification.short_times
+    signal_short_stop_loss = notification.short_stop_loss
+    signal_short_take_profit = notification.short_take_profit
     raw_quantity = 0 if usdt is None else math.floor(100000 * float(usdt) * equity_percentage / signal_entry) / 100000
 
     # params override by message
@@ -1048,9 +1308,9 @@ def create_order_based_on_notification(
                 float(signal_entry) * (100 + float(signal_short_stop_loss)) / 100), _price_precision)
 
     # params override by message
-    if signal_message_json is not None and 'sl' in signal_message_json:
+    if notification.sl is not None:
         logger.info(f"{req_id} - parse stop loss from message")
-        stop_loss_stop_price = round(float(signal_message_json['sl']), _price_precision)
+        stop_loss_stop_price = round(notification.sl, _price_precision)
 
     take_profit_stop_price = round(
         (float(signal_entry) * (100 + float(signal_long_take_profit)) / 100) if signal_side == 'BUY' else (
@@ -1124,27 +1384,22 @@ def close_order_based_on_notification(
 ###
 
 
+@tracer.traced()
 def handle_swing_notification(req_id, strategy, notification):
-    strategy_client = Client(strategy.account.api_key, strategy.account.api_secret)
+    strategy_client = get_client(strategy.account.api_key, strategy.account.api_secret)
     logger.info(f"{req_id} - strategy client {strategy_client}")
-    signal_symbol = notification['ticker']
+    signal_symbol = notification.ticker
     _price_precision = int(exchange_info_map[signal_symbol]['pricePrecision'])
     _quantity_precision = int(exchange_info_map[signal_symbol]['quantityPrecision'])
-    signal_position_size = round(float(notification['position_size']), _quantity_precision)
-    signal_message_json = None
-    signal_message_type = None
-    signal_message_lev = None
+    signal_position_size = round(notification.position_size or 0.0, _quantity_precision)
+    signal_message_json = notification.message
+    signal_message_type = notification.message_type
+    signal_message_lev = notification.lev
     signal_message_eq = None
-    signal_message = notification['message']
-    if signal_message is not None:
-        signal_message_json = json.loads(signal_message)
+    if signal_message_json is not None:
         logger.info(f"{req_id} - signal message {signal_message_json}")
-    if signal_message_json is not None and 'type' in signal_message_json:
-        signal_message_type = signal_message_json['type']
-    if signal_message_json is not None and 'lev' in signal_message_json:
-        signal_message_lev = signal_message_json['lev']
-    if signal_message_json is not None and 'eq' in signal_message_json:
-        signal_message_eq = int(float(signal_message_json['eq']))
+    if notification.eq is not None:
+        signal_message_eq = notification.eq
         if signal_message_eq > 95:
             signal_message_eq = 95
         percentage = signal_message_eq / 100
@@ -1153,7 +1408,7 @@ def handle_swing_notification(req_id, strategy, notification):
     allowed_close_position = False
 
     logger.info(f"{req_id} - check current position")
-    time.sleep(close_position_delay)
+    wait_for_symbol_settled(strategy_client.API_KEY, signal_symbol, 'close_position_delay', close_position_delay)
     position = get_position(req_id=req_id, strategy_client=strategy_client, symbol=signal_symbol)
     if position is not None:
         logger.info(f"{req_id} - position is not None")
@@ -1250,7 +1505,8 @@ def handle_swing_notification(req_id, strategy, notification):
     logger.info(f"{req_id} - close prev open order for entry signal")
     cancel_all_open_order(symbol=signal_symbol, strategy_client=strategy_client)
 
-    time.sleep(create_order_delay)
+    # 等待撤單事件到齊後再讀取可用餘額
+    wait_for_symbol_settled(strategy_client.API_KEY, signal_symbol, 'create_order_delay', create_order_delay)
     # prepare param
     all_usdt = Decimal(get_usdt(req_id=req_id, strategy_client=strategy_client))
     balance = find_balance_by_strategy_id(strategy.strategy_id)
@@ -1273,21 +1529,15 @@ def handle_swing_notification(req_id, strategy, notification):
     logger.info(f"{req_id} - used usdt {usdt}")
 
     logger.info(f"{req_id} - parse entry")
-    signal_entry = round(float(notification['entry']), _price_precision)
+    signal_entry = round(notification.entry, _price_precision)
     logger.info(f"{req_id} - parse side")
-    signal_side = 'SELL' if notification['order'] == 'sell' else 'BUY'
-    logger.info(f"{req_id} - parse long times")
-    signal_long_times = int(notification['strategy']['long']['times'])
-    logger.info(f"{req_id} - parse long stop loss")
-    signal_long_stop_loss = notification['strategy']['long']['stopLoss']
-    logger.info(f"{req_id} - parse long take profit")
-    signal_long_take_profit = notification['strategy']['long']['takeProfit']
-    logger.info(f"{req_id} - parse short times")
-    signal_short_times = int(notification['strategy']['short']['times'])
-    logger.info(f"{req_id} - parse short stop loss")
-    signal_short_stop_loss = notification['strategy']['short']['stopLoss']
-    logger.info(f"{req_id} - parse long take profit")
-    signal_short_take_profit = notification['strategy']['short']['takeProfit']
+    signal_side = 'SELL' if notification.order == 'sell' else 'BUY'
+    signal_long_times = notification.long_times
+    signal_long_stop_loss = notification.long_stop_loss
+    signal_long_take_profit = notification.long_take_profit
+    signal_short_times = notification.short_times
+    signal_short_stop_loss = notification.short_stop_loss
+    signal_short_take_profit = notification.short_take_profit
     raw_quantity = 0 if usdt is None else math.floor(100000 * float(usdt) * percentage / signal_entry) / 100000
 
     # params override by message
@@ -1315,9 +1565,9 @@ def handle_swing_notification(req_id, strategy, notification):
                 float(signal_entry) * (100 + float(signal_short_stop_loss)) / 100), _price_precision)
 
     # params override by message
-    if signal_message_json is not None and 'sl' in signal_message_json:
+    if notification.sl is not None:
         logger.info(f"{req_id} - parse stop loss from message")
-        stop_loss_stop_price = round(float(signal_message_json['sl']), _price_precision)
+        stop_loss_stop_price = round(notification.sl, _price_precision)
 
     take_profit_stop_price = round(
         (float(signal_entry) * (100 + float(signal_long_take_profit)) / 100) if signal_side == 'BUY' else (
@@ -1349,6 +1599,7 @@ def handle_swing_notification(req_id, strategy, notification):
     send_telegram_message(req_id, post_data)
 
 
+@tracer.traced()
 def send_telegram_message(req_id, post_data):
     if not check_api_enable(enable_send_telegram):
         return None
@@ -1392,7 +1643,9 @@ def get_position(req_id, strategy_client, symbol):
         return None
 
     logger.info(f"{req_id} - start get position")
-    positions = strategy_client.futures_account()['positions']
+    # 訂閱 user data stream 的帳戶由記憶體讀取，其他帳戶查詢 REST
+    tracker = account_trackers.ready_for(strategy_client)
+    positions = tracker.get_positions() if tracker else strategy_client.futures_account()['positions']
     target = None
     for position in positions:
         if position['symbol'] == symbol:
@@ -1418,6 +1671,12 @@ def close_position(req_id, strategy_client, symbol, side, quantity):
     # print('cancel_order_response', cancel_order_response)
     if abs(float(quantity)) != 0.0:
         logger.info(f"{req_id} - has position")
+        # 大額平倉分批執行並等待完成，回應彙總成單張訂單的格式
+        parent = run_reduce_execution(client=strategy_client, symbol=symbol, side=side, quantity=quantity)
+        if parent is not None:
+            response = parent.summary()
+            logger.info(f"{req_id} - execution {parent.execution_id} {parent.state}, {response}")
+            return response
         response = strategy_client.futures_create_order(
             symbol=symbol,
             type="MARKET",
@@ -1446,6 +1705,7 @@ def close_position_at_price(req_id, strategy_client, symbol, side, stop_price):
     logger.info(f"{req_id} - {response}")
 
 
+@tracer.traced()
 def create_swing_order(
         req_id,
         strategy_client,
@@ -1548,7 +1808,8 @@ def create_swing_order(
         strategy.save()
         logger.info(f"{req_id} - create_order response 1 {response}")
 
-    time.sleep(2)
+    # 第二批為 reduceOnly 止盈單，需等市價入場成交建立倉位
+    wait_for_order(req_id, strategy_client.API_KEY, 'create_swing_order', 2, client_order_id=str(trade_group_id))
 
     if float(format_decimal(float(quantity_level1), _quantity_precision)) == 0:
         quantity_message = f"Unable to open a position: the quantity becomes 0 after precision adjustment"
@@ -1693,8 +1954,10 @@ def close_grid_order(
             # TODO 判斷是否全部平掉 是的話更新INACTIVE
             # 记录平仓操作
             logger.info(f"{req_id} - Close order response: {response}")
+            return response
     else:
         logger.error(f"{req_id} - Failed to get position info for {notification_symbol}")
+    return None
 
 
 # 排程
@@ -1707,11 +1970,28 @@ def check_all_grid_v2_orders():
     for symbol in v2_symbols:
         check_and_reset_grid_orders(client, symbol)
 
+def sync_order_books():
+    """深度簿維護 ACTIVE grid 策略的交易對，其他交易對閒置後取消訂閱"""
+    try:
+        clients = {}
+        for strategy in strategy_registry.by_type('grid', status='ACTIVE'):
+            if strategy.account and strategy.account.api_key:
+                clients[strategy.symbol] = get_client(strategy.account.api_key, strategy.account.api_secret)
+        added, removed = order_book_cache.sync(clients)
+        if added or removed:
+            logger.info(f"深度簿追蹤更新: 新增 {added}, 取消 {removed}")
+    except Exception as e:
+        logger.error(f"更新深度簿追蹤清單時發生錯誤: {str(e)}")
+
+def reconcile_open_orders():
+    """以 REST 核對本地掛單簿與帳戶持倉"""
+    # 定期核對讓路給下單與訊號處理
+    with rate_limit_governor.priority(LOW):
+        open_order_mirror.reconcile(client)
+        account_trackers.register(api_key, 'main').reconcile(client)
+
+
 def run_schedule():
-    # 每 5 秒運行一次
-    schedule.every(5).seconds.do(handle_webhook_entry_schedule)
-    schedule.every(5).seconds.do(handle_webhook_exit_schedule)
-    
     # 新增每天午夜執行的槓桿率恢復排程
     schedule.every().day.at("00:00").do(recover_all_active_strategy_leverage)
     
@@ -1722,12 +2002,44 @@ def run_schedule():
     # 新增從整點開始每2分鐘檢查網格掛單
     for minute in range(0, 60, 2):
         schedule.every().hour.at(f":{minute:02d}").do(check_all_grid_v2_orders)
+
+    # 每5分鐘核對本地掛單簿，安排在網格檢查之間
+    for minute in range(1, 60, 5):
+        schedule.every().hour.at(f":{minute:02d}").do(reconcile_open_orders)
+
+    # 每5分鐘更新深度簿追蹤清單
+    schedule.every(5).minutes.do(sync_order_books)
     
     while True:
         schedule.run_pending()
         time.sleep(1)
 
 
+# 通知由派發器即時處理，不再由排程輪詢
+notification_dispatcher = NotificationDispatcher(
+    handler=handle_webhook,
+    shards=notification_shards,
+    on_done=webhook_journal.ack,
+    coalesce=coalesce_notifications,
+    on_collapsed=audit_collapsed_notification
+)
+notification_queue_depth = metrics.gauge('notification_queue_depth', '通知佇列深度', ('kind',))
+notification_queue_depth.set_function(lambda: {
+    ('exit',): notification_dispatcher.stats()['exit_depth'],
+    ('entry',): notification_dispatcher.stats()['entry_depth'],
+})
+metrics.counter('notifications_dispatched_total', '已派發通知數量').set_function(
+    lambda: notification_dispatcher.stats()['dispatched'])
+metrics.counter('notifications_collapsed_total', '被合併略過的通知數量').set_function(
+    lambda: notification_dispatcher.stats()['collapsed'])
+metrics.gauge('webhook_journal_pending', 'webhook 日誌中尚未處理完成的記錄數量').set_function(
+    webhook_journal.pending_count)
+recover_journal_notifications()
+webhook_journal.start()
+# 啟動時先追蹤有效策略的深度簿，第一筆訊號不需等待快照
+sync_order_books()
+notification_dispatcher.start()
+
 # 在單獨的線程中運行定時任務
 entry_schedule_thread = threading.Thread(target=run_schedule, daemon=True)
 entry_schedule_thread.start()
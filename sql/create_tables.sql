@@ -168,4 +168,8 @@ COMMENT ON COLUMN public.order_executions.price IS '成交價格';
 COMMENT ON COLUMN public.order_executions.quantity IS '本次成交數量';
 COMMENT ON COLUMN public.order_executions.commission IS '手續費';
 COMMENT ON COLUMN public.order_executions.commission_asset IS '手續費資產類型';
-COMMENT ON COLUMN public.order_executions.realized_pnl IS '已實現盈虧';
\ No newline at end of file
+COMMENT ON COLUMN public.order_executions.realized_pnl IS '已實現盈虧';
+
+-- 網格深度 (每邊掛單數量)
+ALTER TABLE strategies ADD COLUMN grid_depth INT NOT NULL DEFAULT 5;
+COMMENT ON COLUMN strategies.grid_depth IS '網格每邊掛單數量';